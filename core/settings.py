@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 
 import os
 import os
+import json
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -170,3 +171,163 @@ SUBSCRIPTION_LIMITS = {
 }
 
 
+# YOLO micro-batching: кадры от всех запросов собираются в окне
+# YOLO_BATCH_WINDOW_MS (или до YOLO_BATCH_MAX_SIZE) и идут одним predict
+YOLO_BATCH_WINDOW_MS = float(os.getenv('YOLO_BATCH_WINDOW_MS', '10'))
+YOLO_BATCH_MAX_SIZE = int(os.getenv('YOLO_BATCH_MAX_SIZE', '8'))
+
+# Кэш результатов моделей для почти одинаковых кадров (dHash + точный хэш)
+FRAME_CACHE = {
+    'ttl': float(os.getenv('FRAME_CACHE_TTL', '2.0')),  # секунды
+    'max_distance': int(os.getenv('FRAME_CACHE_MAX_DISTANCE', '6')),  # расстояние Хэмминга по dHash (из 64 бит)
+    'max_entries': 32,  # кадров на пользователя
+    'max_users': 1000,
+    'shared': os.getenv('FRAME_CACHE_SHARED', 'False') == 'True',  # один кэш на всех пользователей
+}
+
+# Бэкенд детектора YOLO: 'torch' (ultralytics .pt), 'onnx' (ONNX Runtime) или 'openvino'.
+# Для onnx/openvino модель экспортируется рядом с YOLO_MODEL при первом запуске.
+YOLO_BACKEND = os.getenv('YOLO_BACKEND', 'torch')
+YOLO_MODEL = os.getenv('YOLO_MODEL', 'yolov8n.pt')
+YOLO_IMGSZ = int(os.getenv('YOLO_IMGSZ', '640'))
+YOLO_THREADS = int(os.getenv('YOLO_THREADS', '0'))  # 0 = по числу ядер
+YOLO_QUANTIZE = os.getenv('YOLO_QUANTIZE', 'False') == 'True'  # int8 для onnx/openvino
+
+# WebSocket-сервер: полная детекция YOLO раз в N кадров, между ними — предсказание трекера
+WS_DETECT_EVERY_N = int(os.getenv('WS_DETECT_EVERY_N', '3'))
+
+# Motion gate для потокового режима: YOLO запускается только если кадр заметно
+# изменился (threshold — средняя разница яркости 0..255) или прошлому результату
+# больше max_staleness секунд. Настройки по режимам, 'default' — общие.
+MOTION_GATE = {
+    'default': {'threshold': 4.0, 'max_staleness': 2.0},
+    'navigator': {'threshold': float(os.getenv('MOTION_GATE_THRESHOLD', '4.0')), 'max_staleness': 1.0},
+    'vision': {'enabled': False},
+}
+
+# Угол обзора камеры клиента (градусы) — для bearing/distance в результатах детекции
+CAMERA_HFOV = float(os.getenv('CAMERA_HFOV', '50'))
+CAMERA_VFOV = float(os.getenv('CAMERA_VFOV', '66'))
+
+# Пул процессов для инференса (кадры через shared memory). Пусто — всё в процессе сервера.
+# Пример: {'detect': {'processes': 2, 'threads': 2}, 'caption': {'processes': 1, 'threads': 4}}
+INFERENCE_WORKERS = {}
+
+# Размеры пулов потоков по классам работы (см. vision/executors.py).
+# Стадии разных пулов выполняются параллельно: задержка запроса ~ max стадий, а не сумма.
+MODEL_EXECUTORS = {
+    'decode': 2,
+    'stt': int(os.getenv('STT_WORKERS', '1')),
+    'detect': 2,
+    'caption': int(os.getenv('CAPTION_WORKERS', '1')),
+    'ocr': 1,
+    'tts': 1,
+    'db': 4,
+}
+
+# LLM-шлюз (vision/llm_gateway.py): общие пулы соединений, дедлайн, повторы, хеджирование.
+# LLM_PROVIDERS — JSON-список OpenAI-совместимых провайдеров, например
+# [{"name": "deepseek", "base_url": "https://api.deepseek.com", "model": "deepseek-chat", "api_key_env": "DEEPSEEK_API_KEY"}].
+# Пусто — один провайдер по OPENAI_API_KEY (DeepSeek или OpenRouter), адрес можно подменить через LLM_BASE_URL.
+LLM_PROVIDERS = json.loads(os.getenv('LLM_PROVIDERS', '[]'))
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '20'))  # секунды на весь вызов, включая повторы
+LLM_RETRIES = int(os.getenv('LLM_RETRIES', '2'))
+LLM_HEDGE = os.getenv('LLM_HEDGE', 'False') == 'True'  # второй провайдер, если первый медленнее своего p95
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '20'))
+
+# Кэш ответов LLM (vision/response_cache.py): вопрос + сцена + факты пользователя.
+# semantic — при промахе искать перефраз вопроса (косинус >= similarity) с той же сценой.
+LLM_RESPONSE_CACHE = {
+    'enabled': os.getenv('LLM_RESPONSE_CACHE', 'True') == 'True',
+    'ttl': float(os.getenv('LLM_RESPONSE_CACHE_TTL', '300')),  # секунды
+    'max_entries': 1024,
+    'semantic': True,
+    'similarity': 0.9,
+}
+
+# История чата (vision.models.ChatMessage): window — сколько последних сообщений читать,
+# keep / max_age_days — что оставляет команда prune_chat_messages (по cron)
+CHAT_HISTORY = {
+    'window': 20,
+    'keep': int(os.getenv('CHAT_HISTORY_KEEP', '200')),  # сообщений на пользователя
+    'max_age_days': int(os.getenv('CHAT_HISTORY_MAX_AGE_DAYS', '90')),
+}
+
+# Память фактов пользователя (vision/vector_memory.py). embedder — 'hashing' (без моделей)
+# или имя модели sentence-transformers, например 'paraphrase-multilingual-MiniLM-L12-v2'.
+VECTOR_MEMORY = {
+    'embedder': os.getenv('MEMORY_EMBEDDER', 'hashing'),
+    'min_similarity': float(os.getenv('MEMORY_MIN_SIMILARITY', '0.2')),
+    'retrieval': os.getenv('MEMORY_RETRIEVAL', 'hybrid'),  # 'hybrid' | 'bm25' | 'embedding'
+    'compact_every': 500,  # записей журнала фактов до переноса в снапшот
+    'cache_users': int(os.getenv('MEMORY_CACHE_USERS', '256')),  # загруженных памятей в процессе (LRU)
+    'cache_idle_seconds': 1800,
+}
+
+# Потоковый STT по WebSocket (vision/stt_stream.py): PCM 16 kHz int16 mono бинарными кадрами.
+# silence_ms — пауза, после которой фраза считается законченной; partial_interval — как часто
+# (секунды речи) отдавать промежуточный текст.
+STT_STREAM = {
+    'sample_rate': 16000,
+    'silence_ms': int(os.getenv('STT_SILENCE_MS', '400')),
+    'partial_interval': 0.6,
+    'max_utterance_s': 15.0,
+    'margin_db': 10.0,
+}
+
+# Общий батч Whisper (vision/stt_batching.py): фразы всех пользователей собираются в течение
+# window_ms (или до max_batch) и декодируются одним проходом модели.
+# tiers — beam size по уровню задержки: промежуточный текст, финальная фраза, загруженный файл.
+STT_BATCH = {
+    'window_ms': float(os.getenv('STT_BATCH_WINDOW_MS', '30')),
+    'max_batch': int(os.getenv('STT_BATCH_MAX_SIZE', '8')),
+    'tiers': {
+        'partial': 1,
+        'final': int(os.getenv('STT_FINAL_BEAM_SIZE', '1')),
+        'upload': int(os.getenv('STT_UPLOAD_BEAM_SIZE', '5')),
+    },
+    'language': os.getenv('STT_LANGUAGE') or None,  # None — автоопределение Whisper
+}
+WHISPER_MODEL = os.getenv('WHISPER_MODEL', 'tiny')
+
+# Уровни моделей под нагрузку (vision/tiering.py). Уровни — от лучшего качества к самому
+# быстрому; 'default' — уровень при старте и при выключенном MODEL_TIERING. Под нагрузкой
+# (очередь >= queue_depth или p95 > p95_ms) стадия переходит на уровень быстрее, в простое —
+# обратно. Модели всех уровней загружаются заранее (warm).
+MODEL_TIERING = {
+    'enabled': os.getenv('MODEL_TIERING', 'False') == 'True',
+    'interval': 1.0,  # как часто пересматривать уровни, секунды
+    'warm': True,
+}
+MODEL_TIERS = {
+    'detect': {
+        'tiers': [
+            {'name': 'quality', 'model': os.getenv('YOLO_QUALITY_MODEL', 'yolov8s.pt'), 'imgsz': 640},
+            {'name': 'standard', 'model': YOLO_MODEL, 'imgsz': YOLO_IMGSZ},
+            {'name': 'fast', 'model': YOLO_MODEL, 'imgsz': 320},
+        ],
+        'default': 'standard',
+        'p95_ms': float(os.getenv('TIER_DETECT_P95_MS', '250')),
+        'queue_depth': 8,
+    },
+    'stt': {
+        # beam_size — потолок для уровней задержки STT_BATCH['tiers']; None — без ограничения
+        'tiers': [
+            {'name': 'quality', 'model': os.getenv('WHISPER_QUALITY_MODEL', 'base'), 'beam_size': None},
+            {'name': 'standard', 'model': WHISPER_MODEL, 'beam_size': None},
+            {'name': 'fast', 'model': WHISPER_MODEL, 'beam_size': 1},
+        ],
+        'default': 'standard',
+        'p95_ms': float(os.getenv('TIER_STT_P95_MS', '2000')),
+        'queue_depth': 8,
+    },
+    'caption': {
+        'tiers': [
+            {'name': 'standard', 'max_new_tokens': 50},
+            {'name': 'fast', 'max_new_tokens': 20},
+        ],
+        'default': 'standard',
+        'p95_ms': float(os.getenv('TIER_CAPTION_P95_MS', '1500')),
+        'queue_depth': 2,
+    },
+}
@@ -1,3 +1,4 @@
+import os
 import cv2
 import time
 import logging
@@ -6,6 +7,7 @@ from colorama import Fore, Style
 
 from tts_manager import KaniTTSManager
 from vision_service import VisionSystem
+from vision.motion import MotionGate  # vision_service уже добавил корень проекта в sys.path
 
 # Инициализация цвета
 colorama.init(autoreset=True)
@@ -54,6 +56,12 @@ def main():
     last_scan_time = 0
     SCAN_INTERVAL = 5.0 # Сканируем каждые 5 сек чтобы не болтать без умолку
 
+    # Если сцена не изменилась с прошлого сканирования — YOLO не запускаем
+    motion_gate = MotionGate(
+        threshold=float(os.getenv("MOTION_GATE_THRESHOLD", "4.0")),
+        max_staleness=float(os.getenv("MOTION_GATE_MAX_STALENESS", "30.0")),
+    )
+
     try:
         while True:
             ret, frame = cap.read()
@@ -78,8 +86,13 @@ def main():
                 if tts.is_busy() and not manual_trigger:
                     continue
 
-                logger.info(Fore.YELLOW + "🔍 Сканирование...")
                 last_scan_time = current_time
+
+                if not manual_trigger and not motion_gate.should_run(frame):
+                    logger.info("Сцена не изменилась, пропускаем сканирование.")
+                    continue
+
+                logger.info(Fore.YELLOW + "🔍 Сканирование...")
                 
                 # 1. Vision
                 objects = vision.detect(frame)
@@ -104,6 +117,7 @@ def main():
         cap.release()
         cv2.destroyAllWindows()
         tts.stop()
+        logger.info(f"Motion gate: {motion_gate.stats} (пропущено {motion_gate.skip_rate:.0%})")
         logger.info("Система выключена.")
 
 if __name__ == "__main__":
@@ -1,21 +1,29 @@
+import os
+import sys
 import cv2
 import logging
-from ultralytics import YOLO
+
+# Общие бэкенды детектора (torch / onnx / openvino) лежат в пакете vision
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vision.detectors import load_detector
 
 logger = logging.getLogger(__name__)
 
 class VisionSystem:
-    def __init__(self, model_path="../yolov8n.pt"):
+    def __init__(self, model_path="../yolov8n.pt", backend=None):
         self.model = None
+        # YOLO_BACKEND=onnx|openvino даёт заметно более быстрый CPU-инференс
+        backend = backend or os.getenv("YOLO_BACKEND", "torch")
+        threads = int(os.getenv("YOLO_THREADS", "0"))
         try:
-            logger.info(f"👁️ Загрузка YOLO из {model_path}...")
-            self.model = YOLO(model_path)
+            logger.info(f"👁️ Загрузка YOLO ({backend}) из {model_path}...")
+            self.model = load_detector(backend, model_path, threads=threads)
             logger.info("✅ Vision System готова")
         except Exception as e:
             logger.error(f"❌ Ошибка YOLO: {e}")
             # Try loading generic if local fails
             try:
-                self.model = YOLO("yolov8n.pt")
+                self.model = load_detector(backend, "yolov8n.pt", threads=threads)
             except:
                 pass
 
@@ -27,7 +35,7 @@ class VisionSystem:
             return []
             
         # Run inference
-        results = self.model(frame, verbose=False, conf=0.5)
+        results = self.model.predict(frame, verbose=False, conf=0.5)
         
         detected_objects = []
         for r in results:
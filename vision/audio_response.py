@@ -0,0 +1,48 @@
+"""
+Ответы с речью: согласование аудиоформата и бинарная выдача.
+
+Клиент выбирает формат полем `audio_format` ('opus' / 'mp3' / 'wav') или
+заголовком Accept (audio/ogg, audio/mpeg, audio/wav; q учитывается).
+Если формат согласован, ответ — multipart/mixed: JSON-часть с метаданными и
+бинарная аудио-часть без base64. Клиенты без согласования получают прежний
+JSON с полем `audio` в base64.
+"""
+import base64
+import json
+import uuid
+
+from django.http import HttpResponse, JsonResponse
+
+from .tts_system.audio import AUDIO_FORMATS, format_from_accept, normalize_format
+
+
+def negotiate_audio_format(request):
+    """Формат из поля audio_format или заголовка Accept; None — клиент ждёт JSON с base64."""
+    requested = request.POST.get('audio_format') or request.GET.get('audio_format')
+    if requested:
+        return normalize_format(requested)
+    return format_from_accept(request.headers.get('Accept', ''))
+
+
+def speech_response(payload: dict, audio: bytes, audio_format: str, binary: bool):
+    """
+    payload — JSON-метаданные ответа (message, detected_objects, ...).
+    binary  — клиент согласовал формат: отдаём multipart, иначе JSON с base64.
+    """
+    if not binary or not audio:
+        payload['audio'] = base64.b64encode(audio).decode('utf-8') if audio else None
+        return JsonResponse(payload)
+
+    mime = AUDIO_FORMATS[audio_format].mime if audio_format in AUDIO_FORMATS else 'application/octet-stream'
+    payload = dict(payload, audio_format=audio_format, audio_mime=mime, audio_bytes=len(audio))
+    boundary = uuid.uuid4().hex
+    meta = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    body = b''.join([
+        f'--{boundary}\r\nContent-Type: application/json; charset=utf-8\r\n'
+        f'Content-Length: {len(meta)}\r\n\r\n'.encode('ascii'),
+        meta,
+        f'\r\n--{boundary}\r\nContent-Type: {mime}\r\nContent-Length: {len(audio)}\r\n\r\n'.encode('ascii'),
+        audio,
+        f'\r\n--{boundary}--\r\n'.encode('ascii'),
+    ])
+    return HttpResponse(body, content_type=f'multipart/mixed; boundary={boundary}')
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class DetectionBatcher:
+    """
+    Общая очередь детекции YOLO для всех запросов процесса.
+
+    Кадры от /api/detect/, /api/smart-analyze/ и WebSocket-сервера складываются
+    в одну очередь. Фоновый поток собирает их в течение `window_ms` (или пока не
+    наберётся `max_batch`), делает ОДИН батчевый model.predict и раздаёт
+    результаты обратно ожидающим вызовам. Кадры для разных уровней
+    (модель / imgsz, см. vision/tiering.py) идут отдельными predict в том же окне.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, model_getter, window_ms=10.0, max_batch=8, conf=0.3, iou=0.45):
+        self._model_getter = model_getter
+        self.window = max(window_ms, 0.0) / 1000.0
+        self.max_batch = max(int(max_batch), 1)
+        self.conf = conf
+        self.iou = iou
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._stats = {"batches": 0, "frames": 0, "max_batch_seen": 0}
+
+        self._thread = threading.Thread(target=self._run, name="yolo-batcher", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def get(cls):
+        """Singleton, настроенный из settings (YOLO_BATCH_*)."""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    from django.conf import settings
+                    from .services import LocalBrain
+
+                    cls._instance = cls(
+                        LocalBrain.get_yolo_model,
+                        window_ms=getattr(settings, 'YOLO_BATCH_WINDOW_MS', 10.0),
+                        max_batch=getattr(settings, 'YOLO_BATCH_MAX_SIZE', 8),
+                    )
+        return cls._instance
+
+    def submit(self, image, model=None, imgsz=None) -> Future:
+        """
+        Ставит кадр (BGR ndarray) в очередь. Возвращает Future с ultralytics Results.
+        model / imgsz — уровень детектора; None — YOLO_MODEL и размер модели.
+        """
+        future = Future()
+        self._queue.put((image, model, imgsz, future))
+        return future
+
+    def detect(self, image, model=None, imgsz=None):
+        """Блокирующий вызов для синхронного кода."""
+        return self.submit(image, model, imgsz).result()
+
+    async def detect_async(self, image, model=None, imgsz=None):
+        """Ожидание результата из корутины без занятия потока."""
+        return await asyncio.wrap_future(self.submit(image, model, imgsz))
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["avg_batch"] = stats["frames"] / stats["batches"] if stats["batches"] else 0.0
+        stats["queued"] = self._queue.qsize()
+        return stats
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._process(batch)
+
+    def _process(self, batch):
+        # Отменённые запросы не тратят место в батче
+        batch = [item for item in batch if item[3].set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        groups = {}
+        for item in batch:
+            groups.setdefault((item[1], item[2]), []).append(item)
+
+        for (model_path, imgsz), items in groups.items():
+            options = {'imgsz': imgsz} if imgsz else {}
+            try:
+                model = self._model_getter(model_path)
+                if model is None:
+                    raise RuntimeError("YOLO model is not loaded")
+                results = model.predict([image for image, *_ in items], conf=self.conf, iou=self.iou,
+                                        verbose=False, **options)
+            except Exception as e:
+                logger.error(f"YOLO batch error ({len(items)} frames): {e}")
+                for *_, future in items:
+                    future.set_exception(e)
+                continue
+
+            for (*_, future), result in zip(items, results):
+                future.set_result(result)
+
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["frames"] += len(batch)
+            self._stats["max_batch_seen"] = max(self._stats["max_batch_seen"], len(batch))
@@ -2,7 +2,6 @@ import logging
 from datetime import datetime
 from .models import VisionUser
 from .vector_memory import VectorMemory
-import os
 
 logger = logging.getLogger(__name__)
 
@@ -12,10 +11,10 @@ class CAGSystem:
     """
     def __init__(self, user: VisionUser):
         self.user = user
-        # Path for vector memory storage
-        base_path = os.path.dirname(os.path.abspath(__file__))
-        storage_path = os.path.join(base_path, "..", "data", "memory", str(self.user.id))
-        self.vector_memory = VectorMemory(storage_path)
+        # Память из общего LRU процесса (data/memory/<id>), без чтения файлов на каждый запрос
+        self.vector_memory = VectorMemory.for_user(self.user.id)
+        # Факты из памяти, попавшие в последний промпт (часть ключа кэша ответов)
+        self.rag_context = ""
         
         # Инициализация фактов, если пусто
         if not self.user.facts:
@@ -77,6 +76,7 @@ class CAGSystem:
         rag_context = ""
         if user_query:
             rag_context = self.vector_memory.get_context_string(user_query)
+        self.rag_context = rag_context
         
         # 2. Личность и Ситуация
         prompt = (
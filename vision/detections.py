@@ -0,0 +1,154 @@
+"""
+Структурированный результат детекции.
+
+Хранит все объекты кадра в NumPy-массивах (нормализованные боксы, уверенность,
+класс) и считает пространственные признаки векторно, без цикла по боксам:
+
+    bearing  — горизонтальный угол на объект в градусах (минус — слева, плюс — справа),
+               клиент использует его для панорамирования пространственного звука
+    distance — грубая оценка расстояния в метрах по высоте бокса и типичной
+               высоте объекта класса (pinhole-модель камеры); None, если класс неизвестен
+"""
+import logging
+import math
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Угол обзора камеры телефона в портретной ориентации (градусы)
+DEFAULT_HFOV = 50.0
+DEFAULT_VFOV = 66.0
+
+# Типичная высота объектов классов COCO в метрах
+CLASS_HEIGHTS_M = {
+    'person': 1.7,
+    'bicycle': 1.0,
+    'car': 1.5,
+    'motorcycle': 1.2,
+    'bus': 3.2,
+    'train': 3.8,
+    'truck': 3.0,
+    'traffic light': 0.9,
+    'fire hydrant': 0.8,
+    'stop sign': 0.75,
+    'parking meter': 1.3,
+    'bench': 0.85,
+    'bird': 0.25,
+    'cat': 0.3,
+    'dog': 0.55,
+    'horse': 1.6,
+    'sheep': 0.8,
+    'cow': 1.4,
+    'backpack': 0.45,
+    'umbrella': 1.0,
+    'handbag': 0.3,
+    'suitcase': 0.65,
+    'sports ball': 0.22,
+    'skateboard': 0.12,
+    'bottle': 0.25,
+    'cup': 0.1,
+    'chair': 0.9,
+    'couch': 0.85,
+    'potted plant': 0.6,
+    'bed': 0.6,
+    'dining table': 0.75,
+    'toilet': 0.75,
+    'tv': 0.6,
+    'laptop': 0.25,
+    'cell phone': 0.15,
+    'microwave': 0.3,
+    'oven': 0.85,
+    'sink': 0.2,
+    'refrigerator': 1.8,
+    'book': 0.22,
+    'clock': 0.3,
+    'vase': 0.3,
+}
+
+
+class Detections:
+    """
+    Объекты одного кадра.
+
+    xyxy — (N, 4) float32, нормализованные [0..1] координаты
+    conf — (N,) float32
+    cls  — (N,) int32, индексы классов в `names`
+    """
+
+    def __init__(self, xyxy, conf, cls, names, hfov=DEFAULT_HFOV, vfov=DEFAULT_VFOV):
+        self.xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        self.conf = np.asarray(conf, dtype=np.float32).reshape(-1)
+        self.cls = np.asarray(cls, dtype=np.int32).reshape(-1)
+        self.names = names
+        self.hfov = hfov
+        self.vfov = vfov
+
+    @classmethod
+    def empty(cls, names=None, **kwargs):
+        return cls(np.zeros((0, 4)), np.zeros(0), np.zeros(0), names or {}, **kwargs)
+
+    @classmethod
+    def from_result(cls, result, **kwargs):
+        """Из ultralytics Results или DetectorResult (ONNX/OpenVINO)."""
+        if result is None:
+            return cls.empty(**kwargs)
+        if not len(result.boxes):
+            return cls.empty(result.names, **kwargs)
+        h, w = result.orig_shape[:2]
+        xyxy = _as_numpy(result.boxes.xyxy).astype(np.float32) / np.array([w, h, w, h], dtype=np.float32)
+        return cls(xyxy, _as_numpy(result.boxes.conf), _as_numpy(result.boxes.cls), result.names, **kwargs)
+
+    def __len__(self):
+        return len(self.cls)
+
+    @property
+    def labels(self):
+        return [self.names[int(c)] for c in self.cls]
+
+    def unique_labels(self):
+        """Уникальные классы, от самого уверенного к наименее уверенному."""
+        order = np.argsort(-self.conf, kind='stable')
+        return list(dict.fromkeys(self.names[int(c)] for c in self.cls[order]))
+
+    @property
+    def centers(self):
+        return np.stack([(self.xyxy[:, 0] + self.xyxy[:, 2]) / 2, (self.xyxy[:, 1] + self.xyxy[:, 3]) / 2], axis=1)
+
+    @property
+    def bearing(self):
+        """Горизонтальный угол на центр бокса, градусы. 0 — прямо по курсу."""
+        return (self.centers[:, 0] - 0.5) * self.hfov
+
+    @property
+    def distance(self):
+        """Оценка расстояния в метрах (NaN для классов без известной высоты)."""
+        heights = np.array([CLASS_HEIGHTS_M.get(name, np.nan) for name in self.labels], dtype=np.float32)
+        box_h = np.maximum(self.xyxy[:, 3] - self.xyxy[:, 1], 1e-3)
+        # d = H * f / h_px, f = (img_h / 2) / tan(vfov / 2), h_px = box_h * img_h
+        return heights / (2.0 * box_h * math.tan(math.radians(self.vfov) / 2))
+
+    def to_json(self):
+        """JSON-представление: список объектов, отсортированный по уверенности."""
+        if not len(self):
+            return []
+        order = np.argsort(-self.conf, kind='stable')
+        labels, bearing, distance = self.labels, self.bearing, self.distance
+        xyxy = np.round(self.xyxy.astype(np.float64), 4).tolist()
+        return [
+            {
+                'label': labels[i],
+                'confidence': round(float(self.conf[i]), 3),
+                'box': xyxy[i],
+                'bearing': round(float(bearing[i]), 1),
+                'distance': None if np.isnan(distance[i]) else round(float(distance[i]), 1),
+            }
+            for i in order
+        ]
+
+
+def _as_numpy(values):
+    # ultralytics отдаёт torch-тензоры, ONNX/OpenVINO бэкенды — уже NumPy
+    if hasattr(values, "cpu"):
+        values = values.cpu().numpy()
+    return np.asarray(values)
@@ -0,0 +1,303 @@
+"""
+Бэкенды детектора YOLO.
+
+    torch    — ultralytics YOLO(.pt), как раньше
+    onnx     — ONNX Runtime (опционально int8-квантованная модель)
+    openvino — OpenVINO IR
+
+Все бэкенды отдают тот же API, что и ultralytics: `predict(...)` возвращает
+список результатов с `boxes.xyxy / boxes.conf / boxes.cls` и `names`.
+Модуль не зависит от Django — его использует и smart_glasses.
+"""
+import ast
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "onnx", "openvino")
+# Сдвиг боксов по классам в NMS: больше любой стороны кадра (как max_wh в ultralytics)
+MAX_WH = 7680
+
+
+class DetectorBoxes:
+    """Аналог ultralytics Boxes на NumPy-массивах."""
+
+    def __init__(self, xyxy: np.ndarray, conf: np.ndarray, cls: np.ndarray):
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls = cls
+
+    def __len__(self):
+        return len(self.cls)
+
+
+class DetectorResult:
+    """Аналог ultralytics Results для одного кадра."""
+
+    def __init__(self, boxes: DetectorBoxes, names: dict, orig_shape):
+        self.boxes = boxes
+        self.names = names
+        self.orig_shape = orig_shape
+
+
+class _ExportedDetector:
+    """Общая пред- и постобработка для экспортированных YOLOv8 (ONNX / OpenVINO)."""
+
+    def __init__(self, names: dict, imgsz: int = 640):
+        self.names = names
+        self.imgsz = imgsz
+
+    def __call__(self, source, **kwargs):
+        return self.predict(source, **kwargs)
+
+    def predict(self, source, conf=0.25, iou=0.45, verbose=False, imgsz=None, **kwargs):
+        images = source if isinstance(source, (list, tuple)) else [source]
+        size = imgsz or self.imgsz
+
+        batch, metas = [], []
+        for image in images:
+            tensor, meta = _letterbox(image, size)
+            batch.append(tensor)
+            metas.append(meta)
+
+        outputs = self._infer(np.stack(batch))
+        return [
+            self._postprocess(output, meta, image.shape[:2], conf, iou)
+            for output, meta, image in zip(outputs, metas, images)
+        ]
+
+    def _infer(self, batch: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def _postprocess(self, output, meta, orig_shape, conf_thres, iou_thres):
+        # output: (4 + num_classes, N) — cx, cy, w, h + скоры классов
+        preds = output.T
+        scores = preds[:, 4:]
+        cls = scores.argmax(axis=1)
+        conf = scores[np.arange(len(scores)), cls]
+
+        keep = conf > conf_thres
+        preds, cls, conf = preds[keep], cls[keep], conf[keep]
+
+        boxes = np.empty((len(preds), 4), dtype=np.float32)
+        boxes[:, 0] = preds[:, 0] - preds[:, 2] / 2
+        boxes[:, 1] = preds[:, 1] - preds[:, 3] / 2
+        boxes[:, 2] = preds[:, 0] + preds[:, 2] / 2
+        boxes[:, 3] = preds[:, 1] + preds[:, 3] / 2
+
+        keep = nms(boxes, conf, iou_thres, classes=cls)
+        boxes, conf, cls = boxes[keep], conf[keep], cls[keep]
+
+        # Обратно из letterbox-координат в координаты исходного кадра
+        ratio, pad_x, pad_y = meta
+        boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad_x) / ratio
+        boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad_y) / ratio
+        h, w = orig_shape
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, w)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, h)
+
+        return DetectorResult(
+            DetectorBoxes(boxes, conf.astype(np.float32), cls.astype(np.float32)),
+            self.names,
+            orig_shape,
+        )
+
+
+class OnnxDetector(_ExportedDetector):
+    def __init__(self, model_path: str, imgsz: int = 640, threads: int = 0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        super().__init__(_parse_names(metadata.get("names")), int(_parse_imgsz(metadata.get("imgsz"), imgsz)))
+
+    def _infer(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+class OpenVinoDetector(_ExportedDetector):
+    def __init__(self, model_dir: str, imgsz: int = 640, threads: int = 0):
+        import openvino as ov
+
+        core = ov.Core()
+        xml_path = next(
+            os.path.join(model_dir, f) for f in os.listdir(model_dir) if f.endswith(".xml")
+        )
+        config = {"PERFORMANCE_HINT": "LATENCY"}
+        if threads:
+            config["INFERENCE_NUM_THREADS"] = threads
+        self.model = core.compile_model(core.read_model(xml_path), "CPU", config)
+
+        names, size = {}, imgsz
+        metadata_path = os.path.join(model_dir, "metadata.yaml")
+        if os.path.exists(metadata_path):
+            import yaml
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                metadata = yaml.safe_load(f) or {}
+            names = metadata.get("names", {})
+            size = _parse_imgsz(metadata.get("imgsz"), imgsz)
+        super().__init__(names, int(size))
+
+    def _infer(self, batch):
+        return self.model(batch)[self.model.output(0)]
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_thres: float, classes: np.ndarray = None) -> np.ndarray:
+    """
+    Векторизованный NMS. Если заданы classes, боксы разных классов не подавляют
+    друг друга (сдвиг координат на class_id * MAX_WH).
+    Возвращает индексы оставленных боксов по убыванию score.
+    """
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    if classes is not None:
+        # Сдвиг должен превышать весь размах координат: неклиппированные боксы
+        # letterbox бывают и отрицательными, поэтому boxes.max() не годится
+        max_wh = max(MAX_WH, float(np.abs(boxes).max()) * 2 + 1)
+        offset = classes.astype(np.float32)[:, None] * max_wh
+        boxes = boxes + offset
+
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = (np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest])).clip(0)
+        h = (np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest])).clip(0)
+        inter = w * h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_thres]
+    return np.array(keep, dtype=np.int64)
+
+
+def export_model(model_path: str, backend: str, imgsz: int = 640, quantize: bool = False) -> str:
+    """
+    Экспортирует .pt в формат бэкенда (если ещё не экспортирован) и возвращает путь.
+    Повторный запуск берёт уже готовый файл рядом с .pt.
+    """
+    stem, _ = os.path.splitext(model_path)
+    if backend == "onnx":
+        onnx_path = f"{stem}.onnx"
+        if not os.path.exists(onnx_path):
+            from ultralytics import YOLO
+            logger.info(f"⏳ Экспорт {model_path} в ONNX...")
+            onnx_path = YOLO(model_path).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+        if not quantize:
+            return onnx_path
+
+        int8_path = f"{stem}.int8.onnx"
+        if not os.path.exists(int8_path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            logger.info("⏳ int8-квантование ONNX модели...")
+            quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QUInt8)
+            _copy_onnx_metadata(onnx_path, int8_path)
+        return int8_path
+
+    if backend == "openvino":
+        ov_dir = f"{stem}_openvino_model"
+        if not os.path.isdir(ov_dir):
+            from ultralytics import YOLO
+            logger.info(f"⏳ Экспорт {model_path} в OpenVINO IR...")
+            ov_dir = YOLO(model_path).export(format="openvino", imgsz=imgsz, dynamic=True, int8=quantize)
+        return ov_dir
+
+    return model_path
+
+
+def load_detector(backend: str = "torch", model_path: str = "yolov8n.pt", imgsz: int = 640,
+                  threads: int = 0, quantize: bool = False):
+    """
+    Загружает детектор выбранного бэкенда. При ошибке откатывается на PyTorch,
+    чтобы сервер не остался без детекции.
+    """
+    if backend not in BACKENDS:
+        logger.warning(f"Unknown YOLO backend '{backend}', using torch")
+        backend = "torch"
+
+    if backend != "torch":
+        try:
+            path = export_model(model_path, backend, imgsz=imgsz, quantize=quantize)
+            if backend == "onnx":
+                detector = OnnxDetector(path, imgsz=imgsz, threads=threads)
+            else:
+                detector = OpenVinoDetector(path, imgsz=imgsz, threads=threads)
+            logger.info(f"✅ YOLO ({backend}) загружен: {path}")
+            return detector
+        except Exception as e:
+            logger.error(f"❌ YOLO backend '{backend}' failed: {e}. Falling back to torch.")
+
+    from ultralytics import YOLO
+    return YOLO(model_path)
+
+
+def load_detector_from_settings(model_path: str = None):
+    """load_detector с параметрами из Django settings (YOLO_*)."""
+    from django.conf import settings
+    return load_detector(
+        backend=getattr(settings, "YOLO_BACKEND", "torch"),
+        model_path=model_path or getattr(settings, "YOLO_MODEL", "yolov8n.pt"),
+        imgsz=getattr(settings, "YOLO_IMGSZ", 640),
+        threads=getattr(settings, "YOLO_THREADS", 0),
+        quantize=getattr(settings, "YOLO_QUANTIZE", False),
+    )
+
+
+def _letterbox(image: np.ndarray, size: int):
+    """BGR кадр -> NCHW float32 RGB с сохранением пропорций (как ultralytics LetterBox)."""
+    import cv2
+    h, w = image.shape[:2]
+    ratio = min(size / h, size / w)
+    new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+    if (new_w, new_h) != (w, h):
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+
+    pad_x, pad_y = (size - new_w) / 2, (size - new_h) / 2
+    top, left = int(round(pad_y - 0.1)), int(round(pad_x - 0.1))
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    canvas[top:top + new_h, left:left + new_w] = image
+
+    tensor = canvas[:, :, ::-1].transpose(2, 0, 1).astype(np.float32) / 255.0
+    return np.ascontiguousarray(tensor), (ratio, left, top)
+
+
+def _parse_names(raw) -> dict:
+    if isinstance(raw, dict):
+        return {int(k): v for k, v in raw.items()}
+    if not raw:
+        return {}
+    return {int(k): v for k, v in ast.literal_eval(raw).items()}
+
+
+def _parse_imgsz(raw, default):
+    if raw is None:
+        return default
+    if isinstance(raw, str):
+        raw = ast.literal_eval(raw)
+    if isinstance(raw, (list, tuple)):
+        return max(raw)
+    return raw
+
+
+def _copy_onnx_metadata(src: str, dst: str):
+    """quantize_dynamic теряет metadata_props (names, imgsz) — переносим их."""
+    import onnx
+    source, target = onnx.load(src), onnx.load(dst)
+    del target.metadata_props[:]
+    target.metadata_props.extend(source.metadata_props)
+    onnx.save(target, dst)
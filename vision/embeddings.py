@@ -0,0 +1,112 @@
+"""
+Лёгкие текстовые эмбеддинги без внешних моделей.
+
+HashingEmbedder раскладывает текст на символьные n-граммы слов и хэширует их
+в вектор фиксированной длины (feature hashing). Это не семантика уровня
+sentence-transformers, но перефразы с теми же корнями слов («что впереди» /
+«что там впереди?») получают близкие векторы, а считается это за микросекунды.
+
+SentenceEmbedder — локальная модель sentence-transformers (опциональная
+зависимость) для памяти пользователя, если она установлена.
+"""
+import logging
+import re
+import threading
+import zlib
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbedder:
+    def __init__(self, dim: int = 256, ngram: int = 3):
+        self.dim = dim
+        self.ngram = ngram
+        # Имя для проверки, что сохранённые векторы посчитаны тем же эмбеддером
+        self.name = f"hashing-{dim}-{ngram}"
+
+    def features(self, text: str):
+        for word in _WORD.findall(text.lower().replace('ё', 'е')):
+            word = f"<{word}>"
+            if len(word) <= self.ngram:
+                yield word
+                continue
+            for i in range(len(word) - self.ngram + 1):
+                yield word[i:i + self.ngram]
+
+    def embed(self, text: str) -> np.ndarray:
+        """Единичный float32-вектор длины dim (нулевой для пустого текста)."""
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in self.features(text):
+            # crc32 стабилен между процессами (в отличие от hash())
+            h = zlib.crc32(feature.encode('utf-8'))
+            vector[h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def embed_batch(self, texts) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([self.embed(text) for text in texts])
+
+
+class SentenceEmbedder:
+    """Модель sentence-transformers из ModelRegistry; векторы нормированы."""
+
+    def __init__(self, model_name: str):
+        from .registry import ModelRegistry
+
+        self.name = model_name
+        self._registry_name = f"sentence:{model_name}"
+        if not ModelRegistry.is_registered(self._registry_name):
+            ModelRegistry.register(self._registry_name, lambda: _load_sentence_model(model_name))
+        model = ModelRegistry.get(self._registry_name)
+        if model is None:
+            raise RuntimeError(f"Sentence model '{model_name}' is not available")
+        self.dim = model.get_sentence_embedding_dimension()
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.embed_batch([text])[0]
+
+    def embed_batch(self, texts) -> np.ndarray:
+        from .registry import ModelRegistry
+
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        model = ModelRegistry.get(self._registry_name)
+        vectors = model.encode(list(texts), normalize_embeddings=True, convert_to_numpy=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+
+def _load_sentence_model(model_name):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name, device="cpu")
+
+
+_embedders = {}
+_embedders_lock = threading.Lock()
+
+
+def get_embedder(spec: str = "hashing"):
+    """
+    Общий эмбеддер процесса: 'hashing' или имя модели sentence-transformers.
+    Если модель не загружается (нет пакета или весов) — HashingEmbedder.
+    """
+    spec = spec or "hashing"
+    with _embedders_lock:
+        embedder = _embedders.get(spec)
+        if embedder is None:
+            if spec == "hashing":
+                # 1024 измерения: на коротких фразах меньше коллизий хэшей, чем у 256
+                embedder = HashingEmbedder(dim=1024)
+            else:
+                try:
+                    embedder = SentenceEmbedder(spec)
+                except Exception as e:
+                    logger.warning(f"Sentence embedder '{spec}' unavailable ({e}), using hashing embedder")
+                    embedder = HashingEmbedder(dim=1024)
+            _embedders[spec] = embedder
+        return embedder
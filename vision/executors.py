@@ -0,0 +1,107 @@
+"""
+Именованные пулы потоков для модельных стадий.
+
+sync_to_async по умолчанию (thread_sensitive=True) выполняет ВСЁ в одном потоке,
+поэтому STT, YOLO и BLIP внутри asyncio.gather шли строго друг за другом.
+Здесь у каждого класса работы свой ограниченный пул (stt, detect, caption, ocr,
+db, ...), стадии разных классов действительно выполняются параллельно, а по
+каждому пулу видно глубину очереди и время ожидания.
+
+Размеры пулов — settings.MODEL_EXECUTORS, например {'stt': 1, 'caption': 1, 'db': 4}.
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXECUTORS = {'decode': 2, 'stt': 1, 'detect': 2, 'caption': 1, 'ocr': 1, 'tts': 1, 'db': 4}
+
+
+class NamedExecutor:
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-worker")
+        self._lock = threading.Lock()
+        self._stats = {
+            "submitted": 0, "started": 0, "completed": 0, "failed": 0,
+            "max_queue_depth": 0, "wait_seconds": 0.0, "run_seconds": 0.0,
+        }
+
+    def submit(self, fn, *args, **kwargs):
+        enqueued = time.perf_counter()
+        with self._lock:
+            self._stats["submitted"] += 1
+            depth = self._stats["submitted"] - self._stats["started"]
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], depth)
+        return self._pool.submit(self._call, enqueued, fn, args, kwargs)
+
+    async def run(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    @property
+    def queue_depth(self) -> int:
+        with self._lock:
+            return self._stats["submitted"] - self._stats["started"]
+
+    @property
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = stats["submitted"] - stats["started"]
+        stats["in_flight"] = stats["started"] - stats["completed"] - stats["failed"]
+        stats["max_workers"] = self.max_workers
+        done = stats["completed"] + stats["failed"]
+        stats["avg_wait_ms"] = round(stats["wait_seconds"] / stats["started"] * 1000, 1) if stats["started"] else 0.0
+        stats["avg_run_ms"] = round(stats["run_seconds"] / done * 1000, 1) if done else 0.0
+        stats["wait_seconds"] = round(stats["wait_seconds"], 3)
+        stats["run_seconds"] = round(stats["run_seconds"], 3)
+        return stats
+
+    def _call(self, enqueued, fn, args, kwargs):
+        started = time.perf_counter()
+        with self._lock:
+            self._stats["started"] += 1
+            self._stats["wait_seconds"] += started - enqueued
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            if self.name == 'db':
+                # Как в конце обычного запроса: закрываем отслужившие соединения этого потока
+                from django.db import close_old_connections
+                close_old_connections()
+            with self._lock:
+                self._stats["completed" if ok else "failed"] += 1
+                self._stats["run_seconds"] += time.perf_counter() - started
+
+
+class ModelExecutors:
+    _executors = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, name: str) -> NamedExecutor:
+        executor = cls._executors.get(name)
+        if executor is not None:
+            return executor
+        with cls._lock:
+            if name not in cls._executors:
+                from django.conf import settings
+                sizes = dict(DEFAULT_EXECUTORS, **getattr(settings, 'MODEL_EXECUTORS', {}))
+                cls._executors[name] = NamedExecutor(name, sizes.get(name, 1))
+            return cls._executors[name]
+
+    @classmethod
+    def stats(cls):
+        return {name: executor.stats for name, executor in list(cls._executors.items())}
+
+
+async def run_in(name: str, fn, *args, **kwargs):
+    """Выполняет синхронную функцию в пуле `name` и ждёт результат."""
+    return await ModelExecutors.get(name).run(fn, *args, **kwargs)
@@ -0,0 +1,98 @@
+import hashlib
+import logging
+from functools import cached_property
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Frame:
+    """
+    Кадр, декодированный ОДИН раз.
+
+    YOLO, BLIP и EasyOCR берут из него нужное им представление, а производные
+    копии (RGB, PIL, CLAHE, grayscale) считаются лениво и кэшируются на объекте.
+    Так один запрос больше не декодирует/перекодирует JPEG по нескольку раз.
+    """
+
+    def __init__(self, bgr: np.ndarray, content_hash: str = None):
+        self.bgr = bgr
+        self._content_hash = content_hash
+
+    @classmethod
+    def from_bytes(cls, data: bytes, max_dim: int = None):
+        """Декодирует байты изображения. None, если это не картинка."""
+        import cv2
+        nparr = np.frombuffer(data, np.uint8)
+        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        if img is None:
+            return None
+        return cls(_fit(img, max_dim), content_hash=hashlib.blake2b(data, digest_size=16).hexdigest())
+
+    @classmethod
+    def ensure(cls, image, max_dim: int = None):
+        """Принимает Frame, байты или BGR ndarray и возвращает Frame (или None)."""
+        if isinstance(image, Frame):
+            return image
+        if isinstance(image, np.ndarray):
+            return cls(_fit(image, max_dim))
+        if image is None:
+            return None
+        return cls.from_bytes(bytes(image), max_dim=max_dim)
+
+    @property
+    def shape(self):
+        return self.bgr.shape
+
+    @cached_property
+    def rgb(self) -> np.ndarray:
+        import cv2
+        return cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB)
+
+    @cached_property
+    def pil(self):
+        from PIL import Image
+        return Image.fromarray(self.rgb)
+
+    @cached_property
+    def gray(self) -> np.ndarray:
+        import cv2
+        return cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY)
+
+    @property
+    def content_hash(self) -> str:
+        """Точный хэш содержимого (исходных байт, если кадр пришёл из них)."""
+        if self._content_hash is None:
+            self._content_hash = hashlib.blake2b(np.ascontiguousarray(self.bgr).data, digest_size=16).hexdigest()
+        return self._content_hash
+
+    @cached_property
+    def dhash(self) -> int:
+        """64-битный difference hash по уменьшенному grayscale (9x8) — устойчив к шуму и сжатию."""
+        import cv2
+        small = cv2.resize(self.gray, (9, 8), interpolation=cv2.INTER_AREA)
+        bits = small[:, 1:] > small[:, :-1]
+        return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+    @cached_property
+    def clahe(self) -> np.ndarray:
+        """BGR с выравниванием контраста по яркости (CLAHE) — вход для YOLO."""
+        import cv2
+        lab = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2LAB)
+        l, a, b = cv2.split(lab)
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+        l = clahe.apply(l)
+        return cv2.cvtColor(cv2.merge([l, a, b]), cv2.COLOR_LAB2BGR)
+
+
+def _fit(img: np.ndarray, max_dim: int = None) -> np.ndarray:
+    """Уменьшает изображение так, чтобы большая сторона была не больше max_dim."""
+    if not max_dim:
+        return img
+    h, w = img.shape[:2]
+    if max(h, w) <= max_dim:
+        return img
+    import cv2
+    scale = max_dim / max(h, w)
+    return cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
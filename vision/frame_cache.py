@@ -0,0 +1,158 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+MISS = object()
+# Закэшированный «пустой» результат (OCR не нашёл текста): в кэше None не отличить от отсутствия
+EMPTY = object()
+
+
+class FrameResultCache:
+    """
+    Кэш результатов моделей (YOLO / BLIP / OCR) для почти одинаковых кадров.
+
+    Ключ — точный хэш содержимого кадра плюс перцептивный dHash. Если точного
+    совпадения нет, берётся ближайший кадр с расстоянием Хэмминга по dHash не
+    больше `max_distance`. Записи живут `ttl` секунд, вытеснение — LRU.
+    Для стоящего на месте пользователя почти все кадры попадают в кэш.
+    """
+    _user_caches = OrderedDict()
+    _shared = None
+    _registry_lock = threading.Lock()
+
+    def __init__(self, max_entries=32, ttl=2.0, max_distance=6):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self._entries = OrderedDict()  # content_hash -> {"dhash", "created", "values"}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "near_hits": 0, "misses": 0, "evictions": 0}
+
+    @classmethod
+    def for_user(cls, user_id):
+        """
+        Кэш конкретного пользователя (или общий, если FRAME_CACHE['shared']).
+        Число пользовательских кэшей ограничено FRAME_CACHE['max_users'] (LRU).
+        """
+        from django.conf import settings
+        config = getattr(settings, 'FRAME_CACHE', {})
+        options = {k: config[k] for k in ('max_entries', 'ttl', 'max_distance') if k in config}
+
+        with cls._registry_lock:
+            if config.get('shared'):
+                if cls._shared is None:
+                    cls._shared = cls(**options)
+                return cls._shared
+
+            key = str(user_id)
+            cache = cls._user_caches.get(key)
+            if cache is None:
+                cache = cls._user_caches[key] = cls(**options)
+                while len(cls._user_caches) > config.get('max_users', 1000):
+                    cls._user_caches.popitem(last=False)
+            else:
+                cls._user_caches.move_to_end(key)
+            return cache
+
+    @classmethod
+    def global_stats(cls):
+        """Суммарные счётчики по всем кэшам процесса."""
+        with cls._registry_lock:
+            caches = list(cls._user_caches.values())
+            if cls._shared is not None:
+                caches.append(cls._shared)
+        total = {"hits": 0, "near_hits": 0, "misses": 0, "evictions": 0, "caches": len(caches)}
+        for cache in caches:
+            for key, value in cache.stats.items():
+                if key in total:
+                    total[key] += value
+        lookups = total["hits"] + total["near_hits"] + total["misses"]
+        total["hit_rate"] = (total["hits"] + total["near_hits"]) / lookups if lookups else 0.0
+        return total
+
+    @property
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=len(self._entries))
+
+    def get(self, frame, kind):
+        """Результат `kind` для этого или почти такого же кадра, иначе MISS."""
+        # Хэши считаем до захвата блокировки
+        content_hash, dhash = frame.content_hash, frame.dhash
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+
+            entry = self._entries.get(content_hash)
+            if entry is not None and kind in entry["values"]:
+                self._entries.move_to_end(content_hash)
+                self._stats["hits"] += 1
+                return _unwrap(entry["values"][kind])
+
+            best_key, best_distance = None, self.max_distance + 1
+            for key, entry in self._entries.items():
+                if kind not in entry["values"]:
+                    continue
+                distance = (entry["dhash"] ^ dhash).bit_count()
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+
+            if best_key is None:
+                self._stats["misses"] += 1
+                return MISS
+
+            self._entries.move_to_end(best_key)
+            self._stats["near_hits"] += 1
+            return _unwrap(self._entries[best_key]["values"][kind])
+
+    def put(self, frame, kind, value):
+        content_hash, dhash = frame.content_hash, frame.dhash
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(content_hash)
+            if entry is None:
+                entry = self._entries[content_hash] = {"dhash": dhash, "created": now, "values": {}}
+            else:
+                self._entries.move_to_end(content_hash)
+            entry["values"][kind] = EMPTY if value is None else value
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    async def get_or_compute(self, frame, kind, compute, fallback=None):
+        """
+        Возвращает закэшированный результат или await compute() и кладёт его в кэш.
+        compute — функция без аргументов, возвращающая awaitable; при сбое модели
+        она должна бросать исключение. Тогда возвращается fallback и в кэш ничего
+        не попадает — иначе один сбой YOLO на ttl секунд превратился бы в
+        «путь свободен» для всех похожих кадров.
+        """
+        if frame is not None:
+            value = self.get(frame, kind)
+            if value is not MISS:
+                return value
+        try:
+            value = await compute()
+        except Exception as e:
+            logger.error(f"Frame cache: '{kind}' failed, result not cached: {e}")
+            return fallback
+        if frame is not None:
+            self.put(frame, kind, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _expire(self, now):
+        expired = [key for key, entry in self._entries.items() if now - entry["created"] > self.ttl]
+        for key in expired:
+            del self._entries[key]
+
+
+def _unwrap(value):
+    return None if value is EMPTY else value
@@ -0,0 +1,382 @@
+"""
+Общий шлюз к LLM-провайдерам (OpenAI-совместимые API: DeepSeek, OpenRouter, ...).
+
+Раньше каждый запрос создавал новый AsyncOpenAI — с новым TCP/TLS соединением
+и копией логики выбора провайдера. Здесь:
+
+- по одному долгоживущему клиенту (пул keep-alive соединений) на провайдера.
+  httpx-клиент привязан к event loop, а под WSGI каждый async view получает
+  свой короткоживущий loop, поэтому клиенты живут в собственном loop шлюза
+  (поток llm-gateway): вызовы из любого loop — views, FastAPI-сервера —
+  передаются туда, и соединения переиспользуются между запросами. При выходе
+  процесса (atexit) клиенты закрываются;
+- дедлайн на весь вызов, повторы с экспоненциальной задержкой и джиттером;
+- хеджирование (LLM_HEDGE): если основной провайдер не ответил за свой p95,
+  параллельно запрашивается следующий, берётся первый успешный ответ;
+- учёт задержек и ошибок по провайдерам; запросы идут к самому быстрому
+  из здоровых, провайдер после серии ошибок временно выводится из ротации.
+
+Провайдеры — settings.LLM_PROVIDERS; по умолчанию один, выбранный по
+OPENAI_API_KEY как раньше. LLM_BASE_URL подменяет адрес (например, локальный
+тестовый OpenAI-совместимый сервер).
+"""
+import asyncio
+import atexit
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DEEPSEEK = {"name": "deepseek", "base_url": "https://api.deepseek.com", "model": "deepseek-chat"}
+OPENROUTER = {"name": "openrouter", "base_url": "https://openrouter.ai/api/v1", "model": "deepseek/deepseek-chat"}
+
+
+class LLMError(Exception):
+    """Ни один провайдер не ответил до дедлайна."""
+
+
+class Provider:
+    def __init__(self, name, base_url, model, api_key=None, api_key_env=None,
+                 failure_threshold=3, cooldown=30.0, window=100):
+        self.name = name
+        self.base_url = base_url
+        self.model = model
+        self.api_key = api_key or os.getenv(api_key_env or "OPENAI_API_KEY")
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+
+    def healthy(self, now=None) -> bool:
+        return (now or time.monotonic()) >= self.down_until
+
+    def record_success(self, seconds: float):
+        with self._lock:
+            self.calls += 1
+            self.consecutive_failures = 0
+            self._latencies.append(seconds)
+
+    def record_failure(self):
+        with self._lock:
+            self.calls += 1
+            self.errors += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self.down_until = time.monotonic() + self.cooldown
+                logger.warning(f"LLM provider '{self.name}' marked down for {self.cooldown:.0f}s")
+
+    def percentile(self, q: float):
+        with self._lock:
+            values = sorted(self._latencies)
+        if not values:
+            return None
+        return values[min(int(q * len(values)), len(values) - 1)]
+
+    @property
+    def stats(self):
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "healthy": self.healthy(),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+class LLMGateway:
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, providers, timeout=20.0, retries=2, backoff=0.25, hedge=False,
+                 hedge_min_delay=0.5, hedge_default_delay=2.0, max_connections=20):
+        self.providers = [p if isinstance(p, Provider) else Provider(**p) for p in providers]
+        self.providers = [p for p in self.providers if p.api_key]
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_default_delay = hedge_default_delay
+        self.max_connections = max_connections
+        # Клиенты провайдеров создаются и используются только в loop шлюза
+        self._clients = {}
+        self._loop = None
+        self._loop_thread = None
+        self._loop_lock = threading.Lock()
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    from django.conf import settings
+                    cls._instance = cls(
+                        getattr(settings, 'LLM_PROVIDERS', None) or _default_providers(),
+                        timeout=getattr(settings, 'LLM_TIMEOUT', 20.0),
+                        retries=getattr(settings, 'LLM_RETRIES', 2),
+                        hedge=getattr(settings, 'LLM_HEDGE', False),
+                        max_connections=getattr(settings, 'LLM_MAX_CONNECTIONS', 20),
+                    )
+        return cls._instance
+
+    @property
+    def available(self) -> bool:
+        return bool(self.providers)
+
+    def ranked(self):
+        """Здоровые провайдеры по возрастанию p50 (только что ошибавшиеся — в конце), затем выведенные из ротации."""
+        now = time.monotonic()
+
+        def key(item):
+            index, provider = item
+            p50 = provider.percentile(0.5)
+            # Без статистики сохраняем порядок из настроек
+            return (not provider.healthy(now), provider.consecutive_failures,
+                    p50 if p50 is not None else 0.0, index)
+
+        return [p for _, p in sorted(enumerate(self.providers), key=key)]
+
+    def client(self, provider):
+        """Клиент провайдера. Вызывается только из loop шлюза."""
+        import httpx
+        from openai import AsyncOpenAI
+
+        clients = self._clients
+        if provider.name not in clients:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                timeout=self.timeout,
+            )
+            # Повторы делает шлюз — встроенные у SDK отключены
+            clients[provider.name] = AsyncOpenAI(
+                api_key=provider.api_key, base_url=provider.base_url,
+                http_client=http_client, max_retries=0,
+            )
+        return clients[provider.name]
+
+    async def chat(self, messages, timeout=None, **params) -> str:
+        """Текст ответа. Бросает LLMError, если до дедлайна ответа нет."""
+        if self._in_gateway_loop():
+            return await self._chat(messages, timeout, **params)
+        future = asyncio.run_coroutine_threadsafe(self._chat(messages, timeout, **params), self._gateway_loop())
+        # Отмена в вызывающем loop отменяет и задачу в loop шлюза
+        return await asyncio.wrap_future(future)
+
+    async def stream(self, messages, timeout=None, **params):
+        """
+        Async-генератор текстовых фрагментов (stream=True).
+        Повторяет запрос у другого провайдера только пока не пришёл первый фрагмент.
+        """
+        if self._in_gateway_loop():
+            async for delta in self._stream(messages, timeout, **params):
+                yield delta
+            return
+
+        # Генерация идёт в loop шлюза, фрагменты передаются в очередь вызывающего loop
+        loop = asyncio.get_running_loop()
+        deltas = asyncio.Queue()
+
+        def put(item):
+            try:
+                loop.call_soon_threadsafe(deltas.put_nowait, item)
+            except RuntimeError:
+                # Вызывающий loop уже закрыт — получателя нет
+                pass
+
+        async def pump():
+            try:
+                async for delta in self._stream(messages, timeout, **params):
+                    put(('delta', delta))
+            except Exception as e:
+                put(('error', e))
+            else:
+                put(('done', None))
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self._gateway_loop())
+        try:
+            while True:
+                kind, value = await deltas.get()
+                if kind == 'done':
+                    return
+                if kind == 'error':
+                    raise value
+                yield value
+        finally:
+            future.cancel()
+
+    def close(self):
+        """Закрывает клиенты (сокеты пулов) и останавливает loop шлюза. Регистрируется в atexit."""
+        with self._loop_lock:
+            loop, thread = self._loop, self._loop_thread
+            self._loop = self._loop_thread = None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._close_clients(), loop).result(timeout=5)
+        except Exception as e:
+            logger.warning(f"LLM gateway: closing clients failed: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+        loop.close()
+        atexit.unregister(self.close)
+
+    async def _close_clients(self):
+        clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            await client.close()
+
+    def _gateway_loop(self):
+        if self._loop is None:
+            with self._loop_lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    thread = threading.Thread(target=loop.run_forever, name="llm-gateway", daemon=True)
+                    thread.start()
+                    self._loop, self._loop_thread = loop, thread
+                    atexit.register(self.close)
+        return self._loop
+
+    def _in_gateway_loop(self):
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    async def _chat(self, messages, timeout=None, **params) -> str:
+        if not self.providers:
+            raise LLMError("No LLM providers configured (OPENAI_API_KEY)")
+
+        deadline = time.monotonic() + (timeout or self.timeout)
+        last_error = None
+        for attempt in range(self.retries + 1):
+            # ranked() уже опускает только что ошибившегося провайдера — повтор идёт к следующему
+            ranked = self.ranked()
+            primary = ranked[0]
+            backup = ranked[1] if len(ranked) > 1 else None
+            try:
+                return await self._hedged(primary, backup if self.hedge else None, messages, deadline, params)
+            except Exception as e:
+                last_error = e
+                logger.warning(f"LLM attempt {attempt + 1} failed: {type(e).__name__}: {e}")
+
+            remaining = deadline - time.monotonic()
+            if attempt == self.retries or remaining <= 0:
+                break
+            # Экспоненциальная задержка с джиттером, не дольше остатка дедлайна
+            delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+            await asyncio.sleep(min(delay, remaining))
+
+        raise LLMError(f"LLM request failed: {last_error}")
+
+    async def _stream(self, messages, timeout=None, **params):
+        if not self.providers:
+            raise LLMError("No LLM providers configured (OPENAI_API_KEY)")
+
+        deadline = time.monotonic() + (timeout or self.timeout)
+        last_error = None
+        for attempt in range(self.retries + 1):
+            provider = self.ranked()[0]
+            started = time.monotonic()
+            produced = False
+            try:
+                response = await asyncio.wait_for(
+                    self.client(provider).chat.completions.create(
+                        model=provider.model, messages=messages, stream=True, **params
+                    ),
+                    timeout=max(deadline - started, 0.01),
+                )
+                async for chunk in response:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if not produced:
+                            # Для стриминга учитываем время до первого фрагмента
+                            provider.record_success(time.monotonic() - started)
+                            produced = True
+                        yield delta
+                return
+            except Exception as e:
+                if produced:
+                    raise
+                provider.record_failure()
+                last_error = e
+                logger.warning(f"LLM stream attempt {attempt + 1} ({provider.name}) failed: {e}")
+
+            remaining = deadline - time.monotonic()
+            if attempt == self.retries or remaining <= 0:
+                break
+            await asyncio.sleep(min(self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5), remaining))
+
+        raise LLMError(f"LLM stream failed: {last_error}")
+
+    async def _hedged(self, primary, backup, messages, deadline, params):
+        first = asyncio.ensure_future(self._call(primary, messages, deadline, params))
+        if backup is None or backup is primary:
+            return await first
+
+        # Второй запрос — только если основной не уложился в свой p95
+        p95 = primary.percentile(0.95)
+        delay = max(p95 if p95 is not None else self.hedge_default_delay, self.hedge_min_delay)
+        done, _ = await asyncio.wait({first}, timeout=min(delay, max(deadline - time.monotonic(), 0)))
+        if done:
+            return first.result()
+
+        logger.info(f"LLM hedge: '{primary.name}' slower than {delay:.2f}s, asking '{backup.name}'")
+        pending = {first, asyncio.ensure_future(self._call(backup, messages, deadline, params))}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _call(self, provider, messages, deadline, params):
+        started = time.monotonic()
+        remaining = deadline - started
+        if remaining <= 0:
+            raise asyncio.TimeoutError("LLM deadline exceeded")
+        try:
+            response = await asyncio.wait_for(
+                self.client(provider).chat.completions.create(model=provider.model, messages=messages, **params),
+                timeout=remaining,
+            )
+        except asyncio.CancelledError:
+            # Проигравший хедж — не ошибка провайдера
+            raise
+        except Exception:
+            provider.record_failure()
+            raise
+        provider.record_success(time.monotonic() - started)
+        return response.choices[0].message.content
+
+    @property
+    def stats(self):
+        return {provider.name: provider.stats for provider in self.providers}
+
+
+def _default_providers():
+    """Как раньше: DeepSeek, либо OpenRouter для ключей sk-or-v1."""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        return []
+    provider = dict(OPENROUTER if api_key.startswith("sk-or-v1") else DEEPSEEK, api_key=api_key)
+    if os.getenv("LLM_BASE_URL"):
+        provider["base_url"] = os.getenv("LLM_BASE_URL")
+    return [provider]
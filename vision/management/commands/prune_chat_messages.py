@@ -0,0 +1,61 @@
+"""
+Удаление старой истории чата: сообщения старше max_age_days и всё сверх
+последних keep сообщений каждого пользователя. Удаляет пачками по id, чтобы
+не держать долгую блокировку таблицы. Запускать по cron:
+
+    python manage.py prune_chat_messages
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+
+from vision.models import ChatMessage
+
+
+class Command(BaseCommand):
+    help = "Удаляет старые сообщения ChatMessage (по возрасту и сверх лимита на пользователя)"
+
+    def add_arguments(self, parser):
+        config = getattr(settings, 'CHAT_HISTORY', {})
+        parser.add_argument('--keep', type=int, default=config.get('keep', 200),
+                            help="Сколько последних сообщений оставлять каждому пользователю (0 — без лимита)")
+        parser.add_argument('--max-age-days', type=int, default=config.get('max_age_days', 90),
+                            help="Удалять сообщения старше N дней (0 — без ограничения по возрасту)")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="Только посчитать, ничего не удалять")
+
+    def handle(self, *args, keep, max_age_days, batch_size, dry_run, **options):
+        batch_size = max(batch_size, 1)
+        expired = 0
+        if max_age_days > 0:
+            cutoff = timezone.now() - timedelta(days=max_age_days)
+            expired = self._delete(ChatMessage.objects.filter(created_at__lt=cutoff), batch_size, dry_run)
+
+        trimmed = 0
+        if keep > 0:
+            over_limit = (ChatMessage.objects.values('user_id')
+                          .annotate(total=Count('id')).filter(total__gt=keep))
+            for row in over_limit.iterator():
+                messages = ChatMessage.objects.filter(user_id=row['user_id'])
+                boundary = messages.order_by('-created_at', '-id').values('created_at', 'id')[keep - 1]
+                older = messages.filter(created_at__lte=boundary['created_at']).exclude(
+                    created_at=boundary['created_at'], id__gte=boundary['id'])
+                trimmed += self._delete(older, batch_size, dry_run)
+
+        verb = "Would delete" if dry_run else "Deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {expired + trimmed} chat messages ({expired} expired, {trimmed} over per-user limit)"))
+
+    @staticmethod
+    def _delete(queryset, batch_size, dry_run):
+        if dry_run:
+            return queryset.count()
+        deleted = 0
+        while True:
+            ids = list(queryset.order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            deleted += ChatMessage.objects.filter(id__in=ids).delete()[0]
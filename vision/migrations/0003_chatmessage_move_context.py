@@ -0,0 +1,88 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:23
+
+import json
+from datetime import timedelta
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+# Столько сообщений хранил старый VisionUser.context (обрезка до 20 + новое)
+LEGACY_HISTORY_LIMIT = 21
+
+
+def move_context_to_messages(apps, schema_editor):
+    """История из JSON-строки VisionUser.context -> строки ChatMessage."""
+    VisionUser = apps.get_model('vision', 'VisionUser')
+    ChatMessage = apps.get_model('vision', 'ChatMessage')
+
+    now = django.utils.timezone.now()
+    batch = []
+    for vision_user in VisionUser.objects.exclude(context__isnull=True).exclude(context='').iterator():
+        try:
+            history = json.loads(vision_user.context)
+        except ValueError:
+            continue
+        if not isinstance(history, list):
+            continue
+        # Времени у старых сообщений нет: раскладываем их по миллисекундам до момента миграции,
+        # чтобы сохранить порядок
+        for i, item in enumerate(history):
+            if not isinstance(item, dict) or 'content' not in item:
+                continue
+            batch.append(ChatMessage(
+                user_id=vision_user.pk,
+                role=item.get('role') or 'user',
+                content=str(item['content'] or ''),
+                created_at=now - timedelta(milliseconds=len(history) - i),
+            ))
+        if len(batch) >= 1000:
+            ChatMessage.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        ChatMessage.objects.bulk_create(batch)
+
+
+def move_messages_to_context(apps, schema_editor):
+    """Обратная миграция: последние сообщения каждого пользователя обратно в JSON."""
+    VisionUser = apps.get_model('vision', 'VisionUser')
+    ChatMessage = apps.get_model('vision', 'ChatMessage')
+
+    for vision_user in VisionUser.objects.iterator():
+        recent = ChatMessage.objects.filter(user_id=vision_user.pk).order_by('-created_at', '-id')
+        history = [
+            {'role': message.role, 'content': message.content}
+            for message in reversed(recent[:LEGACY_HISTORY_LIMIT])
+        ]
+        if history:
+            vision_user.context = json.dumps(history, ensure_ascii=False)
+            vision_user.save(update_fields=['context'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vision', '0002_visionuser_facts_alter_user_id_alter_visionuser_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('user', 'User'), ('assistant', 'Assistant'), ('system', 'System')], max_length=20)),
+                ('content', models.TextField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='vision.visionuser')),
+            ],
+            options={
+                'db_table': 'chat_messages',
+                'indexes': [models.Index(fields=['user', 'created_at'], name='chat_msg_user_created_idx')],
+            },
+        ),
+        migrations.RunPython(move_context_to_messages, move_messages_to_context),
+        migrations.RemoveField(
+            model_name='visionuser',
+            name='context',
+        ),
+    ]
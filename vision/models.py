@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 
 class User(AbstractUser):
     """Расширенная модель пользователя для WayFinder"""
@@ -69,7 +70,6 @@ class VisionUser(models.Model):
     """
     telegram_id = models.CharField(max_length=100, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    context = models.TextField(blank=True, null=True) # Хранение истории переписки (JSON или текст)
     
     # CAG System: Персональные факты и состояние пользователя
     facts = models.JSONField(default=dict, blank=True, null=True)
@@ -81,25 +81,39 @@ class VisionUser(models.Model):
         return f"VisionUser {self.telegram_id}"
 
     def add_message(self, role, content):
-        """Добавить сообщение в контекст"""
-        import json
-        try:
-            history = json.loads(self.context) if self.context else []
-        except:
-            history = []
+        """Добавить сообщение в историю (одна вставка в ChatMessage)"""
+        return ChatMessage.objects.create(user=self, role=role, content=content or "")
         
-        # Ограничиваем историю
-        if len(history) > 20: 
-            history = history[-20:]
-            
-        history.append({"role": role, "content": content})
-        self.context = json.dumps(history, ensure_ascii=False)
-        self.save()
-        
-    def get_context(self):
-        """Получить историю как список словарей"""
-        import json
-        try:
-            return json.loads(self.context) if self.context else []
-        except:
-            return []
+    def get_context(self, limit=None):
+        """Последние `limit` сообщений (по умолчанию CHAT_HISTORY['window']) как список словарей"""
+        from django.conf import settings
+        limit = limit or getattr(settings, 'CHAT_HISTORY', {}).get('window', 20)
+        recent = ChatMessage.objects.filter(user=self).order_by('-created_at', '-id').values('role', 'content')[:limit]
+        return list(reversed(recent))
+
+
+class ChatMessage(models.Model):
+    """
+    Сообщение чата VisionUser — одна строка на реплику.
+    Раньше вся история лежала JSON-строкой в VisionUser.context и переписывалась целиком;
+    старые сообщения удаляет команда prune_chat_messages.
+    """
+    ROLE_CHOICES = [
+        ('user', 'User'),
+        ('assistant', 'Assistant'),
+        ('system', 'System'),
+    ]
+
+    user = models.ForeignKey(VisionUser, on_delete=models.CASCADE, related_name='messages')
+    role = models.CharField(max_length=20, choices=ROLE_CHOICES)
+    content = models.TextField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'chat_messages'
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='chat_msg_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.role}: {self.content[:50]}"
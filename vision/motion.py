@@ -0,0 +1,82 @@
+"""
+Motion gate: решает, стоит ли вообще запускать детектор на кадре.
+
+Сравниваем крошечную grayscale-копию кадра с копией кадра, на котором детектор
+запускался в последний раз. Если средняя разница пикселей ниже порога — сцена
+не изменилась, используем прошлый результат. Не реже чем раз в `max_staleness`
+секунд детекция выполняется принудительно.
+Модуль не зависит от Django — его использует и smart_glasses.
+"""
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class MotionGate:
+    """
+    threshold     — средняя абсолютная разница яркости (0..255), выше которой сцена «изменилась»
+    max_staleness — максимальный возраст прошлого результата в секундах
+    size          — размер уменьшенного кадра для сравнения (w, h)
+    enabled       — False: гейт всегда пропускает кадр (для режимов без гейтинга)
+    """
+
+    def __init__(self, threshold=4.0, max_staleness=2.0, size=(32, 24), enabled=True):
+        self.threshold = threshold
+        self.max_staleness = max_staleness
+        self.size = tuple(size)
+        self.enabled = enabled
+        self._reference = None
+        self._last_run = 0.0
+        self.stats = {"checked": 0, "ran": 0, "skipped": 0}
+
+    @classmethod
+    def for_mode(cls, mode, config: dict):
+        """Гейт с настройками режима из словаря вида {'navigator': {...}, 'default': {...}}."""
+        options = dict(config.get("default", {}))
+        options.update(config.get(mode, {}))
+        return cls(**options)
+
+    @staticmethod
+    def thumbnail_from_bytes(data: bytes):
+        """
+        Дешёвое декодирование JPEG сразу в grayscale с уменьшением в 8 раз —
+        гейту не нужен полный кадр.
+        """
+        import cv2
+        return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+
+    def should_run(self, image, now=None) -> bool:
+        """image: grayscale или BGR ndarray любого размера. True — запускать детектор."""
+        self.stats["checked"] += 1
+        if not self.enabled or image is None:
+            self.stats["ran"] += 1
+            return True
+
+        import cv2
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        tiny = cv2.resize(image, self.size, interpolation=cv2.INTER_AREA).astype(np.float32)
+        now = time.monotonic() if now is None else now
+
+        stale = now - self._last_run >= self.max_staleness
+        changed = self._reference is None or float(np.abs(tiny - self._reference).mean()) > self.threshold
+
+        if stale or changed:
+            self._reference = tiny
+            self._last_run = now
+            self.stats["ran"] += 1
+            return True
+
+        self.stats["skipped"] += 1
+        return False
+
+    @property
+    def skip_rate(self) -> float:
+        return self.stats["skipped"] / self.stats["checked"] if self.stats["checked"] else 0.0
+
+    def reset(self):
+        self._reference = None
+        self._last_run = 0.0
@@ -0,0 +1,83 @@
+"""
+Небольшой DAG стадий для обработки запроса.
+
+Стадия объявляет имя, async-функцию и зависимости. Pipeline.run(targets)
+запускает только стадии, нужные для целей; независимые стадии идут параллельно,
+каждая выполняется не больше одного раза, а стадии с ложным `when` пропускаются.
+Для каждой стадии записывается время выполнения.
+"""
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """
+    name — имя стадии (ключ результата)
+    fn   — async def fn(ctx) -> результат
+    deps — имена стадий, результаты которых нужны fn
+    when — def when(ctx) -> bool; False — стадия пропускается (результат None)
+    """
+
+    def __init__(self, name, fn, deps=(), when=None):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.when = when
+
+
+class PipelineContext:
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.results = {}
+        self.timings = {}
+        self.skipped = []
+
+    def __getitem__(self, name):
+        return self.results.get(name)
+
+
+class Pipeline:
+    def __init__(self, stages):
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            missing = [dep for dep in stage.deps if dep not in self.stages]
+            if missing:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stages: {missing}")
+
+    async def run(self, targets, **inputs) -> PipelineContext:
+        ctx = PipelineContext(inputs)
+        tasks = {}
+
+        def schedule(name):
+            # Одна задача на стадию: повторные обращения ждут ту же задачу
+            if name not in tasks:
+                tasks[name] = asyncio.ensure_future(self._run_stage(self.stages[name], ctx, schedule))
+            return tasks[name]
+
+        try:
+            await asyncio.gather(*(schedule(name) for name in targets))
+        finally:
+            for task in tasks.values():
+                if not task.done():
+                    task.cancel()
+        return ctx
+
+    async def _run_stage(self, stage, ctx, schedule):
+        if stage.deps:
+            await asyncio.gather(*(schedule(dep) for dep in stage.deps))
+
+        if stage.when is not None and not stage.when(ctx):
+            ctx.skipped.append(stage.name)
+            ctx.results[stage.name] = None
+            return None
+
+        started = time.perf_counter()
+        try:
+            result = await stage.fn(ctx)
+        finally:
+            ctx.timings[stage.name] = round((time.perf_counter() - started) * 1000, 1)
+        ctx.results[stage.name] = result
+        return result
@@ -0,0 +1,144 @@
+import gc
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """
+    Единый реестр моделей процесса (YOLO, BLIP, Whisper, EasyOCR, KaniTTS).
+
+    Каждая модель регистрируется под именем вместе с функцией загрузки и
+    загружается лениво при первом обращении — ровно один экземпляр на процесс,
+    даже если её одновременно запросили несколько потоков.
+    Реестр считает ссылки (acquire/release) и запоминает, сколько памяти
+    добавила загрузка каждой модели.
+    """
+    _loaders = {}
+    _models = {}
+    _locks = {}
+    _refcounts = {}
+    _info = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def register(cls, name: str, loader):
+        """Регистрирует функцию загрузки. Повторная регистрация заменяет loader, но не модель."""
+        with cls._lock:
+            cls._loaders[name] = loader
+            cls._locks.setdefault(name, threading.Lock())
+            cls._refcounts.setdefault(name, 0)
+
+    @classmethod
+    def get(cls, name: str):
+        """Модель по имени (загружается при первом вызове). None, если загрузка не удалась."""
+        if name in cls._models:
+            return cls._models[name]
+
+        lock = cls._locks.get(name)
+        if lock is None:
+            raise KeyError(f"Model '{name}' is not registered")
+
+        with lock:
+            if name in cls._models:
+                return cls._models[name]
+
+            rss_before = _rss_bytes()
+            started = time.perf_counter()
+            try:
+                model = cls._loaders[name]()
+            except Exception as e:
+                # Не кэшируем неудачу — следующий вызов попробует снова
+                logger.error(f"❌ Failed to load model '{name}': {e}")
+                return None
+
+            cls._info[name] = {
+                "load_seconds": round(time.perf_counter() - started, 2),
+                "rss_delta_mb": round((_rss_bytes() - rss_before) / 2**20, 1),
+                "param_mb": round(_param_bytes(model) / 2**20, 1),
+            }
+            cls._models[name] = model
+            return model
+
+    @classmethod
+    def acquire(cls, name: str):
+        """get() + увеличение счётчика ссылок."""
+        model = cls.get(name)
+        if model is not None:
+            with cls._lock:
+                cls._refcounts[name] += 1
+        return model
+
+    @classmethod
+    def release(cls, name: str, unload: bool = False):
+        """Уменьшает счётчик ссылок; при unload=True выгружает модель, когда ссылок не осталось."""
+        with cls._lock:
+            cls._refcounts[name] = max(cls._refcounts.get(name, 0) - 1, 0)
+            if not unload or cls._refcounts[name] > 0:
+                return
+        cls.unload(name)
+
+    @classmethod
+    def unload(cls, name: str):
+        lock = cls._locks.get(name)
+        if lock is None:
+            return
+        with lock:
+            if cls._models.pop(name, None) is not None:
+                cls._info.pop(name, None)
+                gc.collect()
+                logger.info(f"Model '{name}' unloaded")
+
+    @classmethod
+    def is_registered(cls, name: str) -> bool:
+        return name in cls._loaders
+
+    @classmethod
+    def is_loaded(cls, name: str) -> bool:
+        return name in cls._models
+
+    @classmethod
+    def memory_report(cls) -> dict:
+        """Память процесса и вклад каждой модели (прирост RSS при загрузке и размер весов)."""
+        with cls._lock:
+            names = list(cls._loaders)
+            refcounts = dict(cls._refcounts)
+        models = {}
+        for name in names:
+            models[name] = {
+                "loaded": name in cls._models,
+                "refs": refcounts.get(name, 0),
+                **cls._info.get(name, {}),
+            }
+        return {"process_rss_mb": round(_rss_bytes() / 2**20, 1), "models": models}
+
+
+def _rss_bytes() -> int:
+    """Текущий RSS процесса (Linux /proc, иначе psutil, иначе 0)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return 0
+
+
+def _param_bytes(model) -> int:
+    """Размер весов torch-модели (для кортежей — сумма по элементам)."""
+    if isinstance(model, (tuple, list)):
+        return sum(_param_bytes(m) for m in model)
+    module = getattr(model, "model", model)  # ultralytics YOLO хранит nn.Module в .model
+    parameters = getattr(module, "parameters", None)
+    if not callable(parameters):
+        return 0
+    try:
+        return sum(p.numel() * p.element_size() for p in parameters())
+    except Exception:
+        return 0
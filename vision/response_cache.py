@@ -0,0 +1,165 @@
+"""
+Кэш ответов LLM.
+
+Один и тот же вопрос про одну и ту же сцену («что впереди?» при тех же
+объектах и том же описании) не должен каждый раз стоить запроса к API.
+Ключ — нормализованный вопрос + канонический визуальный контекст (отсортированные
+объекты, описание BLIP, текст OCR) + факты пользователя, влияющие на промпт.
+Если в промпт попали факты из личной памяти (RAG), ключ дополнительно включает
+id пользователя и хэш этих фактов: ответ по чужой памяти не отдаётся, а
+после add_fact вопрос с новым контекстом памяти не берёт устаревший ответ.
+
+Поиск: сначала точное совпадение ключа, затем (semantic=True) ближайший по
+косинусу вопрос с тем же самым визуальным контекстом. Записи живут ttl секунд,
+при переполнении вытесняются по LRU. Личные и зависящие от времени вопросы
+(«который час», «как меня зовут») не кэшируются.
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .embeddings import HashingEmbedder
+
+logger = logging.getLogger(__name__)
+
+# Вопросы, ответ на которые зависит от времени или личной памяти, а не от сцены
+UNCACHEABLE = re.compile(
+    r"врем|\bчас(а|ов)?\b|который час|сегодня|завтра|вчера|дата|число|день недели|погод|новост|"
+    r"меня зовут|как меня|запомни|помнишь|напомни|\bмо[йяеи]\b|\bмоё\b|"
+    r"\btime\b|\btoday\b|\bweather\b|\bremember\b|\bmy\b",
+    re.IGNORECASE,
+)
+_WAKE_WORDS = re.compile(r"\b(wayfinder|вейфайндер|вэйфайндер)\b", re.IGNORECASE)
+_PUNCT = re.compile(r"[^\w\s]+", re.UNICODE)
+_SPACES = re.compile(r"\s+")
+
+# Факты пользователя, которые попадают в системный промпт (см. CAGSystem.build_system_prompt)
+PROMPT_FACTS = ('name', 'mood')
+
+
+def normalize_query(text: str) -> str:
+    text = _WAKE_WORDS.sub(" ", (text or "").lower().replace('ё', 'е'))
+    return _SPACES.sub(" ", _PUNCT.sub(" ", text)).strip()
+
+
+def context_key(visual_context=None, ocr_context=None, detected_objects=None, facts=None,
+                memory=None, user_id=None) -> str:
+    """
+    Канонический визуальный контекст + факты в виде короткого хэша.
+    memory — текст фактов из памяти пользователя, вставленный в промпт (CAGSystem.rag_context).
+    """
+    memory = (memory or "").strip()
+    canonical = json.dumps({
+        'caption': (visual_context or "").strip().lower(),
+        'ocr': _SPACES.sub(" ", (ocr_context or "").strip().lower()),
+        'objects': sorted(set(detected_objects or [])),
+        'facts': {k: (facts or {}).get(k) for k in PROMPT_FACTS},
+        # Ответ, опирающийся на личную память, принадлежит только её владельцу
+        'memory': hashlib.blake2b(memory.encode('utf-8'), digest_size=16).hexdigest() if memory else None,
+        'user': str(user_id) if memory else None,
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class ResponseCache:
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0, semantic: bool = True,
+                 similarity: float = 0.9, enabled: bool = True):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.semantic = semantic
+        self.similarity = similarity
+        self.enabled = enabled
+        self.embedder = HashingEmbedder()
+        # (context, query) -> (answer, expires_at, query_vector)
+        self._entries = OrderedDict()
+        # context -> ключи записей с этим контекстом (для семантического поиска)
+        self._by_context = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "semantic_hits": 0, "misses": 0, "skipped": 0, "stores": 0, "evictions": 0}
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    from django.conf import settings
+                    cls._instance = cls(**getattr(settings, 'LLM_RESPONSE_CACHE', {}))
+        return cls._instance
+
+    def cacheable(self, query: str) -> bool:
+        return self.enabled and bool(query) and not UNCACHEABLE.search(query)
+
+    def lookup(self, query: str, context: str):
+        """Ответ из кэша или None."""
+        if not self.cacheable(query):
+            with self._lock:
+                self._stats["skipped"] += 1
+            return None
+
+        normalized = normalize_query(query)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((context, normalized))
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end((context, normalized))
+                self._stats["hits"] += 1
+                return entry[0]
+
+            if self.semantic:
+                candidates = [key for key in self._by_context.get(context, ()) if self._entries[key][1] > now]
+                if candidates:
+                    vector = self.embedder.embed(normalized)
+                    scores = np.stack([self._entries[key][2] for key in candidates]) @ vector
+                    best = int(np.argmax(scores))
+                    if scores[best] >= self.similarity:
+                        self._entries.move_to_end(candidates[best])
+                        self._stats["semantic_hits"] += 1
+                        return self._entries[candidates[best]][0]
+
+            self._stats["misses"] += 1
+            return None
+
+    def store(self, query: str, context: str, answer: str):
+        if not answer or not self.cacheable(query):
+            return
+        normalized = normalize_query(query)
+        key = (context, normalized)
+        vector = self.embedder.embed(normalized) if self.semantic else None
+        with self._lock:
+            self._entries[key] = (answer, time.monotonic() + self.ttl, vector)
+            self._entries.move_to_end(key)
+            self._by_context.setdefault(context, set()).add(key)
+            self._stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_context.clear()
+
+    @property
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries))
+        lookups = stats["hits"] + stats["semantic_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits"] + stats["semantic_hits"]) / lookups, 3) if lookups else 0.0
+        return stats
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        keys = self._by_context.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_context[key[0]]
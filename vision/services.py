@@ -1,153 +1,364 @@
 import os
 import asyncio
+import functools
 import base64
 import torch
-from faster_whisper import WhisperModel
+from faster_whisper import WhisperModel, decode_audio
 from transformers import BlipProcessor, BlipForConditionalGeneration
-from PIL import Image
-from io import BytesIO
-from openai import AsyncOpenAI
 import edge_tts
 import logging
 import easyocr
 import numpy as np
-from ultralytics import YOLO
-from asgiref.sync import sync_to_async
-from asgiref.sync import sync_to_async
+from .executors import ModelExecutors, run_in
+from .batching import DetectionBatcher
+from .stt_batching import WhisperBatcher
+from .tiering import ModelTiering
+from .frame import Frame
+from .detectors import load_detector_from_settings
+from .detections import Detections, DEFAULT_HFOV, DEFAULT_VFOV
+from .registry import ModelRegistry
+from .workers import InferencePool
+from .speech_stream import speak_sentences
+from .llm_gateway import LLMGateway
+from .response_cache import ResponseCache, context_key
 
 logger = logging.getLogger(__name__)
 
+def _load_whisper(size=None):
+    from django.conf import settings
+    # По умолчанию tiny — для скорости (max speed); крупнее — уровни MODEL_TIERS
+    size = size or getattr(settings, 'WHISPER_MODEL', 'tiny')
+    print(f"⏳ Загрузка модели Whisper {size} (STT)...")
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    compute_type = "float16" if device == "cuda" else "int8"
+    
+    try:
+        model = WhisperModel(size, device=device, compute_type=compute_type)
+        print(f"✅ Whisper ({size}) загружен на {device}")
+        return model
+    except Exception as e:
+        print(f"❌ Ошибка загрузки Whisper: {e}")
+        return WhisperModel(size, device="cpu", compute_type="int8")
+
+def _load_blip():
+    print("⏳ Загрузка модели Vision (BLIP)...")
+    processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
+    model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
+    
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model.to(device)
+    print(f"✅ Vision модель загружена на {device}")
+    return processor, model
+
+def _load_easyocr():
+    print("⏳ Загрузка EasyOCR...")
+    # Инициализируем только русский и английский
+    reader = easyocr.Reader(['ru', 'en'], gpu=torch.cuda.is_available())
+    print("✅ EasyOCR загружен")
+    return reader
+
+def _load_yolo(model_path=None):
+    print(f"⏳ Загрузка YOLO {model_path or ''}...")
+    # Бэкенд (torch / onnx / openvino) выбирается через settings.YOLO_BACKEND
+    model = load_detector_from_settings(model_path)
+    print("✅ YOLO загружен")
+    return model
+
+ModelRegistry.register('whisper', _load_whisper)
+ModelRegistry.register('blip', _load_blip)
+ModelRegistry.register('easyocr', _load_easyocr)
+ModelRegistry.register('yolo', _load_yolo)
+
+def _variant(base, variant, default, loader):
+    """
+    Имя варианта модели в ModelRegistry. Вариант по умолчанию — сама `base`,
+    остальные (уровни MODEL_TIERS) регистрируются при первом обращении.
+    """
+    if not variant or variant == default:
+        return base
+    name = f"{base}:{variant}"
+    if not ModelRegistry.is_registered(name):
+        ModelRegistry.register(name, functools.partial(loader, variant))
+    return name
+
 class LocalBrain:
-    _stt_model = None
-    _vision_model = None
-    _vision_processor = None
-    _ocr_reader = None
-    _yolo_model = None
+    """
+    Доступ к локальным моделям. Сами модели живут в ModelRegistry —
+    один экземпляр на процесс, кто бы их ни запросил.
+    """
     
     @classmethod
-    def get_stt_model(cls):
-        if cls._stt_model is None:
-            print("⏳ Загрузка модели Whisper (STT)...")
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            compute_type = "float16" if device == "cuda" else "int8"
-            
-            try:
-                # Используем tiny модель для скорости (max speed)
-                cls._stt_model = WhisperModel("tiny", device=device, compute_type=compute_type)
-                print(f"✅ Whisper (tiny) загружен на {device}")
-            except Exception as e:
-                print(f"❌ Ошибка загрузки Whisper: {e}")
-                cls._stt_model = WhisperModel("tiny", device="cpu", compute_type="int8")
-        return cls._stt_model
+    def stt_model_name(cls, size=None):
+        from django.conf import settings
+        return _variant('whisper', size, getattr(settings, 'WHISPER_MODEL', 'tiny'), _load_whisper)
+
+    @classmethod
+    def yolo_model_name(cls, model_path=None):
+        from django.conf import settings
+        return _variant('yolo', model_path, getattr(settings, 'YOLO_MODEL', 'yolov8n.pt'), _load_yolo)
+
+    @classmethod
+    def get_stt_model(cls, size=None):
+        return ModelRegistry.get(cls.stt_model_name(size))
 
     @classmethod
     def get_vision_model(cls):
-        if cls._vision_model is None:
-            print("⏳ Загрузка модели Vision (BLIP)...")
-            try:
-                cls._vision_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-                cls._vision_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
-                
-                device = "cuda" if torch.cuda.is_available() else "cpu"
-                cls._vision_model.to(device)
-                print(f"✅ Vision модель загружена на {device}")
-            except Exception as e:
-                print(f"❌ Ошибка загрузки Vision: {e}")
-        return cls._vision_processor, cls._vision_model
+        return ModelRegistry.get('blip') or (None, None)
 
     @classmethod
     def get_ocr_reader(cls):
-        if cls._ocr_reader is None:
-             print("⏳ Загрузка EasyOCR...")
-             # Инициализируем только русский и английский
-             cls._ocr_reader = easyocr.Reader(['ru', 'en'], gpu=torch.cuda.is_available())
-             print("✅ EasyOCR загружен")
-        return cls._ocr_reader
+        return ModelRegistry.get('easyocr')
 
     @classmethod
-    def get_yolo_model(cls):
-        if cls._yolo_model is None:
-            print("⏳ Загрузка YOLO...")
-            try:
-                cls._yolo_model = YOLO("yolov8n.pt") # Nano model for speed
-                print("✅ YOLO загружен")
-            except Exception as e:
-                 print(f"❌ Ошибка загрузки YOLO: {e}")
-        return cls._yolo_model
+    def get_yolo_model(cls, model_path=None):
+        return ModelRegistry.get(cls.yolo_model_name(model_path))
+
+def _in_worker_pool(kind):
+    from django.conf import settings
+    return bool(getattr(settings, 'INFERENCE_WORKERS', {}).get(kind))
+
+def _detect_queue_depth():
+    pool = InferencePool.get('detect')
+    if pool is not None:
+        return pool.pending
+    return ModelExecutors.get('detect').queue_depth + DetectionBatcher.get().queue_depth
+
+def _caption_queue_depth():
+    pool = InferencePool.get('caption')
+    return pool.pending if pool is not None else ModelExecutors.get('caption').queue_depth
+
+def _warm_detect(model_tier):
+    # В пуле процессов модели живут в воркерах — здесь грузить нечего
+    if _in_worker_pool('detect'):
+        return
+    model = ModelRegistry.acquire(LocalBrain.yolo_model_name(model_tier.get('model')))
+    if model is not None:
+        size = model_tier.get('imgsz') or 640
+        model.predict([np.zeros((size, size, 3), dtype=np.uint8)], verbose=False, imgsz=size)
+
+def _warm_stt(model_tier):
+    ModelRegistry.acquire(LocalBrain.stt_model_name(model_tier.get('model')))
+
+def _warm_caption(model_tier):
+    if not _in_worker_pool('caption'):
+        ModelRegistry.acquire('blip')
+
+ModelTiering.register_queue('detect', _detect_queue_depth)
+ModelTiering.register_queue('stt', lambda: WhisperBatcher.get().queue_depth)
+ModelTiering.register_queue('caption', _caption_queue_depth)
+ModelTiering.register_warmer('detect', _warm_detect)
+ModelTiering.register_warmer('stt', _warm_stt)
+ModelTiering.register_warmer('caption', _warm_caption)
+
+def decode_audio_file(audio_file):
+    """Загруженный файл (любой формат, который читает PyAV) -> float32 PCM 16 kHz mono."""
+    return decode_audio(audio_file, sampling_rate=16000)
+
+def _stt_options(model_tier):
+    """Параметры WhisperBatcher для уровня нагрузки: модель и потолок beam size."""
+    return {'model': model_tier.get('model'), 'max_beam': model_tier.get('beam_size')}
 
 def speech_to_text(audio_file):
-    model = LocalBrain.get_stt_model()
-    if not model:
+    try:
+        with ModelTiering.get().serve('stt') as model_tier:
+            return WhisperBatcher.get().transcribe(decode_audio_file(audio_file), tier='upload',
+                                                   **_stt_options(model_tier))
+    except Exception as e:
+        logger.error(f"STT Error: {e}")
+        return None
+
+async def speech_to_text_async(audio_file):
+    """
+    Распознаёт загруженный файл через общий батч Whisper (vision/stt_batching.py):
+    запросы разных пользователей декодируются одним проходом модели.
+    """
+    try:
+        audio = await run_in('decode', decode_audio_file, audio_file)
+        with ModelTiering.get().serve('stt') as model_tier:
+            return await WhisperBatcher.get().transcribe_async(audio, tier='upload', **_stt_options(model_tier))
+    except Exception as e:
+        logger.error(f"STT Error: {e}")
+        return None
+
+def transcribe_pcm(audio, tier='final'):
+    """
+    Распознаёт фразу из float32 PCM 16 kHz (потоковый STT, см. vision/stt_stream.py).
+    Без таймстемпов и без опоры на предыдущий текст — короткие фразы так декодируются быстрее.
+    """
+    if len(audio) == 0:
+        return None
+    try:
+        with ModelTiering.get().serve('stt') as model_tier:
+            return WhisperBatcher.get().transcribe(audio, tier=tier, **_stt_options(model_tier))
+    except Exception as e:
+        logger.error(f"STT Error: {e}")
+        return None
+
+async def transcribe_pcm_async(audio, tier='final'):
+    """То же, что transcribe_pcm, но ожидает батч, не занимая поток."""
+    if len(audio) == 0:
         return None
     try:
-        segments, info = model.transcribe(audio_file, beam_size=5)
-        text = " ".join([segment.text for segment in segments])
-        return text.strip()
+        with ModelTiering.get().serve('stt') as model_tier:
+            return await WhisperBatcher.get().transcribe_async(audio, tier=tier, **_stt_options(model_tier))
     except Exception as e:
         logger.error(f"STT Error: {e}")
         return None
 
-def analyze_image_local(image_bytes):
+# Ответ описания кадра при сбое модели (не кэшируется, см. FrameResultCache.get_or_compute)
+CAPTION_FAILED = "Не удалось распознать изображение."
+
+def analyze_image_local(image, max_new_tokens=50, raise_errors=False):
+    """
+    BLIP-описание кадра. image: Frame или байты изображения.
+    raise_errors=True — при сбое исключение вместо текста ошибки.
+    """
     processor, model = LocalBrain.get_vision_model()
     if not model:
+        if raise_errors:
+            raise RuntimeError("Vision model is not loaded")
         return "Ошибка загрузки зрения."
     try:
-        image = Image.open(BytesIO(image_bytes)).convert('RGB')
+        frame = Frame.ensure(image)
+        if frame is None:
+            raise ValueError("Image could not be decoded")
         device = "cuda" if torch.cuda.is_available() else "cpu"
-        inputs = processor(images=image, return_tensors="pt").to(device)
-        out = model.generate(**inputs, max_new_tokens=50)
+        inputs = processor(images=frame.pil, return_tensors="pt").to(device)
+        out = model.generate(**inputs, max_new_tokens=max_new_tokens)
         description = processor.decode(out[0], skip_special_tokens=True)
         return description
     except Exception as e:
         logger.error(f"Vision Error: {e}")
-        return "Не удалось распознать изображение."
+        if raise_errors:
+            raise
+        return CAPTION_FAILED
 
-def read_text_local(image_bytes):
+def read_text_local(image, raise_errors=False):
+    """
+    OCR кадра. image: Frame или байты изображения.
+    None — текста нет; при сбое тоже None, либо исключение с raise_errors=True.
+    """
     reader = LocalBrain.get_ocr_reader()
     try:
-        result = reader.readtext(image_bytes, detail=0)
+        frame = Frame.ensure(image)
+        if frame is None:
+            raise ValueError("Image could not be decoded")
+        # EasyOCR принимает BGR ndarray напрямую, без повторного декодирования
+        result = reader.readtext(frame.bgr, detail=0)
         text = " ".join(result)
         return text if text else None
     except Exception as e:
         logger.error(f"OCR Error: {e}")
+        if raise_errors:
+            raise
+        return None
+
+def prepare_detection_image(image):
+    """
+    Готовит кадр для YOLO (resize до 1280 + CLAHE). None если не декодировался.
+    image: Frame, байты или BGR ndarray.
+    """
+    frame = Frame.ensure(image, max_dim=1280)
+    if frame is None:
         return None
+    return frame.clahe
+
+def detections_from_result(result):
+    """Detections с углом обзора камеры из settings (CAMERA_HFOV / CAMERA_VFOV)."""
+    from django.conf import settings
+    return Detections.from_result(
+        result,
+        hfov=getattr(settings, 'CAMERA_HFOV', DEFAULT_HFOV),
+        vfov=getattr(settings, 'CAMERA_VFOV', DEFAULT_VFOV),
+    )
 
-def detect_objects_local(image_bytes):
-    model = LocalBrain.get_yolo_model()
-    if not model: return []
+def _detect_options(model_tier):
+    """Параметры детектора для уровня нагрузки (None — значения из settings)."""
+    return {'model': model_tier.get('model'), 'imgsz': model_tier.get('imgsz')}
+
+def detect_local(image):
+    """Структурированная детекция (боксы, уверенность, угол, расстояние)."""
     try:
-        import cv2 # Local import to avoid top-level fail if missing
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
+        img = prepare_detection_image(image)
         if img is None:
-            return []
-        
-        # Preprocessing для улучшения распознавания
-        # 1. Resize если изображение слишком большое
-        max_dimension = 1280
-        h, w = img.shape[:2]
-        if max(h, w) > max_dimension:
-            scale = max_dimension / max(h, w)
-            img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
-        
-        # 2. Улучшение контраста (CLAHE)
-        lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-        l, a, b = cv2.split(lab)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-        l = clahe.apply(l)
-        img = cv2.cvtColor(cv2.merge([l, a, b]), cv2.COLOR_LAB2BGR)
-        
-        # Детекция с оптимальными параметрами
-        results = model.predict(img, conf=0.3, iou=0.45, verbose=False)
-        detected = []
-        for r in results:
-            for c in r.boxes.cls:
-                detected.append(model.names[int(c)])
-        return list(set(detected))
+            return detections_from_result(None)
+        # Кадр уходит в общую очередь и обрабатывается батчем вместе с другими запросами
+        with ModelTiering.get().serve('detect') as model_tier:
+            result = DetectionBatcher.get().detect(img, **_detect_options(model_tier))
+        return detections_from_result(result)
+    except Exception as e:
+        print(f"YOLO Error: {e}")
+        return detections_from_result(None)
+
+async def detect_async(image, raise_errors=False):
+    """
+    Async-версия detect_local.
+    Не занимает поток пула на время инференса, поэтому кадры
+    от параллельных запросов реально попадают в один батч.
+    При сбое — пустые Detections, либо исключение с raise_errors=True.
+    """
+    try:
+        with ModelTiering.get().serve('detect') as model_tier:
+            options = _detect_options(model_tier)
+            pool = InferencePool.get('detect')
+            if pool is not None:
+                # Пре/постобработка и инференс — в отдельном процессе, кадр через shared memory
+                frame = await run_in('decode', Frame.ensure, image, max_dim=1280)
+                if frame is None:
+                    return detections_from_result(None)
+                return await pool.run(frame.bgr, options)
+
+            img = await run_in('detect', prepare_detection_image, image)
+            if img is None:
+                return detections_from_result(None)
+            result = await DetectionBatcher.get().detect_async(img, **options)
+        return detections_from_result(result)
     except Exception as e:
         print(f"YOLO Error: {e}")
-        return []
+        if raise_errors:
+            raise
+        return detections_from_result(None)
+
+async def analyze_image_async(image, raise_errors=False):
+    """BLIP-описание: в пуле процессов, если он включён, иначе в потоке."""
+    with ModelTiering.get().serve('caption') as model_tier:
+        max_new_tokens = model_tier.get('max_new_tokens', 50)
+        pool = InferencePool.get('caption')
+        if pool is None:
+            return await run_in('caption', analyze_image_local, image, max_new_tokens, raise_errors)
+        try:
+            frame = await run_in('decode', Frame.ensure, image)
+            if frame is None:
+                raise ValueError("Image could not be decoded")
+            return await pool.run(frame.bgr, {'max_new_tokens': max_new_tokens})
+        except Exception as e:
+            logger.error(f"Vision Error: {e}")
+            if raise_errors:
+                raise
+            return CAPTION_FAILED
+
+async def read_text_async(image, raise_errors=False):
+    """OCR: в пуле процессов, если он включён, иначе в потоке."""
+    pool = InferencePool.get('ocr')
+    if pool is None:
+        return await run_in('ocr', read_text_local, image, raise_errors)
+    try:
+        frame = await run_in('decode', Frame.ensure, image)
+        if frame is None:
+            raise ValueError("Image could not be decoded")
+        return await pool.run(frame.bgr)
+    except Exception as e:
+        logger.error(f"OCR Error: {e}")
+        if raise_errors:
+            raise
+        return None
+
+def detect_objects_local(image):
+    """Только имена классов (совместимость со старым API)."""
+    return detect_local(image).unique_labels()
+
+async def detect_objects_async(image):
+    return (await detect_async(image)).unique_labels()
 
 from .cag import CAGSystem
 from .tts_engine import TTSBrain
@@ -155,26 +366,7 @@ from .tts_engine import TTSBrain
 # Lazy Init Kani (можно перенести в apps.py для автозагрузки)
 # TTSBrain.init_kani() 
 
-async def generate_ai_response_async(user_text, visual_context=None, user_obj=None, ocr_context=None):
-    """
-    Генерирует ответ используя DeepSeek/OpenRouter API + CAG System.
-    """
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        return "Ошибка: Не найден API ключ (OPENAI_API_KEY)."
-
-    # 1. CAG: Обновляем состояние и память
-    cag = None
-    if user_obj:
-        cag = CAGSystem(user_obj)
-        # Оборачиваем синхронный вызов DB в async
-        await sync_to_async(cag.update_state)(user_text)
-
-    # 2. CAG: Строим умный промпт для незрячих пользователей
-    if cag:
-        system_prompt = cag.build_system_prompt(visual_context, user_query=user_text)
-    else:
-        system_prompt = """Ты WayFinder — персональный голосовой ИИ-ассистент для незрячих людей.
+DEFAULT_SYSTEM_PROMPT = """Ты WayFinder — персональный голосовой ИИ-ассистент для незрячих людей.
 
 ТВОЯ РОЛЬ:
 - Ты видишь мир глазами пользователя через камеру и описываешь окружение
@@ -198,41 +390,130 @@ async def generate_ai_response_async(user_text, visual_context=None, user_obj=No
 
 ВАЖНО: Ты активируешься только когда пользователь говорит "WayFinder" + вопрос. Отвечай только на то, что спросили."""
 
+async def _build_llm_messages(user_text, visual_context=None, user_obj=None, ocr_context=None):
+    """
+    Обновляет состояние CAG и собирает system/user сообщения для LLM.
+    Возвращает (messages, memory) — memory: факты из памяти, попавшие в промпт.
+    """
+    # 1. CAG: Обновляем состояние и память
+    cag = None
+    if user_obj:
+        cag = CAGSystem(user_obj)
+        # Оборачиваем синхронный вызов DB в async
+        await run_in('db', cag.update_state, user_text)
+
+    # 2. CAG: Строим умный промпт для незрячих пользователей
+    if cag:
+        system_prompt = cag.build_system_prompt(visual_context, user_query=user_text)
+    else:
+        system_prompt = DEFAULT_SYSTEM_PROMPT
+
     # OCR Context add
     user_prompt = user_text
     if ocr_context:
         user_prompt += f"\n\n(Текст на изображении: {ocr_context})"
 
-    # 3. LLM Call
-    base_url = "https://api.deepseek.com"
-    model_name = "deepseek-chat"
-    if api_key.startswith("sk-or-v1"):
-        base_url = "https://openrouter.ai/api/v1"
-        model_name = "deepseek/deepseek-chat"
-
-    client = AsyncOpenAI(api_key=api_key, base_url=base_url)
-    
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt}
     ]
+    return messages, (cag.rag_context if cag else "")
+
+def _response_context(visual_context, user_obj, ocr_context, detected_objects, memory=""):
+    # Вызывается после CAG update_state — факты (настроение, имя) уже актуальны
+    facts = (user_obj.facts or {}) if user_obj else {}
+    user_id = user_obj.pk if user_obj else None
+    return context_key(visual_context, ocr_context, detected_objects, facts, memory=memory, user_id=user_id)
+
+async def generate_ai_response_async(user_text, visual_context=None, user_obj=None, ocr_context=None,
+                                     detected_objects=None):
+    """
+    Генерирует ответ используя DeepSeek/OpenRouter API + CAG System.
+    Повторный вопрос про ту же сцену отдаётся из ResponseCache без запроса к API.
+    """
+    gateway = LLMGateway.get()
+    if not gateway.available:
+        return "Ошибка: Не найден API ключ (OPENAI_API_KEY)."
+
+    messages, memory = await _build_llm_messages(user_text, visual_context, user_obj, ocr_context)
+
+    cache = ResponseCache.get()
+    context = _response_context(visual_context, user_obj, ocr_context, detected_objects, memory)
+    cached = cache.lookup(user_text, context)
+    if cached is not None:
+        return cached
 
+    # 3. LLM Call (общий пул соединений, повторы и дедлайн — в шлюзе)
     try:
-        response = await client.chat.completions.create(
-            model=model_name,
-            messages=messages,
+        answer = await gateway.chat(
+            messages,
             max_tokens=300,
             temperature=0.7  # Более естественные ответы
         )
-        answer = response.choices[0].message.content
-        return answer
     except Exception as e:
         logger.error(f"DeepSeek API Error: {e}")
         return f"Извините, произошла ошибка связи. Попробуйте еще раз."
+    cache.store(user_text, context, answer)
+    return answer
+
+async def stream_ai_response_async(user_text, visual_context=None, user_obj=None, ocr_context=None,
+                                   detected_objects=None):
+    """
+    Потоковая версия generate_ai_response_async: async-генератор текстовых фрагментов
+    по мере их генерации (stream=True).
+    """
+    gateway = LLMGateway.get()
+    if not gateway.available:
+        yield "Ошибка: Не найден API ключ (OPENAI_API_KEY)."
+        return
+
+    messages, memory = await _build_llm_messages(user_text, visual_context, user_obj, ocr_context)
+
+    cache = ResponseCache.get()
+    context = _response_context(visual_context, user_obj, ocr_context, detected_objects, memory)
+    cached = cache.lookup(user_text, context)
+    if cached is not None:
+        yield cached
+        return
+
+    parts = []
+    try:
+        async for delta in gateway.stream(messages, max_tokens=300, temperature=0.7):
+            parts.append(delta)
+            yield delta
+    except Exception as e:
+        logger.error(f"DeepSeek API Error: {e}")
+        if not parts:
+            yield "Извините, произошла ошибка связи. Попробуйте еще раз."
+        return
+    cache.store(user_text, context, "".join(parts))
 
 async def text_to_speech_async(text, mood="neutral"):
     return await TTSBrain.speak(text, mood=mood)
 
+async def text_to_speech_as_async(text, mood="neutral", audio_format=None):
+    """(байты, формат): речь в согласованном с клиентом формате (см. vision/audio_response.py)."""
+    return await TTSBrain.speak_as(text, mood=mood, audio_format=audio_format)
+
+def text_to_speech_stream(text, mood="neutral"):
+    """Async-итератор кусков аудио (синтез в памяти, без файлов)."""
+    return TTSBrain.speak_stream(text, mood=mood)
+
+async def speak_response_stream(user_text, visual_context=None, user_obj=None, ocr_context=None, mood="neutral",
+                                detected_objects=None, audio_format=None):
+    """
+    Ответ LLM, озвученный по предложениям: async-генератор (index, sentence, audio, format).
+    TTS первого предложения начинается, пока модель ещё генерирует остальные.
+    """
+    deltas = stream_ai_response_async(user_text, visual_context, user_obj, ocr_context, detected_objects)
+
+    async def synthesize(sentence):
+        return await text_to_speech_as_async(sentence, mood=mood, audio_format=audio_format)
+
+    async for index, sentence, result in speak_sentences(deltas, synthesize):
+        audio, fmt = result if result else (None, None)
+        yield index, sentence, audio, fmt
+
 def get_ai_response_sync(text, visual_context=None):
     return asyncio.run(generate_ai_response_async(text, visual_context))
 
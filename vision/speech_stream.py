@@ -0,0 +1,161 @@
+"""
+Потоковая озвучка ответа LLM.
+
+Ответ модели приходит по токенам (stream=True). SentenceSplitter собирает их
+в предложения, а speak_sentences запускает TTS первого предложения, пока
+остальные токены ещё идут, и отдаёт аудио строго по порядку. Пользователь
+слышит начало ответа примерно через время генерации первого предложения,
+а не всего ответа.
+"""
+import asyncio
+import logging
+import queue
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Конец предложения: . ! ? … (в т.ч. несколько подряд и с закрывающей кавычкой/скобкой) + пробел
+_SENTENCE_END = re.compile(r'[.!?…]+["»)\]]*\s+|\n+')
+# Границы частей длинного предложения, по которым его можно резать
+_CLAUSE_MARKS = (',', ';', ':')
+
+
+class SentenceSplitter:
+    """
+    Инкрементальное разбиение текста на предложения.
+
+    min_chars — слишком короткие куски («Да.», «1.») приклеиваются к следующему
+    max_chars — длинное предложение без точки режется по последней запятой
+                (или ; :) не ближе min_chars от начала, а если её нет — по пробелу,
+                чтобы TTS не ждал конца абзаца
+    """
+
+    def __init__(self, min_chars: int = 12, max_chars: int = 200):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, delta: str) -> list:
+        """Добавляет фрагмент и возвращает готовые предложения (возможно, пустой список)."""
+        self._buffer += delta
+        sentences = []
+        start = 0
+        for match in _SENTENCE_END.finditer(self._buffer):
+            if match.end() - start < self.min_chars:
+                continue
+            sentences.append(self._buffer[start:match.end()].strip())
+            start = match.end()
+        self._buffer = self._buffer[start:]
+
+        while len(self._buffer) > self.max_chars:
+            # Граница фразы звучит естественнее, чем разрыв посреди неё по пробелу
+            cut = max(self._buffer.rfind(mark, 0, self.max_chars) for mark in _CLAUSE_MARKS)
+            if cut < self.min_chars:
+                cut = self._buffer.rfind(' ', 0, self.max_chars)
+            if cut <= 0:
+                cut = self.max_chars
+            sentences.append(self._buffer[:cut + 1].strip())
+            self._buffer = self._buffer[cut + 1:]
+
+        return [s for s in sentences if s]
+
+    def flush(self) -> list:
+        """Остаток буфера в конце потока."""
+        tail, self._buffer = self._buffer.strip(), ""
+        return [tail] if tail else []
+
+
+async def speak_sentences(deltas, synthesize, max_parallel: int = 2):
+    """
+    Озвучивает поток текста по предложениям.
+
+    deltas     — async-итератор текстовых фрагментов (токены LLM)
+    synthesize — async def synthesize(sentence) -> bytes | None
+    Возвращает async-генератор кортежей (index, sentence, audio) в порядке предложений.
+    TTS следующих предложений (до max_parallel одновременно) идёт, пока
+    клиент получает предыдущие.
+    """
+    splitter = SentenceSplitter()
+    semaphore = asyncio.Semaphore(max_parallel)
+    pending = asyncio.Queue()
+
+    async def synthesize_limited(sentence):
+        async with semaphore:
+            try:
+                return await synthesize(sentence)
+            except Exception as e:
+                logger.error(f"Streaming TTS error: {e}")
+                return None
+
+    async def produce():
+        try:
+            async for delta in deltas:
+                for sentence in splitter.feed(delta):
+                    pending.put_nowait((sentence, asyncio.ensure_future(synthesize_limited(sentence))))
+            for sentence in splitter.flush():
+                pending.put_nowait((sentence, asyncio.ensure_future(synthesize_limited(sentence))))
+        finally:
+            pending.put_nowait(None)
+
+    producer = asyncio.ensure_future(produce())
+    index = 0
+    try:
+        while True:
+            item = await pending.get()
+            if item is None:
+                break
+            sentence, task = item
+            yield index, sentence, await task
+            index += 1
+        # Пробрасываем ошибку чтения потока LLM, если она была
+        await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
+        while not pending.empty():
+            item = pending.get_nowait()
+            if item is not None:
+                item[1].cancel()
+
+
+def iterate_in_thread(aiterable):
+    """
+    Синхронный итератор по async-итератору, который выполняется в собственном
+    event loop в отдельном потоке; элементы передаются через очередь.
+
+    Под WSGI StreamingHttpResponse с async-итератором собирается Django целиком
+    (async_to_sync) и уходит клиенту одним куском — первое аудио ждало бы весь
+    ответ. Синхронный итератор WSGI-сервер отправляет по мере получения.
+    Закрытие итератора (клиент ушёл) останавливает генерацию.
+    """
+    items = queue.Queue()
+    stop = threading.Event()
+    done = object()
+
+    async def pump():
+        try:
+            async for item in aiterable:
+                items.put((item, None))
+                if stop.is_set():
+                    break
+        except Exception as e:
+            items.put((done, e))
+            return
+        finally:
+            if hasattr(aiterable, 'aclose'):
+                await aiterable.aclose()
+        items.put((done, None))
+
+    thread = threading.Thread(target=asyncio.run, args=(pump(),), name="stream-producer", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
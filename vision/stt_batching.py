@@ -0,0 +1,258 @@
+"""
+Батчевое распознавание речи Whisper для всех запросов процесса.
+
+Фразы от потокового STT (WebSocket) и загруженные файлы (/api/smart-analyze/,
+/api/navigate/) складываются в одну очередь. Фоновый поток собирает их в
+течение `window_ms` (или пока не наберётся `max_batch`) и делает один проход
+энкодера и один generate CTranslate2 на весь батч — так же, как это делает
+BatchedInferencePipeline faster-whisper, но по фразам разных пользователей,
+а не по кускам одного файла. Результаты раздаются обратно через Future.
+
+Beam size задаётся уровнем задержки (tier): промежуточный текст — жадно,
+загруженный файл — с полным beam search. Уровень нагрузки (vision/tiering.py)
+может сменить модель и ограничить beam size сверху. Фразы с разной моделью
+или beam size декодируются отдельными generate внутри одного окна.
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+# Окно энкодера Whisper
+CHUNK_SECONDS = 30
+DEFAULT_TIERS = {'partial': 1, 'final': 1, 'upload': 5}
+
+
+def split_audio(audio: np.ndarray, sample_rate: int = SAMPLE_RATE, max_seconds: float = CHUNK_SECONDS,
+                frame_ms: int = 30, search_seconds: float = 5.0, silence_db: float = -50.0):
+    """
+    Режет запись на куски не длиннее окна Whisper. Разрез ставится в самом тихом
+    кадре последних search_seconds перед границей, чтобы не рвать слово.
+    Куски, целиком состоящие из тишины, отбрасываются.
+    """
+    max_len = int(max_seconds * sample_rate)
+    frame = sample_rate * frame_ms // 1000
+    chunks = []
+    start = 0
+    while start < len(audio):
+        end = min(start + max_len, len(audio))
+        if end < len(audio):
+            window = audio[max(end - int(search_seconds * sample_rate), start):end]
+            usable = len(window) - len(window) % frame
+            if usable:
+                energy = (window[:usable].reshape(-1, frame) ** 2).mean(axis=1)
+                end = end - len(window) + (int(np.argmin(energy)) + 1) * frame
+        chunk = audio[start:end]
+        peak = float(np.sqrt((chunk ** 2).mean())) if len(chunk) else 0.0
+        if 20 * np.log10(peak + 1e-10) > silence_db:
+            chunks.append(chunk)
+        start = end
+    return chunks
+
+
+class WhisperBatcher:
+    """
+    Общая очередь распознавания Whisper.
+
+    submit(audio, tier) принимает float32 PCM 16 kHz не длиннее 30 с;
+    transcribe / transcribe_async режут длинные записи сами.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, model_getter, window_ms=30.0, max_batch=8, tiers=None, language=None,
+                 no_speech_threshold=0.6):
+        self._model_getter = model_getter
+        self.window = max(window_ms, 0.0) / 1000.0
+        self.max_batch = max(int(max_batch), 1)
+        self.tiers = dict(DEFAULT_TIERS, **(tiers or {}))
+        self.language = language
+        self.no_speech_threshold = no_speech_threshold
+
+        self._queue = queue.Queue()
+        self._batched = True  # False — установленный faster-whisper не поддерживает батчевый путь
+        self._stats_lock = threading.Lock()
+        self._stats = {"batches": 0, "segments": 0, "max_batch_seen": 0, "fallback_segments": 0,
+                       "tiers": {tier: 0 for tier in self.tiers}}
+
+        self._thread = threading.Thread(target=self._run, name="whisper-batcher", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def get(cls):
+        """Singleton, настроенный из settings.STT_BATCH."""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    from django.conf import settings
+                    from .services import LocalBrain
+
+                    config = getattr(settings, 'STT_BATCH', {})
+                    cls._instance = cls(
+                        LocalBrain.get_stt_model,
+                        window_ms=config.get('window_ms', 30.0),
+                        max_batch=config.get('max_batch', 8),
+                        tiers=config.get('tiers'),
+                        language=config.get('language'),
+                    )
+        return cls._instance
+
+    def beam_size(self, tier: str) -> int:
+        return max(int(self.tiers.get(tier, self.tiers['final'])), 1)
+
+    def submit(self, audio: np.ndarray, tier: str = 'final', language: str = None,
+               model: str = None, max_beam: int = None) -> Future:
+        """
+        Ставит фразу (до 30 с) в очередь. Возвращает Future с текстом.
+        model — размер Whisper (None — WHISPER_MODEL), max_beam — ограничение beam size уровнем нагрузки.
+        """
+        beam_size = self.beam_size(tier)
+        if max_beam:
+            beam_size = min(beam_size, max(int(max_beam), 1))
+        future = Future()
+        self._queue.put((np.asarray(audio, dtype=np.float32), tier, language or self.language,
+                         model, beam_size, future))
+        return future
+
+    def transcribe(self, audio: np.ndarray, tier: str = 'final', language: str = None, **options) -> str:
+        """Блокирующий вызов для синхронного кода."""
+        futures = [self.submit(chunk, tier, language, **options) for chunk in split_audio(audio)]
+        return " ".join(text for text in (future.result() for future in futures) if text).strip()
+
+    async def transcribe_async(self, audio: np.ndarray, tier: str = 'final', language: str = None,
+                               **options) -> str:
+        """Ожидание результата из корутины без занятия потока."""
+        futures = [asyncio.wrap_future(self.submit(chunk, tier, language, **options))
+                   for chunk in split_audio(audio)]
+        texts = await asyncio.gather(*futures)
+        return " ".join(text for text in texts if text).strip()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats, tiers=dict(self._stats["tiers"]))
+        stats["avg_batch"] = stats["segments"] / stats["batches"] if stats["batches"] else 0.0
+        stats["queued"] = self._queue.qsize()
+        stats["beam_sizes"] = {tier: self.beam_size(tier) for tier in self.tiers}
+        return stats
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._process(batch)
+
+    def _process(self, batch):
+        # Отменённые запросы (клиент ушёл, фраза устарела) не тратят место в батче
+        batch = [item for item in batch if item[-1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        groups = {}
+        for item in batch:
+            groups.setdefault((item[3], item[4]), []).append(item)
+
+        for (model_size, beam_size), items in groups.items():
+            try:
+                model = self._model_getter(model_size)
+                if model is None:
+                    raise RuntimeError("Whisper model is not loaded")
+                texts = self._decode(model, items, beam_size)
+            except Exception as e:
+                logger.error(f"Whisper batch error ({len(items)} segments): {e}")
+                for *_, future in items:
+                    future.set_exception(e)
+                continue
+            for (*_, future), text in zip(items, texts):
+                future.set_result(text)
+
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["segments"] += len(batch)
+            self._stats["max_batch_seen"] = max(self._stats["max_batch_seen"], len(batch))
+            for _, tier, *_ in batch:
+                self._stats["tiers"][tier] = self._stats["tiers"].get(tier, 0) + 1
+
+    def _decode(self, model, items, beam_size):
+        if self._batched:
+            try:
+                return self._decode_batched(model, items, beam_size)
+            except (AttributeError, ImportError, TypeError) as e:
+                # Старый faster-whisper без нужного API — дальше по одной фразе
+                logger.warning(f"Batched Whisper unavailable, falling back to sequential decode: {e}")
+                self._batched = False
+        with self._stats_lock:
+            self._stats["fallback_segments"] += len(items)
+        return [self._decode_single(model, audio, beam_size, language) for audio, _, language, *_ in items]
+
+    def _decode_batched(self, model, items, beam_size):
+        from faster_whisper.audio import pad_or_trim
+        from faster_whisper.tokenizer import Tokenizer
+
+        features = np.stack([pad_or_trim(model.feature_extractor(audio)) for audio, *_ in items])
+        encoder_output = model.encode(features)
+
+        multilingual = model.model.is_multilingual
+        languages = [language for _, _, language, *_ in items]
+        if multilingual and any(language is None for language in languages):
+            detected = model.model.detect_language(encoder_output)
+            languages = [language or ranked[0][0][2:-2] for language, ranked in zip(languages, detected)]
+
+        tokenizers = {}
+        prompts = []
+        for language in languages:
+            language = language if multilingual else None
+            if language not in tokenizers:
+                tokenizers[language] = Tokenizer(model.hf_tokenizer, multilingual,
+                                                 task='transcribe', language=language)
+            tokenizer = tokenizers[language]
+            prompts.append(list(tokenizer.sot_sequence) + [tokenizer.no_timestamps])
+
+        results = model.model.generate(
+            encoder_output,
+            prompts,
+            beam_size=beam_size,
+            max_length=model.max_length,
+            suppress_blank=True,
+            return_no_speech_prob=True,
+        )
+
+        tokenizer = next(iter(tokenizers.values()))
+        texts = []
+        for result in results:
+            if result.no_speech_prob > self.no_speech_threshold:
+                texts.append("")
+                continue
+            tokens = [token for token in result.sequences_ids[0] if token < tokenizer.eot]
+            texts.append(tokenizer.decode(tokens).strip())
+        return texts
+
+    @staticmethod
+    def _decode_single(model, audio, beam_size, language):
+        segments, _ = model.transcribe(
+            audio,
+            beam_size=beam_size,
+            language=language,
+            condition_on_previous_text=False,
+            without_timestamps=True,
+        )
+        return " ".join(segment.text for segment in segments).strip()
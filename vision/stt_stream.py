@@ -0,0 +1,198 @@
+"""
+Потоковое распознавание речи.
+
+Клиент шлёт PCM 16 kHz mono int16 кусками по мере записи. EnergyVAD режет
+поток на фразы по энергии сигнала (с адаптивным уровнем шума), а
+StreamingTranscriber пока пользователь говорит периодически выдаёт
+промежуточный текст (partial), а после паузы — финальный (final) по всей
+фразе. Финальный текст готов примерно через silence_ms + время одного
+прохода Whisper по короткой фразе, а не после загрузки файла и полного
+декодирования.
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EnergyVAD:
+    """
+    Детектор речи по энергии кадров frame_ms.
+
+    Кадр считается речью, если его уровень (dBFS) выше уровня шума на margin_db.
+    Уровень шума отслеживается скользящим средним по кадрам без речи.
+    Фраза начинается после start_frames речевых кадров подряд и заканчивается
+    после silence_ms тишины.
+    """
+
+    def __init__(self, sample_rate: int = 16000, frame_ms: int = 30, margin_db: float = 10.0,
+                 min_db: float = -50.0, start_frames: int = 3, silence_ms: int = 400, preroll_ms: int = 300):
+        self.sample_rate = sample_rate
+        self.frame_size = sample_rate * frame_ms // 1000
+        self.margin_db = margin_db
+        self.min_db = min_db
+        self.start_frames = start_frames
+        self.silence_frames = max(silence_ms // frame_ms, 1)
+        self.noise_db = None
+        self.in_speech = False
+        self._voiced_run = 0
+        self._silent_run = 0
+        self._preroll = deque(maxlen=max(preroll_ms // frame_ms, start_frames))
+
+    def is_speech(self, frame: np.ndarray) -> bool:
+        rms = math.sqrt(float(np.mean(frame * frame))) if len(frame) else 0.0
+        level = 20 * math.log10(rms + 1e-10)
+        if self.noise_db is None:
+            self.noise_db = level
+        speech = level > max(self.noise_db + self.margin_db, self.min_db)
+        if not speech:
+            self.noise_db = 0.95 * self.noise_db + 0.05 * level
+        return speech
+
+    def end(self):
+        """Принудительно завершает текущую фразу."""
+        self.in_speech = False
+        self._voiced_run = 0
+        self._silent_run = 0
+
+    def process(self, frame: np.ndarray):
+        """
+        Обрабатывает один кадр. Возвращает (событие, кадры):
+        ('start', кадры с предзаписью) | ('speech', [frame]) | ('end', []) | (None, []).
+        """
+        speech = self.is_speech(frame)
+        if not self.in_speech:
+            self._preroll.append(frame)
+            self._voiced_run = self._voiced_run + 1 if speech else 0
+            if self._voiced_run >= self.start_frames:
+                self.in_speech = True
+                self._silent_run = 0
+                frames = list(self._preroll)
+                self._preroll.clear()
+                return 'start', frames
+            return None, []
+
+        self._silent_run = 0 if speech else self._silent_run + 1
+        if self._silent_run >= self.silence_frames:
+            self.end()
+            return 'end', []
+        return 'speech', [frame]
+
+
+class StreamingTranscriber:
+    """
+    Сессия потокового STT одного соединения.
+
+    transcribe — async-функция (audio float32, tier) -> str; tier 'partial' или 'final'
+                 задаёт beam size в общем батче Whisper (settings.STT_BATCH['tiers'])
+    on_event   — async-колбэк для событий {'type': 'transcript', 'final': bool, 'text': ..., 'utterance': n}
+    """
+
+    def __init__(self, transcribe, on_event, sample_rate: int = 16000, silence_ms: int = 400,
+                 partial_interval: float = 0.6, max_utterance_s: float = 15.0, margin_db: float = 10.0):
+        self.transcribe = transcribe
+        self.on_event = on_event
+        self.sample_rate = sample_rate
+        self.partial_interval = partial_interval
+        self.max_samples = int(max_utterance_s * sample_rate)
+        self.vad = EnergyVAD(sample_rate, silence_ms=silence_ms, margin_db=margin_db)
+
+        self._pending = np.zeros(0, dtype=np.float32)  # хвост, не набравший целого кадра VAD
+        self._utterance = []
+        self._utterance_samples = 0
+        self._utterance_id = 0
+        self._last_partial_samples = 0
+        self._partial_task = None
+        self._final_task = None
+        self._tasks = set()
+
+    async def feed(self, pcm: bytes):
+        """Принимает кусок PCM int16 little-endian."""
+        samples = np.frombuffer(pcm[:len(pcm) - len(pcm) % 2], dtype='<i2').astype(np.float32) / 32768.0
+        audio = np.concatenate([self._pending, samples])
+        size = self.vad.frame_size
+        usable = len(audio) - len(audio) % size
+        self._pending = audio[usable:]
+
+        for start in range(0, usable, size):
+            event, frames = self.vad.process(audio[start:start + size])
+            if event == 'start':
+                self._utterance_id += 1
+                self._utterance = []
+                self._utterance_samples = 0
+                self._last_partial_samples = 0
+            if frames:
+                self._utterance.extend(frames)
+                self._utterance_samples += sum(len(f) for f in frames)
+            if event == 'end' or (self.vad.in_speech and self._utterance_samples >= self.max_samples):
+                self._finish_utterance()
+
+        if self.vad.in_speech:
+            self._maybe_partial()
+
+    def flush(self):
+        """
+        Конец записи (клиент отпустил кнопку): завершает текущую фразу, не дожидаясь тишины.
+        Возвращает задачу финального распознавания (или None).
+        """
+        if self.vad.in_speech:
+            self._finish_utterance()
+        return self._final_task
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+
+    def _maybe_partial(self):
+        due = self._utterance_samples - self._last_partial_samples >= self.partial_interval * self.sample_rate
+        # Не больше одного промежуточного распознавания одновременно
+        if due and (self._partial_task is None or self._partial_task.done()):
+            self._last_partial_samples = self._utterance_samples
+            audio = np.concatenate(self._utterance)
+            self._partial_task = self._spawn(self._partial(self._utterance_id, audio))
+
+    def _finish_utterance(self):
+        if not self._utterance:
+            return
+        audio = np.concatenate(self._utterance)
+        self._utterance = []
+        self._utterance_samples = 0
+        self.vad.end()
+        self._final_task = self._spawn(self._final(self._utterance_id, audio, self._final_task))
+
+    async def _partial(self, utterance_id, audio):
+        text = await self.transcribe(audio, 'partial')
+        # Фраза уже закончилась — промежуточный текст устарел
+        if text and utterance_id == self._utterance_id and self.vad.in_speech:
+            await self.on_event({'type': 'transcript', 'final': False, 'text': text, 'utterance': utterance_id})
+
+    async def _final(self, utterance_id, audio, previous):
+        started = time.perf_counter()
+        text = await self.transcribe(audio, 'final')
+        # Финальные тексты отдаём строго по порядку фраз
+        if previous is not None:
+            await asyncio.wait({previous})
+        await self.on_event({
+            'type': 'transcript',
+            'final': True,
+            'text': text or "",
+            'utterance': utterance_id,
+            'audio_ms': round(len(audio) / self.sample_rate * 1000),
+            'latency_ms': round((time.perf_counter() - started) * 1000, 1),
+        })
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Streaming STT error: {task.exception()}")
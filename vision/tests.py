@@ -1,3 +1,968 @@
-from django.test import TestCase
+import asyncio
+import base64
+import importlib.util
+import io
+import json
+import tempfile
+import threading
+import time
+import unittest
+import wave
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
 
-# Create your tests here.
+import numpy as np
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.utils import timezone
+
+from .audio_response import negotiate_audio_format, speech_response
+from .batching import DetectionBatcher
+from .detections import Detections
+from .detectors import DetectorBoxes, DetectorResult, _ExportedDetector, _parse_imgsz, _parse_names, nms
+from .embeddings import HashingEmbedder
+from .executors import ModelExecutors, NamedExecutor, run_in
+from .frame import Frame
+from .frame_cache import FrameResultCache
+from .llm_gateway import LLMError, LLMGateway, Provider
+from .models import ChatMessage, VisionUser
+from .motion import MotionGate
+from .pipeline import Pipeline, Stage
+from .registry import ModelRegistry
+from .response_cache import ResponseCache, context_key
+from .speech_stream import SentenceSplitter, iterate_in_thread
+from .stt_batching import CHUNK_SECONDS, SAMPLE_RATE, WhisperBatcher, split_audio
+from .stt_stream import StreamingTranscriber
+from .text_index import BM25Index, stems
+from .tiering import ModelTiering, StageTiers, track_tiers
+from .tracking import ObjectTracker
+from .tts_system.audio import KANI_SAMPLE_RATE, encode_wav
+from .vector_memory import EmbeddingIndex, VectorMemory
+from .workers import InferencePool, SharedFrameRing
+
+
+class ResponseCacheMemoryTests(SimpleTestCase):
+    """Ответы, построенные на личной памяти, не должны переходить к другому пользователю."""
+
+    QUERY = "какая у меня собака"
+    SCENE = dict(visual_context="a dog on the grass", detected_objects=["dog"])
+
+    def setUp(self):
+        self.cache = ResponseCache(semantic=True)
+        self.memory_a = VectorMemory(tempfile.mkdtemp())
+        self.memory_b = VectorMemory(tempfile.mkdtemp())
+        self.memory_a.add_fact("У меня есть собака по кличке Шарик")
+        self.memory_b.add_fact("У меня есть собака породы такса по кличке Бобик")
+
+    def _key(self, user_id, memory):
+        return context_key(**self.SCENE, memory=memory.get_context_string(self.QUERY), user_id=user_id)
+
+    def test_answer_is_not_shared_between_users_with_different_memories(self):
+        self.cache.store(self.QUERY, self._key(1, self.memory_a), "Твою собаку зовут Шарик")
+
+        self.assertEqual(self.cache.lookup(self.QUERY, self._key(1, self.memory_a)), "Твою собаку зовут Шарик")
+        self.assertIsNone(self.cache.lookup(self.QUERY, self._key(2, self.memory_b)))
+
+    def test_new_fact_invalidates_memory_based_answer(self):
+        key = self._key(1, self.memory_a)
+        self.cache.store(self.QUERY, key, "Твою собаку зовут Шарик")
+
+        self.memory_a.add_fact("Моя собака теперь живёт у бабушки")
+        self.assertNotEqual(self._key(1, self.memory_a), key)
+        self.assertIsNone(self.cache.lookup(self.QUERY, self._key(1, self.memory_a)))
+
+    def test_scene_answers_without_memory_are_shared(self):
+        self.cache.store("что впереди", context_key(**self.SCENE, user_id=1), "Впереди собака")
+        self.assertEqual(self.cache.lookup("что впереди", context_key(**self.SCENE, user_id=2)), "Впереди собака")
+
+
+class _FakeFrame:
+    def __init__(self, content_hash, dhash):
+        self.content_hash = content_hash
+        self.dhash = dhash
+
+
+class FrameResultCacheTests(SimpleTestCase):
+    """Сбой модели не должен кэшироваться для соседних кадров."""
+
+    async def test_failure_is_not_cached(self):
+        cache = FrameResultCache(ttl=60.0)
+        frame, neighbour = _FakeFrame(b"a", 0b1010), _FakeFrame(b"b", 0b1011)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError("YOLO failed")
+            return ["car"]
+
+        self.assertEqual(await cache.get_or_compute(frame, 'detect', compute, fallback=[]), [])
+        self.assertEqual(cache.stats["size"], 0)
+
+        self.assertEqual(await cache.get_or_compute(neighbour, 'detect', compute, fallback=[]), ["car"])
+        # Третий вызов — из кэша (почти такой же кадр), без повторного инференса
+        self.assertEqual(await cache.get_or_compute(frame, 'detect', compute, fallback=[]), ["car"])
+        self.assertEqual(len(calls), 2)
+
+    async def test_empty_result_is_cached(self):
+        cache = FrameResultCache(ttl=60.0)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            return None  # OCR: текста на кадре нет
+
+        self.assertIsNone(await cache.get_or_compute(_FakeFrame(b"a", 0b1010), 'ocr', compute))
+        self.assertIsNone(await cache.get_or_compute(_FakeFrame(b"b", 0b1011), 'ocr', compute))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats["near_hits"], 1)
+
+
+class ObjectTrackerTests(SimpleTestCase):
+
+    def test_stationary_object_stays_active_without_delta(self):
+        tracker = ObjectTracker(min_hits=2)
+        box = [[0.4, 0.4, 0.6, 0.8]]
+        tracker.update(box, [0.9], ["car"])
+        self.assertTrue(tracker.update(box, [0.9], ["car"]))
+
+        # Машина стоит на месте: изменений нет, но она по-прежнему в сцене
+        self.assertFalse(tracker.update(box, [0.9], ["car"]))
+        self.assertEqual(tracker.active_labels(), ["car"])
+        tracker.predict()
+        self.assertEqual(tracker.active_labels(), ["car"])
+
+
+class KyrgyzStemmingTests(SimpleTestCase):
+    """Кыргызские словоформы без букв ө, ү, ң тоже сводятся к корню."""
+
+    def test_plural_suffixes(self):
+        for word, root in [("шаарлар", "шаар"), ("мектептер", "мектеп"), ("балдар", "бал"),
+                           ("кыздар", "кыз"), ("иттер", "ит"), ("үйлөр", "үй")]:
+            with self.subTest(word=word):
+                self.assertIn(root, stems(word))
+
+    def test_possessive_suffixes(self):
+        for word, root in [("итим", "ит"), ("балдарым", "бал"), ("досум", "дос"),
+                           ("китептерибиз", "китеп"), ("иттерибизге", "ит")]:
+            with self.subTest(word=word):
+                self.assertIn(root, stems(word))
+
+    def test_russian_forms_still_match(self):
+        self.assertTrue(stems("собака") & stems("собаку") & stems("собаки"))
+
+    def test_short_stems_do_not_overmatch_russian(self):
+        for word in ("нога", "банан", "лето"):
+            with self.subTest(word=word):
+                self.assertTrue(all(len(stem) >= 3 for stem in stems(word)))
+        self.assertFalse(stems("коты") & stems("кони"))
+
+        index = BM25Index()
+        index.add(0, "Мне нравятся кони")
+        self.assertEqual(index.search("коты"), [])
+
+    def test_inflected_query_finds_fact(self):
+        index = BM25Index()
+        index.add(0, "Менин итим бар, аты Бобик")
+        index.add(1, "У меня есть собака Шарик")
+        self.assertEqual(index.search("иттер", top_k=1)[0][0], 0)
+        self.assertEqual(index.search("собаки", top_k=1)[0][0], 1)
+
+
+class NMSTests(SimpleTestCase):
+
+    def test_overlapping_boxes_of_different_classes_are_kept(self):
+        # Неклиппированные боксы у края кадра: координаты отрицательные
+        boxes = np.array([[-50, -50, 10, 10], [-50, -50, 10, 10]], dtype=np.float32)
+        scores = np.array([0.9, 0.8], dtype=np.float32)
+
+        self.assertEqual(sorted(nms(boxes, scores, 0.45, classes=np.array([0, 1]))), [0, 1])
+        self.assertEqual(list(nms(boxes, scores, 0.45, classes=np.array([0, 0]))), [0])
+
+
+class _CannedDetector(_ExportedDetector):
+    """Экспортированный YOLOv8 с заранее заданным выходом сети (4 + классы, N)."""
+
+    def __init__(self, output):
+        super().__init__({0: 'person', 1: 'dog'}, imgsz=640)
+        self.output = np.asarray(output, dtype=np.float32)
+
+    def _infer(self, batch):
+        self.batch_shape = batch.shape
+        return np.stack([self.output] * len(batch))
+
+
+class ExportedDetectorTests(SimpleTestCase):
+    """Постобработка ONNX/OpenVINO: порог, NMS по классам и обратный letterbox."""
+
+    def test_postprocess_maps_boxes_back_to_frame(self):
+        # cx, cy, w, h в координатах letterbox 640x640 и скоры классов person / dog
+        detector = _CannedDetector(np.array([
+            [320, 320, 100, 100, 0.9, 0.0],
+            [322, 320, 100, 100, 0.8, 0.0],   # дубль person — подавляется NMS
+            [322, 320, 100, 100, 0.0, 0.7],   # dog на том же месте — другой класс, остаётся
+            [100, 100, 50, 50, 0.1, 0.0],     # ниже порога
+        ]).T)
+        # 1280x320 -> масштаб 0.5, по вертикали отступ 240
+        result = detector.predict([np.zeros((320, 1280, 3), dtype=np.uint8)], conf=0.25)[0]
+
+        self.assertEqual(detector.batch_shape, (1, 3, 640, 640))
+        self.assertEqual(result.boxes.cls.tolist(), [0.0, 1.0])
+        np.testing.assert_allclose(result.boxes.xyxy[0], [540, 60, 740, 260])
+        self.assertEqual(Detections.from_result(result).labels, ['person', 'dog'])
+
+    def test_export_metadata_parsing(self):
+        self.assertEqual(_parse_names("{0: 'person', 1: 'bicycle'}"), {0: 'person', 1: 'bicycle'})
+        self.assertEqual(_parse_imgsz("[480, 640]", 320), 640)
+        self.assertEqual(_parse_imgsz(None, 320), 320)
+
+
+class SentenceSplitterTests(SimpleTestCase):
+
+    def test_long_clause_is_cut_at_comma(self):
+        splitter = SentenceSplitter(min_chars=12, max_chars=60)
+        text = ("Впереди пешеходный переход и светофор, "
+                "справа от вас остановка автобуса и несколько скамеек без навеса")
+        chunks = splitter.feed(text)
+
+        self.assertEqual(chunks[0], "Впереди пешеходный переход и светофор,")
+        self.assertEqual(" ".join(chunks + splitter.flush()), text)
+
+    def test_falls_back_to_space_without_comma(self):
+        splitter = SentenceSplitter(min_chars=12, max_chars=30)
+        chunks = splitter.feed("очень длинная фраза совсем без знаков препинания внутри")
+
+        self.assertEqual(chunks[0], "очень длинная фраза совсем")
+
+
+class StreamBridgeTests(SimpleTestCase):
+    """Под WSGI NDJSON-ответ должен уходить построчно, а не после всего ответа LLM."""
+
+    def test_first_chunk_arrives_before_llm_finishes(self):
+        llm_finished = threading.Event()
+        release_llm = threading.Event()
+
+        async def stream_chat():
+            yield "vision\n"
+            # «LLM» отвечает только после того, как клиент получил первую строку
+            while not release_llm.is_set():
+                await asyncio.sleep(0.01)
+            llm_finished.set()
+            yield "audio\n"
+
+        chunks = iterate_in_thread(stream_chat())
+        self.assertEqual(next(chunks), "vision\n")
+        self.assertFalse(llm_finished.is_set())
+
+        release_llm.set()
+        self.assertEqual(list(chunks), ["audio\n"])
+        self.assertTrue(llm_finished.is_set())
+
+    def test_producer_error_is_raised_to_consumer(self):
+        async def failing():
+            yield "vision\n"
+            raise RuntimeError("LLM failed")
+
+        chunks = iterate_in_thread(failing())
+        self.assertEqual(next(chunks), "vision\n")
+        with self.assertRaises(RuntimeError):
+            next(chunks)
+
+
+class VectorMemorySharedDirectoryTests(SimpleTestCase):
+    """Память одного пользователя пишут два процесса (Django и WS-сервер) — ничего не теряется."""
+
+    def test_interleaved_writers_keep_all_facts_and_vectors(self):
+        directory = tempfile.mkdtemp()
+        first, second = VectorMemory(directory), VectorMemory(directory)
+        for memory in (first, second):
+            # Частая компакция: снапшот из устаревшей памяти не должен затирать чужие факты
+            memory.log.compact_every = 3
+        texts = [f"Факт номер {i}: предмет{i} лежит на полке{i}" for i in range(10)]
+        for i, text in enumerate(texts):
+            (first if i % 2 == 0 else second).add_fact(text)
+        for memory in (first, second):
+            if memory.log._compaction is not None:
+                memory.log._compaction.join()
+
+        reloaded = VectorMemory(directory)
+        self.assertEqual([entry["text"] for entry in reloaded.data], texts)
+        self.assertEqual(len(reloaded.index), len(texts))
+        # Строка эмбеддинга i соответствует факту i
+        for i, text in enumerate(texts):
+            self.assertEqual(reloaded.index.search(text, top_k=1)[0][0], i)
+
+    def test_cached_instance_sees_facts_written_after_lookup(self):
+        directory = tempfile.mkdtemp()
+        cached = VectorMemory.for_user("stale-check", base_path=directory)
+        # «Другой процесс» пишет в тот же каталог уже после выдачи экземпляра из кэша
+        other = VectorMemory(cached.persistence_path)
+        other.add_fact("У меня есть кошка Мурка")
+
+        self.assertEqual([entry["text"] for entry in cached.search("кошка")], ["У меня есть кошка Мурка"])
+        cached.add_fact("Я люблю чай")
+        self.assertEqual(len(VectorMemory(cached.persistence_path).data), 2)
+
+
+@unittest.skipUnless(importlib.util.find_spec('torch'), "TTSConfig требует torch")
+class TTSCacheAsyncTests(SimpleTestCase):
+    """Горячий уровень отвечает на loop, файлы читаются и пишутся в пуле 'tts'."""
+
+    def _submitted(self):
+        return ModelExecutors.get('tts').stats["submitted"]
+
+    async def test_disk_io_goes_through_tts_pool(self):
+        from .tts_system.cache import TTSCache
+        directory = tempfile.mkdtemp()
+        cache = TTSCache(directory, hot_bytes=4)
+        submitted = self._submitted()
+
+        self.assertEqual(await cache.store_async("a", b"abc", "mp3"), "a.mp3")
+        self.assertEqual(self._submitted(), submitted + 1)
+        self.assertEqual(TTSCache(directory).path("a"), cache.path("a"))
+
+        # Горячий уровень — без пула
+        self.assertEqual(await cache.lookup_async("a"), b"abc")
+        self.assertEqual(self._submitted(), submitted + 1)
+        self.assertIsNone(await cache.lookup_async("missing"))
+        self.assertEqual(self._submitted(), submitted + 1)
+
+        # Вытеснен из памяти — читается с диска в пуле
+        await cache.store_async("b", b"defg", "mp3")
+        self.assertEqual(await cache.lookup_async("a"), b"abc")
+        self.assertEqual(self._submitted(), submitted + 3)
+        self.assertEqual(cache.stats["disk_hits"], 1)
+
+
+class _FakeYOLO:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+
+    def predict(self, images, conf, iou, verbose, **options):
+        self.calls.append((len(images), options.get('imgsz')))
+        if self.fail:
+            raise RuntimeError("CUDA out of memory")
+        return [f"result-{image}" for image in images]
+
+
+class DetectionBatcherTests(SimpleTestCase):
+    """Кадры из одного окна уходят одним predict, результаты возвращаются своим вызовам."""
+
+    def test_concurrent_frames_share_one_predict(self):
+        models = {None: _FakeYOLO(), 'yolov8s.pt': _FakeYOLO()}
+        batcher = DetectionBatcher(models.get, window_ms=100.0, max_batch=8)
+
+        futures = [batcher.submit(i) for i in range(3)] + [batcher.submit(3, model='yolov8s.pt', imgsz=320)]
+
+        self.assertEqual([future.result(timeout=5) for future in futures],
+                         ["result-0", "result-1", "result-2", "result-3"])
+        self.assertEqual(models[None].calls, [(3, None)])
+        # Другой уровень — отдельный predict в том же окне
+        self.assertEqual(models['yolov8s.pt'].calls, [(1, 320)])
+        self.assertEqual(batcher.stats["batches"], 1)
+
+    def test_model_error_reaches_every_caller(self):
+        batcher = DetectionBatcher(lambda model: _FakeYOLO(fail=True), window_ms=100.0)
+        futures = [batcher.submit(i) for i in range(2)]
+
+        for future in futures:
+            with self.assertRaisesRegex(RuntimeError, "out of memory"):
+                future.result(timeout=5)
+
+    def test_missing_model_fails_instead_of_hanging(self):
+        batcher = DetectionBatcher(lambda model: None, window_ms=0.0)
+        with self.assertRaises(RuntimeError):
+            batcher.detect(np.zeros((4, 4, 3), dtype=np.uint8))
+
+
+class PipelineTests(SimpleTestCase):
+    """Общая зависимость считается один раз, ненужные и выключенные стадии не запускаются."""
+
+    def setUp(self):
+        self.calls = []
+
+    def _stage(self, name, deps=(), when=None, delay=0.0):
+        async def fn(ctx):
+            self.calls.append(name)
+            await asyncio.sleep(delay)
+            return [ctx[dep] for dep in deps] or name
+        return Stage(name, fn, deps=deps, when=when)
+
+    async def test_shared_dependency_runs_once(self):
+        pipeline = Pipeline([
+            self._stage('decode', delay=0.01),
+            self._stage('detect', deps=['decode']),
+            self._stage('caption', deps=['decode']),
+            self._stage('ocr', deps=['decode']),
+        ])
+        ctx = await pipeline.run(['detect', 'caption'], frame=b"jpeg")
+
+        self.assertEqual(self.calls.count('decode'), 1)
+        self.assertNotIn('ocr', self.calls)
+        self.assertEqual(ctx['detect'], ['decode'])
+        self.assertEqual(ctx.inputs['frame'], b"jpeg")
+        self.assertEqual(set(ctx.timings), {'decode', 'detect', 'caption'})
+
+    async def test_stage_with_false_when_is_skipped(self):
+        pipeline = Pipeline([
+            self._stage('llm'),
+            self._stage('tts', deps=['llm'], when=lambda ctx: ctx.inputs['speak']),
+        ])
+        ctx = await pipeline.run(['tts'], speak=False)
+
+        self.assertEqual(self.calls, ['llm'])
+        self.assertEqual(ctx.skipped, ['tts'])
+        self.assertIsNone(ctx['tts'])
+
+    def test_unknown_dependency_is_rejected(self):
+        with self.assertRaises(ValueError):
+            Pipeline([self._stage('tts', deps=['llm'])])
+
+
+class _StubLLM:
+    """OpenAI-совместимый клиент: ответы по очереди из списка, исключение в списке — бросается."""
+
+    def __init__(self, replies, delay=0.0):
+        self.replies = list(replies)
+        self.delay = delay
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, messages, stream=False, **params):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        if stream:
+            return _stub_chunks(reply)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))])
+
+
+async def _stub_chunks(text):
+    for word in text.split():
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word))])
+
+
+class _StubGateway(LLMGateway):
+    def __init__(self, stubs, **options):
+        options.setdefault('backoff', 0.0)
+        super().__init__([Provider(name, "http://stub", "stub-model", api_key="key") for name in stubs], **options)
+        self.stubs = stubs
+
+    def client(self, provider):
+        return self.stubs[provider.name]
+
+
+class LLMGatewayTests(SimpleTestCase):
+    MESSAGES = [{"role": "user", "content": "Что впереди?"}]
+
+    def _gateway(self, stubs, **options):
+        gateway = _StubGateway(stubs, **options)
+        self.addCleanup(gateway.close)
+        return gateway
+
+    async def test_transient_error_is_retried(self):
+        stub = _StubLLM([ConnectionError("reset"), "Впереди переход"])
+        gateway = self._gateway({"deepseek": stub})
+
+        self.assertEqual(await gateway.chat(self.MESSAGES), "Впереди переход")
+        self.assertEqual(stub.calls, 2)
+        self.assertEqual(gateway.stats["deepseek"]["errors"], 1)
+
+    async def test_retry_goes_to_the_other_provider(self):
+        first, second = _StubLLM([ConnectionError("reset")]), _StubLLM(["Впереди переход"])
+        gateway = self._gateway({"deepseek": first, "openrouter": second})
+
+        self.assertEqual(await gateway.chat(self.MESSAGES), "Впереди переход")
+        self.assertEqual((first.calls, second.calls), (1, 1))
+
+    async def test_all_attempts_failing_raise_llm_error(self):
+        gateway = self._gateway({"deepseek": _StubLLM([ConnectionError("reset")] * 3)}, retries=2)
+        with self.assertRaises(LLMError):
+            await gateway.chat(self.MESSAGES)
+
+    async def test_slow_primary_is_hedged(self):
+        slow, fast = _StubLLM(["медленно"], delay=2.0), _StubLLM(["быстро"])
+        gateway = self._gateway({"deepseek": slow, "openrouter": fast},
+                                hedge=True, hedge_min_delay=0.05, hedge_default_delay=0.05)
+
+        started = time.monotonic()
+        self.assertEqual(await gateway.chat(self.MESSAGES), "быстро")
+        self.assertLess(time.monotonic() - started, 1.0)
+        # Отменённый проигравший хедж — не ошибка провайдера
+        self.assertEqual(gateway.stats["deepseek"]["errors"], 0)
+
+    async def test_stream_falls_back_before_first_chunk(self):
+        first, second = _StubLLM([ConnectionError("reset")]), _StubLLM(["Впереди переход"])
+        gateway = self._gateway({"deepseek": first, "openrouter": second})
+
+        self.assertEqual([delta async for delta in gateway.stream(self.MESSAGES)], ["Впереди", "переход"])
+        self.assertEqual(gateway.stats["deepseek"]["errors"], 1)
+
+
+def _test_image(width=320, height=240):
+    """Градиент с прямоугольником — кадр, на котором есть что хэшировать."""
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    image[:, :, 1] = np.linspace(0, 255, width, dtype=np.uint8)
+    image[height // 4:height // 2, width // 4:width // 2] = (0, 0, 255)
+    return image
+
+
+class FrameTests(SimpleTestCase):
+    """Кадр декодируется один раз, производные представления считаются лениво и переиспользуются."""
+
+    def test_decode_once_and_reuse_views(self):
+        import cv2
+        data = cv2.imencode('.png', _test_image(640, 480))[1].tobytes()
+        frame = Frame.from_bytes(data, max_dim=320)
+
+        self.assertEqual(frame.shape, (240, 320, 3))
+        self.assertIs(frame.rgb, frame.rgb)
+        self.assertIs(frame.gray, frame.gray)
+        self.assertIs(Frame.ensure(frame), frame)
+        # Хэш — по исходным байтам, одинаковый для повторно присланного кадра
+        self.assertEqual(frame.content_hash, Frame.from_bytes(data).content_hash)
+
+    def test_recompressed_frame_has_close_dhash(self):
+        import cv2
+        image = _test_image()
+        jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 60])[1].tobytes()
+        original, recompressed = Frame(image), Frame.from_bytes(jpeg)
+
+        self.assertNotEqual(original.content_hash, recompressed.content_hash)
+        self.assertLessEqual((original.dhash ^ recompressed.dhash).bit_count(), 6)
+
+    def test_garbage_is_not_a_frame(self):
+        self.assertIsNone(Frame.from_bytes(b"not an image"))
+        self.assertIsNone(Frame.ensure(None))
+
+
+class MotionGateTests(SimpleTestCase):
+
+    def test_static_scene_is_skipped_until_stale(self):
+        gate = MotionGate(threshold=4.0, max_staleness=2.0)
+        image = _test_image()
+
+        self.assertTrue(gate.should_run(image, now=0.0))
+        self.assertFalse(gate.should_run(image, now=0.5))
+        self.assertFalse(gate.should_run(image, now=1.9))
+        self.assertTrue(gate.should_run(image, now=2.0))
+        self.assertEqual(gate.stats["skipped"], 2)
+
+    def test_changed_scene_runs_detector(self):
+        gate = MotionGate(threshold=4.0, max_staleness=60.0)
+        gate.should_run(_test_image(), now=0.0)
+        self.assertTrue(gate.should_run(255 - _test_image(), now=0.1))
+
+    def test_mode_options_override_default(self):
+        gate = MotionGate.for_mode('navigator', {'default': {'threshold': 4.0, 'max_staleness': 2.0},
+                                                 'navigator': {'max_staleness': 0.5}})
+        self.assertEqual((gate.threshold, gate.max_staleness), (4.0, 0.5))
+
+
+class DetectionsTests(SimpleTestCase):
+    """Пространственные признаки считаются по нормализованным боксам."""
+
+    def setUp(self):
+        # Кадр 200x100: человек во весь рост у левого края, неизвестный класс справа
+        boxes = DetectorBoxes(np.array([[0, 0, 20, 100], [160, 40, 200, 60]], dtype=np.float32),
+                              np.array([0.6, 0.9]), np.array([0, 1]))
+        result = DetectorResult(boxes, {0: 'person', 1: 'kiosk'}, (100, 200))
+        self.detections = Detections.from_result(result)
+
+    def test_boxes_are_normalized(self):
+        np.testing.assert_allclose(self.detections.xyxy[0], [0.0, 0.0, 0.1, 1.0])
+        self.assertEqual(self.detections.unique_labels(), ['kiosk', 'person'])
+
+    def test_bearing_and_distance(self):
+        objects = {obj['label']: obj for obj in self.detections.to_json()}
+
+        self.assertLess(objects['person']['bearing'], 0)
+        self.assertGreater(objects['kiosk']['bearing'], 0)
+        # Человек 1.7 м занимает весь кадр по высоте (VFOV 66°) — примерно в 1.3 м
+        self.assertEqual(objects['person']['distance'], 1.3)
+        self.assertIsNone(objects['kiosk']['distance'])
+        self.assertEqual([obj['label'] for obj in self.detections.to_json()], ['kiosk', 'person'])
+
+    def test_missing_result_is_empty(self):
+        self.assertEqual(len(Detections.from_result(None)), 0)
+        self.assertEqual(Detections.from_result(None).to_json(), [])
+
+
+class ModelRegistryTests(SimpleTestCase):
+    """Модель загружается один раз на процесс, даже при одновременных запросах."""
+
+    def _register(self, name, loader):
+        ModelRegistry.register(name, loader)
+        self.addCleanup(ModelRegistry.unload, name)
+
+    def test_concurrent_get_loads_once(self):
+        loads = []
+
+        def loader():
+            loads.append(1)
+            time.sleep(0.05)
+            return object()
+
+        self._register('test-yolo', loader)
+        models = []
+        threads = [threading.Thread(target=lambda: models.append(ModelRegistry.get('test-yolo'))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(len({id(model) for model in models}), 1)
+
+    def test_failed_load_is_retried(self):
+        attempts = []
+
+        def loader():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise OSError("weights not downloaded")
+            return "model"
+
+        self._register('test-flaky', loader)
+        self.assertIsNone(ModelRegistry.get('test-flaky'))
+        self.assertEqual(ModelRegistry.get('test-flaky'), "model")
+
+    def test_release_unloads_last_reference(self):
+        self._register('test-whisper', object)
+        ModelRegistry.acquire('test-whisper')
+        ModelRegistry.acquire('test-whisper')
+
+        ModelRegistry.release('test-whisper', unload=True)
+        self.assertTrue(ModelRegistry.is_loaded('test-whisper'))
+        ModelRegistry.release('test-whisper', unload=True)
+        self.assertFalse(ModelRegistry.is_loaded('test-whisper'))
+
+    def test_unknown_model_raises(self):
+        with self.assertRaises(KeyError):
+            ModelRegistry.get('test-not-registered')
+
+
+class ModelExecutorsTests(SimpleTestCase):
+    """Стадии разных пулов идут параллельно, а не в одном потоке sync_to_async."""
+
+    async def test_different_pools_run_in_parallel(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def stage(name):
+            barrier.wait()  # дождётся второй стадии, только если они идут одновременно
+            return threading.current_thread().name
+
+        threads = await asyncio.gather(run_in('stt', stage, 'stt'), run_in('caption', stage, 'caption'))
+        self.assertTrue(threads[0].startswith('stt-worker'))
+        self.assertTrue(threads[1].startswith('caption-worker'))
+
+    async def test_stats_count_queue_and_failures(self):
+        executor = NamedExecutor('test', 1)
+
+        def fail():
+            raise ValueError("bad frame")
+
+        results = await asyncio.gather(executor.run(time.sleep, 0.05), executor.run(fail), return_exceptions=True)
+        self.assertIsInstance(results[1], ValueError)
+
+        stats = executor.stats
+        self.assertEqual((stats["completed"], stats["failed"], stats["queue_depth"]), (1, 1, 0))
+        # Второй вызов ждал, пока единственный поток занят первым
+        self.assertGreaterEqual(stats["max_queue_depth"], 1)
+        self.assertGreater(stats["wait_seconds"], 0)
+
+
+class ModelTieringTests(SimpleTestCase):
+    TIERS = [{'name': 's640'}, {'name': 'n640'}, {'name': 'n320'}]
+
+    def test_overload_steps_down_and_idle_recovers(self):
+        stage = StageTiers('detect', self.TIERS, queue_depth=4, hold_seconds=10.0)
+        now = time.monotonic()
+
+        self.assertEqual(stage.evaluate(depth=6, min_interval=1.0, now=now + 1), 1)
+        # Не чаще min_interval
+        self.assertIsNone(stage.evaluate(depth=6, min_interval=1.0, now=now + 1.5))
+        self.assertEqual(stage.evaluate(depth=6, min_interval=1.0, now=now + 2), 2)
+        self.assertIsNone(stage.evaluate(depth=6, min_interval=1.0, now=now + 3))
+
+        # Очередь пуста, но возврат — только после hold_seconds
+        self.assertIsNone(stage.evaluate(depth=0, min_interval=1.0, now=now + 5))
+        self.assertEqual(stage.evaluate(depth=0, min_interval=1.0, now=now + 12), 1)
+        self.assertEqual(stage.tier['name'], 'n640')
+
+    def test_slow_p95_steps_down(self):
+        stage = StageTiers('caption', self.TIERS, p95_ms=500.0, min_samples=3)
+        for _ in range(3):
+            stage.observe(0.8)
+        self.assertEqual(stage.evaluate(depth=0, min_interval=0.0), 1)
+
+    def test_served_tier_is_recorded_for_request(self):
+        tiering = ModelTiering({'detect': {'tiers': self.TIERS, 'default': 'n640'}}, enabled=False)
+
+        async def request():
+            tiers = track_tiers()
+            with tiering.serve('detect') as tier, tiering.serve('ocr') as untiered:
+                self.assertEqual(untiered, {})
+            return tier, tiers
+
+        tier, tiers = asyncio.run(request())
+        self.assertEqual(tier['name'], 'n640')
+        self.assertEqual(tiers, {'detect': 'n640'})
+        self.assertEqual(tiering.stats['stages']['detect']['served'], {'s640': 0, 'n640': 1, 'n320': 0})
+
+
+class _CountingEmbedder(HashingEmbedder):
+    def __init__(self, dim=64):
+        super().__init__(dim=dim)
+        self.embedded = 0
+
+    def embed_batch(self, texts):
+        self.embedded += len(texts)
+        return super().embed_batch(texts)
+
+
+class EmbeddingIndexTests(SimpleTestCase):
+    """Векторы переживают перезапуск в mmap-файле и не пересчитываются."""
+
+    TEXTS = [f"предмет{i} лежит на полке{i}" for i in range(EmbeddingIndex.MIN_CAPACITY + 6)]
+
+    def test_grows_and_reloads_without_reembedding(self):
+        directory = tempfile.mkdtemp()
+        index = EmbeddingIndex(directory, _CountingEmbedder())
+        index.load([])
+        for text in self.TEXTS:
+            index.extend(index.embedder.embed_batch([text]))
+        self.assertEqual(index.search(self.TEXTS[-1], top_k=1)[0][0], len(self.TEXTS) - 1)
+
+        embedder = _CountingEmbedder()
+        reloaded = EmbeddingIndex(directory, embedder)
+        reloaded.load(self.TEXTS)
+        self.assertEqual(embedder.embedded, 0)
+        self.assertEqual(len(reloaded), len(self.TEXTS))
+        self.assertEqual(reloaded.search(self.TEXTS[3], top_k=1)[0][0], 3)
+
+    def test_missing_tail_and_new_embedder_are_recomputed(self):
+        directory = tempfile.mkdtemp()
+        index = EmbeddingIndex(directory, _CountingEmbedder())
+        index.load(self.TEXTS[:2])
+
+        # Факт записан в лог, а вектор — нет
+        embedder = _CountingEmbedder()
+        EmbeddingIndex(directory, embedder).load(self.TEXTS[:3])
+        self.assertEqual(embedder.embedded, 1)
+
+        # Другая размерность — матрица строится заново
+        embedder = _CountingEmbedder(dim=32)
+        EmbeddingIndex(directory, embedder).load(self.TEXTS[:3])
+        self.assertEqual(embedder.embedded, 3)
+
+
+class _FakeWhisper:
+    """faster-whisper WhisperModel только с transcribe(): батчевый путь недоступен."""
+
+    def __init__(self):
+        self.calls = []
+
+    def transcribe(self, audio, beam_size, language, **options):
+        self.calls.append((len(audio), beam_size))
+        return [SimpleNamespace(text=f" {len(audio) // SAMPLE_RATE}s")], None
+
+
+class WhisperBatchingTests(SimpleTestCase):
+
+    def test_long_recording_is_cut_in_a_pause(self):
+        tone = (0.3 * np.sin(np.arange(100 * SAMPLE_RATE) * 2 * np.pi * 220 / SAMPLE_RATE)).astype(np.float32)
+        tone[27 * SAMPLE_RATE:int(27.5 * SAMPLE_RATE)] = 0  # пауза перед границей окна
+        tone[60 * SAMPLE_RATE:] = 0                          # 40 с тишины в конце
+
+        chunks = split_audio(tone)
+        self.assertTrue(all(len(chunk) <= CHUNK_SECONDS * SAMPLE_RATE for chunk in chunks))
+        self.assertTrue(27 * SAMPLE_RATE <= len(chunks[0]) <= 27.5 * SAMPLE_RATE)
+        # Куски идут подряд с начала записи; последний, из одной тишины, выброшен
+        self.assertTrue(60 * SAMPLE_RATE <= sum(len(chunk) for chunk in chunks) < 100 * SAMPLE_RATE)
+
+    def test_falls_back_to_sequential_decode_with_tier_beams(self):
+        model = _FakeWhisper()
+        batcher = WhisperBatcher(lambda size: model, window_ms=100.0, tiers={'upload': 5})
+        one_second = np.full(SAMPLE_RATE, 0.1, dtype=np.float32)
+
+        futures = [batcher.submit(one_second, 'partial'), batcher.submit(one_second, 'upload'),
+                   batcher.submit(one_second, 'upload', max_beam=2)]
+        self.assertEqual([future.result(timeout=5) for future in futures], ["1s", "1s", "1s"])
+        self.assertEqual(sorted(beam for _, beam in model.calls), [1, 2, 5])
+        self.assertEqual(batcher.stats["fallback_segments"], 3)
+
+    def test_missing_model_fails_every_segment(self):
+        batcher = WhisperBatcher(lambda size: None, window_ms=0.0)
+        with self.assertRaises(RuntimeError):
+            batcher.transcribe(np.full(SAMPLE_RATE, 0.1, dtype=np.float32))
+
+
+class SpeechResponseTests(SimpleTestCase):
+    """Согласовавший формат клиент получает аудио бинарной частью, остальные — прежний JSON."""
+
+    def test_format_negotiation(self):
+        factory = RequestFactory()
+        self.assertEqual(negotiate_audio_format(factory.post('/', {'audio_format': 'ogg'})), 'opus')
+        accept = factory.post('/', HTTP_ACCEPT='audio/wav;q=0.5, audio/mpeg, application/json')
+        self.assertEqual(negotiate_audio_format(accept), 'mp3')
+        self.assertIsNone(negotiate_audio_format(factory.post('/', HTTP_ACCEPT='application/json')))
+
+    def test_binary_audio_part_without_base64(self):
+        audio = bytes(range(256)) * 4
+        response = speech_response({'message': 'Впереди переход'}, audio, 'mp3', binary=True)
+
+        boundary = response['Content-Type'].split('boundary=')[1]
+        parts = response.content.split(f'--{boundary}'.encode('ascii'))
+        meta_headers, meta = parts[1].split(b'\r\n\r\n', 1)
+        audio_headers, body = parts[2].split(b'\r\n\r\n', 1)
+
+        self.assertEqual(json.loads(meta.strip())['audio_bytes'], len(audio))
+        self.assertIn(b'Content-Type: audio/mpeg', audio_headers)
+        self.assertEqual(body[:-2], audio)
+
+    def test_legacy_clients_get_base64_json(self):
+        response = speech_response({'message': 'ok'}, b'RIFF', 'wav', binary=False)
+        self.assertEqual(json.loads(response.content)['audio'], base64.b64encode(b'RIFF').decode())
+
+
+def _pcm(seconds, amplitude):
+    samples = np.arange(int(seconds * 16000))
+    wave = amplitude * np.sin(samples * 2 * np.pi * 220 / 16000)
+    return (wave * 32767).astype('<i2').tobytes()
+
+
+class StreamingTranscriberTests(SimpleTestCase):
+    """Пока человек говорит — промежуточный текст, после паузы — финальный, фразы по порядку."""
+
+    async def _session(self, chunks):
+        events, calls = [], []
+
+        async def transcribe(audio, tier):
+            calls.append(tier)
+            return f"фраза {len(audio) // 1600}"
+
+        async def on_event(event):
+            events.append(event)
+
+        transcriber = StreamingTranscriber(transcribe, on_event, silence_ms=300, partial_interval=0.5)
+        for chunk in chunks:
+            # Куски по 100 мс, как их шлёт клиент
+            for start in range(0, len(chunk), 3200):
+                await transcriber.feed(chunk[start:start + 3200])
+                await asyncio.sleep(0)
+        final = transcriber.flush()
+        if final is not None:
+            await final
+        return events, calls
+
+    async def test_partial_then_final_after_pause(self):
+        events, calls = await self._session([_pcm(0.5, 0.001), _pcm(1.5, 0.3), _pcm(0.6, 0.001)])
+
+        partial = [event for event in events if not event['final']]
+        final = [event for event in events if event['final']]
+        self.assertTrue(partial)
+        self.assertEqual(len(final), 1)
+        self.assertEqual(events[-1], final[0])
+        self.assertEqual(calls.count('final'), 1)
+        # Финальная фраза — вся речь плюс предзапись
+        self.assertGreaterEqual(final[0]['audio_ms'], 1500)
+
+    async def test_two_utterances_are_reported_in_order(self):
+        events, _ = await self._session([_pcm(0.5, 0.001), _pcm(0.6, 0.3), _pcm(0.6, 0.001), _pcm(0.6, 0.3)])
+
+        final = [event['utterance'] for event in events if event['final']]
+        # Вторая фраза без паузы в конце завершается flush()
+        self.assertEqual(final, [1, 2])
+
+
+class InferencePoolTests(SimpleTestCase):
+
+    def test_frame_round_trip_through_shared_memory(self):
+        ring = SharedFrameRing(slots=2, slot_bytes=64 * 64 * 3)
+        self.addCleanup(ring.close)
+        attached = SharedFrameRing(2, ring.slot_bytes, name=ring.name)
+        self.addCleanup(attached.close)
+        frame = np.random.randint(0, 255, (64, 48, 3), dtype=np.uint8)
+
+        ring.write(1, frame)
+        np.testing.assert_array_equal(attached.read(1, frame.shape, frame.dtype.str), frame)
+        self.assertFalse(ring.fits(np.zeros((65, 64, 3), dtype=np.uint8)))
+
+    def test_dead_worker_fails_its_requests_and_frees_slots(self):
+        pool = InferencePool('detect', processes=1, slots=2, slot_bytes=32 * 32 * 3, timeout=10.0,
+                             monitor_interval=0.05)
+        self.addCleanup(pool.shutdown)
+
+        future = pool.submit(np.zeros((32, 32, 3), dtype=np.uint8))
+        pool._workers[0][0].kill()
+
+        with self.assertRaisesRegex(RuntimeError, "died"):
+            future.result(timeout=10)
+        self.assertEqual(pool.stats["free_slots"], 2)
+        self.assertGreaterEqual(pool.stats["restarts"], 1)
+
+
+class InMemoryAudioTests(SimpleTestCase):
+    """Синтезированная речь кодируется в WAV в памяти, без временных файлов."""
+
+    def test_float_audio_encodes_to_wav_bytes(self):
+        audio = np.sin(np.linspace(0, 100, KANI_SAMPLE_RATE)).astype(np.float32) * 1.5  # с клиппингом
+        data = encode_wav(audio, KANI_SAMPLE_RATE)
+
+        with wave.open(io.BytesIO(data)) as wav:
+            self.assertEqual((wav.getnchannels(), wav.getsampwidth(), wav.getframerate()), (1, 2, KANI_SAMPLE_RATE))
+            pcm = np.frombuffer(wav.readframes(wav.getnframes()), dtype='<i2')
+        self.assertEqual(len(pcm), len(audio))
+        self.assertEqual(int(np.abs(pcm).max()), 32767)
+
+    def test_channels_first_audio_is_interleaved(self):
+        stereo = np.zeros((2, 100), dtype=np.int16)
+        with wave.open(io.BytesIO(encode_wav(stereo, 16000))) as wav:
+            self.assertEqual((wav.getnchannels(), wav.getnframes()), (2, 100))
+
+
+class ChatHistoryTests(TestCase):
+    """История — строки ChatMessage: запись одной вставкой, окно последних, очистка командой."""
+
+    def setUp(self):
+        self.vision_user = VisionUser.objects.create(telegram_id="chat-history")
+
+    def _history(self, count, days_ago=0):
+        created = timezone.now() - timedelta(days=days_ago)
+        ChatMessage.objects.bulk_create([
+            ChatMessage(user=self.vision_user, role='user' if i % 2 == 0 else 'assistant',
+                        content=f"сообщение {i}", created_at=created - timedelta(seconds=count - i))
+            for i in range(count)
+        ])
+
+    def test_context_is_the_latest_window_in_order(self):
+        self._history(30)
+        self.vision_user.add_message('user', "что впереди?")
+
+        context = self.vision_user.get_context(limit=3)
+        self.assertEqual([item['content'] for item in context], ["сообщение 28", "сообщение 29", "что впереди?"])
+        self.assertEqual(context[-1]['role'], 'user')
+
+    def test_prune_by_age_and_per_user_limit(self):
+        self._history(5, days_ago=120)
+        self._history(10)
+        other = VisionUser.objects.create(telegram_id="other")
+        ChatMessage.objects.create(user=other, role='user', content="привет")
+
+        out = StringIO()
+        call_command('prune_chat_messages', keep=4, max_age_days=90, batch_size=2, stdout=out)
+
+        self.assertIn("Deleted 11 chat messages (5 expired, 6 over per-user limit)", out.getvalue())
+        self.assertEqual([item['content'] for item in self.vision_user.get_context(limit=10)],
+                         [f"сообщение {i}" for i in range(6, 10)])
+        self.assertEqual(other.messages.count(), 1)
+
+    def test_dry_run_deletes_nothing(self):
+        self._history(5, days_ago=120)
+        call_command('prune_chat_messages', max_age_days=90, dry_run=True, stdout=StringIO())
+        self.assertEqual(ChatMessage.objects.count(), 5)
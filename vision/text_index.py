@@ -0,0 +1,186 @@
+"""
+Ключевой поиск по фактам: лёгкий стемминг ru / ky / en и инвертированный индекс BM25.
+
+Стемминг — отсечение частых окончаний без словарей: «собака», «собаку» и
+«собаки» дают одну основу «собак». Для кыргызских слов снимаются цепочки
+аффиксов множественного числа, принадлежности и падежа: «иттер», «итим»,
+«иттерибизге» -> «ит». Большинство кыргызских словоформ пишется без букв
+ө, ү, ң и по написанию от русских не отличается, поэтому кириллическое
+слово без этих букв индексируется и русской основой, и кыргызской — если
+цепочка действительно сняла аффикс; запрос разбирается так же. Кыргызская
+основа короче MIN_STEM допускается только для известных корней (ит, үй, ат...),
+иначе «нога» -> «но» и «кони» -> «ко» совпадали бы с чем попало.
+Индекс обновляется по одному документу, поиск обходит только списки
+документов терминов запроса, а не все факты.
+"""
+import math
+import re
+from collections import Counter, defaultdict
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_CYRILLIC = re.compile(r"[а-яёөүң]")
+_KYRGYZ = re.compile(r"[өүң]")
+
+STOPWORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по ее мне
+было вот от меня еще нет о из ему теперь когда даже ну ли если уже или ни быть был него до
+вас нибудь опять уж вам ведь там потом себя ничего ей может они тут где есть надо ней для мы
+тебя их чем была сам чтоб без будто чего раз тоже себе под будет ж тогда кто этот того потому
+этого какой совсем ним здесь этом один почти мой тем чтобы нее были куда зачем всех никогда
+можно при наконец два об другой хоть после над больше тот через эти нас про всего них какая
+много разве три эту моя впрочем хорошо свою этой перед иногда лучше чуть том нельзя такой им
+более всегда конечно всю между мою мое мои
+жана менен бул ал мен сен биз силер алар эмне ким кандай деп да дагы үчүн бирок же
+the a an and or of to in on at for is are was were be been it this that with as by from my
+me i you he she we they your our their do does did have has had not no
+""".split())
+
+# Окончания по убыванию длины внутри группы: снимается самое длинное подходящее
+_RU_ENDINGS = sorted("""
+иями ями ами иях ях ах ием ией ей ой ий ый ая яя ое ее ые ие ого его ому ему ыми ими ую юю
+ов ев ом ем ам ям ешь ете ет ут ют ат ят ишь ите ит ила ило или ил ла ло ли ть ться тся сь ся
+ость ости остью ение ения ению ением ении а я о е ы и у ю ь й
+""".split(), key=len, reverse=True)
+
+_KY_SUFFIXES = sorted("""
+лар лер лор лөр дар дер дор дөр тар тер тор төр
+нын нин нун нүн дын дин дун дүн тын тин тун түн
+дан ден дон дөн тан тен тон төн нан нен нон нөн
+га ге го гө ка ке ко кө на не но нө
+ны ни ну нү ды ди ду дү ты ти ту тү
+да де до дө та те то тө нда нде ндо ндө
+ым им ум үм ың иң уң үң ыбыз ибиз убуз үбүз сы си су сү ы и у ү
+""".split(), key=len, reverse=True)
+
+_EN_RULES = (("ies", "y"), ("sses", "ss"), ("ing", ""), ("edly", ""), ("ed", ""), ("ly", ""), ("es", ""), ("s", ""))
+
+MIN_STEM = 3
+# Двухбуквенные кыргызские корни, до которых можно снимать аффиксы
+KY_SHORT_ROOTS = frozenset("ит үй ат ай ой эт эл ун уй өз ок".split())
+
+
+def stem(word: str) -> str:
+    """Основная основа слова (для кириллицы без ө, ү, ң — русская)."""
+    word = word.lower().replace('ё', 'е')
+    if _KYRGYZ.search(word):
+        return _strip_kyrgyz(word)
+    if _CYRILLIC.search(word):
+        return _strip_suffix(word, _RU_ENDINGS)
+    return _stem_english(word)
+
+
+def stems(word: str):
+    """Все основы слова: для кириллицы без ө, ү, ң — русская и кыргызская."""
+    word = word.lower().replace('ё', 'е')
+    if _CYRILLIC.search(word) and not _KYRGYZ.search(word):
+        result = {_strip_suffix(word, _RU_ENDINGS)}
+        kyrgyz = _strip_kyrgyz(word)
+        if kyrgyz != word:
+            result.add(kyrgyz)
+        return result
+    return {stem(word)}
+
+
+def tokenize(text: str):
+    """Основы значимых слов текста (без стоп-слов и однобуквенных токенов)."""
+    tokens = []
+    for word in _WORD.findall(text.lower().replace('ё', 'е')):
+        if len(word) < 2 or word in STOPWORDS:
+            continue
+        tokens.extend(sorted(stems(word)))
+    return tokens
+
+
+def _strip_suffix(word, suffixes):
+    for suffix in suffixes:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM:
+            return word[:-len(suffix)]
+    return word
+
+
+def _strip_kyrgyz(word):
+    # Аффиксы агглютинативно нанизываются: снимаем до трёх с конца
+    for _ in range(3):
+        for suffix in _KY_SUFFIXES:
+            rest = word[:-len(suffix)]
+            if word.endswith(suffix) and (len(rest) >= MIN_STEM or rest in KY_SHORT_ROOTS):
+                word = rest
+                break
+        else:
+            break
+    return word
+
+
+def _stem_english(word):
+    if word.endswith("ss"):
+        return word
+    for suffix, replacement in _EN_RULES:
+        if word.endswith(suffix) and len(word) - len(suffix) + len(replacement) >= MIN_STEM:
+            return word[:-len(suffix)] + replacement
+    return word
+
+
+class BM25Index:
+    """
+    Инвертированный индекс BM25 (Okapi) с добавлением документов по одному.
+    Документы — целые номера (позиция факта в памяти).
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(dict)  # основа -> {doc_id: tf}
+        self._lengths = {}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add(self, doc_id: int, text: str):
+        terms = Counter(tokenize(text))
+        if doc_id in self._lengths:
+            self.remove(doc_id)
+        for term, tf in terms.items():
+            self._postings[term][doc_id] = tf
+        length = sum(terms.values())
+        self._lengths[doc_id] = length
+        self._total_length += length
+
+    def remove(self, doc_id: int):
+        length = self._lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self._total_length -= length
+        for term in [term for term, docs in self._postings.items() if doc_id in docs]:
+            del self._postings[term][doc_id]
+            if not self._postings[term]:
+                del self._postings[term]
+
+    def search(self, query: str, top_k: int = 3):
+        """[(doc_id, score)] по убыванию BM25; только документы с общими терминами."""
+        n = len(self._lengths)
+        if not n or top_k <= 0:
+            return []
+        avg_length = self._total_length / n or 1.0
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            docs = self._postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+
+def reciprocal_rank_fusion(*rankings, k: int = 60, top_k: int = 3):
+    """
+    Слияние ранжирований [(doc_id, score), ...] по сумме 1 / (k + место).
+    Шкалы BM25 и косинуса несравнимы, а места — сравнимы.
+    """
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking):
+            fused[doc_id] += 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
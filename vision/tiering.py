@@ -0,0 +1,238 @@
+"""
+Адаптивный выбор уровня моделей под нагрузку.
+
+Для каждой стадии (detect, stt, caption) в settings.MODEL_TIERS задан список
+уровней от лучшего качества к самому быстрому, например YOLO s/640 -> n/640 ->
+n/320 или Whisper base -> tiny -> tiny с beam 1. Контроллер следит за
+глубиной очереди стадии и p95 задержки последних запросов:
+
+- очередь >= queue_depth или p95 > p95_ms — переходит на уровень быстрее;
+- очередь пуста и p95 < p95_ms * recover_ratio в течение hold_seconds —
+  возвращается на уровень лучше.
+
+Модели всех уровней загружаются заранее (warm), поэтому переключение не
+стоит загрузки. Уровень, которым обслужена каждая стадия, записывается в
+словарь запроса (track_tiers) и попадает в ответ рядом с timings.
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_request_tiers = contextvars.ContextVar('request_tiers', default=None)
+
+
+def track_tiers() -> dict:
+    """Начинает запись уровней для текущего запроса. Возвращает словарь stage -> имя уровня."""
+    tiers = {}
+    _request_tiers.set(tiers)
+    return tiers
+
+
+class StageTiers:
+    """Уровни одной стадии и решение о переключении."""
+
+    def __init__(self, stage: str, tiers, default: str = None, p95_ms: float = 1000.0, queue_depth: int = 4,
+                 recover_ratio: float = 0.5, hold_seconds: float = 10.0, window_seconds: float = 30.0,
+                 min_samples: int = 5):
+        if not tiers:
+            raise ValueError(f"Stage '{stage}' has no tiers")
+        self.stage = stage
+        self.tiers = [dict(tier) for tier in tiers]
+        names = [tier['name'] for tier in self.tiers]
+        self.default_level = names.index(default) if default in names else 0
+        self.level = self.default_level
+        self.p95_ms = p95_ms
+        self.queue_depth = queue_depth
+        self.recover_ratio = recover_ratio
+        self.hold_seconds = hold_seconds
+        self.window_seconds = window_seconds
+        self.min_samples = min_samples
+
+        self._samples = deque(maxlen=512)  # (monotonic, seconds)
+        self._last_switch = time.monotonic()
+        self._served = {name: 0 for name in names}
+        self._switches = 0
+
+    @property
+    def tier(self) -> dict:
+        return self.tiers[self.level]
+
+    def observe(self, seconds: float):
+        self._samples.append((time.monotonic(), seconds))
+
+    def served(self, name: str):
+        self._served[name] = self._served.get(name, 0) + 1
+
+    def p95(self, now: float = None):
+        """p95 задержки (мс) за последние window_seconds или None, если замеров мало."""
+        now = time.monotonic() if now is None else now
+        recent = [seconds for at, seconds in self._samples if now - at <= self.window_seconds]
+        if len(recent) < self.min_samples:
+            return None
+        return float(np.percentile(recent, 95)) * 1000
+
+    def evaluate(self, depth: int, min_interval: float, now: float = None):
+        """Переключает уровень по глубине очереди и p95. Возвращает новый уровень или None."""
+        now = time.monotonic() if now is None else now
+        since_switch = now - self._last_switch
+        p95 = self.p95(now)
+
+        overloaded = depth >= self.queue_depth or (p95 is not None and p95 > self.p95_ms)
+        if overloaded and self.level < len(self.tiers) - 1 and since_switch >= min_interval:
+            return self._switch(self.level + 1, now, depth, p95)
+
+        idle = depth == 0 and (p95 is None or p95 < self.p95_ms * self.recover_ratio)
+        if idle and self.level > 0 and since_switch >= self.hold_seconds:
+            return self._switch(self.level - 1, now, depth, p95)
+        return None
+
+    def stats(self, depth: int = None):
+        p95 = self.p95()
+        return {
+            "tier": self.tier['name'],
+            "level": self.level,
+            "tiers": [tier['name'] for tier in self.tiers],
+            "queue_depth": depth,
+            "p95_ms": round(p95, 1) if p95 is not None else None,
+            "served": dict(self._served),
+            "switches": self._switches,
+        }
+
+    def _switch(self, level, now, depth, p95):
+        previous = self.tier['name']
+        self.level = level
+        self._last_switch = now
+        self._switches += 1
+        # Замеры прежнего уровня не говорят о новом
+        self._samples.clear()
+        p95_text = f"{p95:.0f} ms" if p95 is not None else "n/a"
+        logger.info(f"Tier '{self.stage}': {previous} -> {self.tier['name']} (queue {depth}, p95 {p95_text})")
+        return level
+
+
+class ModelTiering:
+    """
+    Контроллер уровней всех стадий.
+
+    Сервисы регистрируют для стадии источник глубины очереди (register_queue) и
+    функцию прогрева уровня (register_warmer), а при обработке запроса берут
+    уровень через serve(stage).
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+    _queues = {}
+    _warmers = {}
+
+    def __init__(self, stages: dict, enabled: bool = True, interval: float = 1.0, warm: bool = True):
+        self.enabled = enabled
+        self.interval = interval
+        self.stages = {name: StageTiers(name, **config) for name, config in stages.items()}
+        self._lock = threading.Lock()
+        self._last_evaluated = 0.0
+        if enabled and warm:
+            threading.Thread(target=self.warm, name="tier-warmup", daemon=True).start()
+
+    @classmethod
+    def get(cls):
+        """Singleton, настроенный из settings (MODEL_TIERING, MODEL_TIERS)."""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    from django.conf import settings
+                    config = dict(getattr(settings, 'MODEL_TIERING', {}))
+                    cls._instance = cls(
+                        getattr(settings, 'MODEL_TIERS', {}),
+                        enabled=config.get('enabled', False),
+                        interval=config.get('interval', 1.0),
+                        warm=config.get('warm', True),
+                    )
+        return cls._instance
+
+    @classmethod
+    def register_queue(cls, stage: str, depth_fn):
+        """depth_fn() -> число задач стадии, ожидающих обработки."""
+        cls._queues[stage] = depth_fn
+
+    @classmethod
+    def register_warmer(cls, stage: str, warm_fn):
+        """warm_fn(tier) загружает (и прогревает) модели уровня."""
+        cls._warmers[stage] = warm_fn
+
+    def select(self, stage: str) -> dict:
+        """Текущий уровень стадии (пустой словарь, если стадия не настроена)."""
+        stages = self.stages.get(stage)
+        if stages is None:
+            return {}
+        if self.enabled:
+            self._maybe_evaluate()
+        return stages.tier
+
+    @contextmanager
+    def serve(self, stage: str):
+        """
+        Уровень для одного вызова стадии: записывает его в запрос и
+        учитывает время вызова в p95 стадии.
+        """
+        tier = self.select(stage)
+        stages = self.stages.get(stage)
+        if stages is not None:
+            with self._lock:
+                stages.served(tier['name'])
+            request_tiers = _request_tiers.get()
+            if request_tiers is not None:
+                request_tiers[stage] = tier['name']
+        started = time.perf_counter()
+        try:
+            yield tier
+        finally:
+            if stages is not None:
+                with self._lock:
+                    stages.observe(time.perf_counter() - started)
+
+    def warm(self):
+        """Загружает модели всех уровней, чтобы переключение не ждало загрузки."""
+        for stage, stages in self.stages.items():
+            warm_fn = self._warmers.get(stage)
+            if warm_fn is None:
+                continue
+            for tier in stages.tiers:
+                try:
+                    warm_fn(tier)
+                except Exception as e:
+                    logger.error(f"Tier warmup failed ({stage}/{tier['name']}): {e}")
+        logger.info("Model tiers warmed up")
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "stages": {name: stages.stats(self._depth(name)) for name, stages in self.stages.items()},
+            }
+
+    def _maybe_evaluate(self):
+        now = time.monotonic()
+        if now - self._last_evaluated < self.interval:
+            return
+        with self._lock:
+            if now - self._last_evaluated < self.interval:
+                return
+            self._last_evaluated = now
+            for name, stages in self.stages.items():
+                stages.evaluate(self._depth(name) or 0, self.interval, now)
+
+    def _depth(self, stage):
+        depth_fn = self._queues.get(stage)
+        if depth_fn is None:
+            return None
+        try:
+            return int(depth_fn())
+        except Exception:
+            return None
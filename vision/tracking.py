@@ -0,0 +1,192 @@
+"""
+Лёгкий трекер объектов для потокового режима (WebSocket).
+
+Ассоциация детекций с треками по IoU в два прохода, как в ByteTrack:
+сначала уверенные детекции, затем слабые — только к уже существующим трекам.
+Движение трека сглаживается α-β фильтром (установившийся Калман с постоянной
+скоростью), что позволяет продвигать треки между кадрами без детекции.
+
+Наружу отдаются только изменения: новые объекты, пропавшие и заметно сдвинувшиеся.
+"""
+import itertools
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Track:
+    def __init__(self, track_id, box, score, label):
+        self.id = track_id
+        self.box = np.asarray(box, dtype=np.float32)
+        self.velocity = np.zeros(4, dtype=np.float32)
+        self.score = float(score)
+        self.label = label
+        self.hits = 1
+        self.lost = 0  # кадров подряд без совпадения
+        self.reported_box = None  # позиция, о которой клиенту уже сообщили
+
+    @property
+    def center(self):
+        return np.array([(self.box[0] + self.box[2]) / 2, (self.box[1] + self.box[3]) / 2])
+
+    def predict(self):
+        self.box = self.box + self.velocity
+
+    def update(self, box, score, alpha=0.6, beta=0.2):
+        residual = np.asarray(box, dtype=np.float32) - self.box
+        self.box = self.box + alpha * residual
+        self.velocity = self.velocity + beta * residual
+        self.score = float(score)
+        self.hits += 1
+        self.lost = 0
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "label": self.label,
+            "box": [round(float(v), 4) for v in self.box],
+            "score": round(self.score, 3),
+        }
+
+
+class TrackDelta:
+    def __init__(self, new=None, lost=None, moved=None):
+        self.new = new or []
+        self.lost = lost or []
+        self.moved = moved or []
+
+    def __bool__(self):
+        return bool(self.new or self.lost or self.moved)
+
+    def labels(self):
+        return {t["label"] for t in self.new + self.moved}
+
+    def to_dict(self):
+        return {"new": self.new, "lost": self.lost, "moved": self.moved}
+
+
+class ObjectTracker:
+    """
+    Трекер одного соединения. Координаты боксов — нормализованные [0..1] xyxy.
+
+    iou_threshold  — минимальный IoU для сопоставления детекции и трека
+    high_conf      — порог «уверенной» детекции (может создавать новый трек)
+    min_hits       — сколько раз трек должен подтвердиться, прежде чем о нём сообщат
+    max_lost       — сколько кадров трек живёт без совпадений
+    move_threshold — сдвиг центра (доля кадра) или изменение высоты бокса для «moved»
+    """
+
+    def __init__(self, iou_threshold=0.3, high_conf=0.5, min_hits=2, max_lost=15, move_threshold=0.15):
+        self.iou_threshold = iou_threshold
+        self.high_conf = high_conf
+        self.min_hits = min_hits
+        self.max_lost = max_lost
+        self.move_threshold = move_threshold
+        self.tracks = []
+        self._ids = itertools.count(1)
+
+    def active_labels(self):
+        """Классы подтверждённых (уже отправленных клиенту) живых треков."""
+        return sorted({track.label for track in self.tracks if track.reported_box is not None})
+
+    def predict(self):
+        """Продвигает треки на кадр без детекции (дешёвая пропагация)."""
+        for track in self.tracks:
+            track.predict()
+        return self.tracks
+
+    def update(self, boxes, scores, labels) -> TrackDelta:
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        labels = list(labels)
+
+        for track in self.tracks:
+            track.predict()
+
+        high = np.flatnonzero(scores >= self.high_conf)
+        low = np.flatnonzero(scores < self.high_conf)
+
+        # 1. Уверенные детекции ко всем трекам
+        unmatched_tracks = list(range(len(self.tracks)))
+        matches, unmatched_tracks, unmatched_high = self._associate(unmatched_tracks, high, boxes, labels)
+        # 2. Слабые детекции — только к оставшимся трекам (новых не создают)
+        low_matches, unmatched_tracks, _ = self._associate(unmatched_tracks, low, boxes, labels)
+
+        for t, d in matches + low_matches:
+            self.tracks[t].update(boxes[d], scores[d])
+        for t in unmatched_tracks:
+            self.tracks[t].lost += 1
+        for d in unmatched_high:
+            self.tracks.append(Track(next(self._ids), boxes[d], scores[d], labels[d]))
+
+        return self._delta()
+
+    def _associate(self, track_idx, det_idx, boxes, labels):
+        if not len(track_idx) or not len(det_idx):
+            return [], list(track_idx), list(det_idx)
+
+        track_boxes = np.stack([self.tracks[t].box for t in track_idx])
+        iou = box_iou(track_boxes, boxes[det_idx])
+
+        # Объекты разных классов не сопоставляем
+        same_label = np.array([[self.tracks[t].label == labels[d] for d in det_idx] for t in track_idx])
+        iou[~same_label] = 0.0
+
+        matches, used_t, used_d = [], set(), set()
+        for flat in np.argsort(iou, axis=None)[::-1]:
+            i, j = np.unravel_index(flat, iou.shape)
+            if iou[i, j] < self.iou_threshold:
+                break
+            if i in used_t or j in used_d:
+                continue
+            used_t.add(i)
+            used_d.add(j)
+            matches.append((track_idx[i], det_idx[j]))
+
+        rest_tracks = [t for i, t in enumerate(track_idx) if i not in used_t]
+        rest_dets = [d for j, d in enumerate(det_idx) if j not in used_d]
+        return matches, rest_tracks, rest_dets
+
+    def _delta(self) -> TrackDelta:
+        delta = TrackDelta()
+        alive = []
+        for track in self.tracks:
+            if track.lost > self.max_lost:
+                if track.reported_box is not None:
+                    delta.lost.append({"id": track.id, "label": track.label})
+                continue
+            alive.append(track)
+
+            if track.lost or track.hits < self.min_hits:
+                continue
+            if track.reported_box is None:
+                delta.new.append(track.to_dict())
+                track.reported_box = track.box.copy()
+            elif self._moved(track):
+                delta.moved.append(track.to_dict())
+                track.reported_box = track.box.copy()
+
+        self.tracks = alive
+        return delta
+
+    def _moved(self, track):
+        prev = track.reported_box
+        prev_center = np.array([(prev[0] + prev[2]) / 2, (prev[1] + prev[3]) / 2])
+        shift = np.linalg.norm(track.center - prev_center)
+        prev_h = max(prev[3] - prev[1], 1e-6)
+        growth = abs((track.box[3] - track.box[1]) - prev_h) / prev_h
+        return shift > self.move_threshold or growth > self.move_threshold
+
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Матрица IoU (len(a), len(b)) для xyxy боксов."""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
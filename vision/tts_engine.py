@@ -1,42 +1,32 @@
 import logging
-import os
-import io
 from vision.tts_system.manager import TTSManager
-from vision.tts_system.config import TTSConfig
 
 logger = logging.getLogger(__name__)
 
 class TTSBrain:
     """
     Фасад для TTSManager. Обеспечивает обратную совместимость с text_to_speech_async,
-    возвращая байты, но внутри использует файловую систему и KaniTTS.
+    возвращая байты; синтез и кэш фраз — в TTSManager / TTSCache.
     """
     
     @classmethod
     async def speak(cls, text: str, mood: str = "neutral") -> bytes:
         """
-        Генерирует речь и возвращает байты (WAV).
+        Генерирует речь и возвращает байты (MP3 от EdgeTTS или WAV от KaniTTS).
+        Повторные фразы отдаются из TTSCache без обращения к движку.
         """
         manager = TTSManager() # Singleton, загрузит модель если надо
-        
-        # 1. Генерируем файл
-        # Возвращает URL типа /media/tts/file.wav
-        media_url = await manager.generate_speech(text, mood=mood)
-        
-        if not media_url:
-            return None
-            
-        # 2. Получаем физический путь из URL
-        # media_url = /media/tts/xyz.wav
-        # filename = xyz.wav
-        filename = media_url.split('/')[-1]
-        file_path = os.path.join(TTSConfig.OUTPUT_PATH, filename)
-        
-        # 3. Читаем файл в байты (для совместимости с views.py)
-        try:
-            with open(file_path, 'rb') as f:
-                return f.read()
-        except Exception as e:
-            logger.error(f"Error reading generated TTS file: {e}")
-            return None
+        return await manager.synthesize(text, mood=mood)
 
+    @classmethod
+    async def speak_as(cls, text: str, mood: str = "neutral", audio_format: str = None):
+        """(байты, формат) в запрошенном формате — 'opus', 'mp3' или 'wav'."""
+        manager = TTSManager()
+        return await manager.synthesize_as(text, mood=mood, audio_format=audio_format)
+
+    @classmethod
+    async def speak_stream(cls, text: str, mood: str = "neutral"):
+        """Async-итератор кусков аудио — для клиентов, которые могут проигрывать по мере получения."""
+        manager = TTSManager()
+        async for chunk in manager.stream(text, mood=mood):
+            yield chunk
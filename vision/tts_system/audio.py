@@ -0,0 +1,110 @@
+"""
+Кодирование аудио в памяти (без временных файлов).
+"""
+import io
+import shutil
+import subprocess
+import wave
+
+import numpy as np
+
+# Частота дискретизации KaniTTS (NanoCodec), если модель не сообщает свою
+KANI_SAMPLE_RATE = 22050
+
+
+def to_int16(audio) -> np.ndarray:
+    """float [-1, 1] или int16, моно или (N, channels) -> int16."""
+    if hasattr(audio, "detach"):  # torch.Tensor
+        audio = audio.detach().cpu().numpy()
+    audio = np.asarray(audio)
+    if audio.dtype == np.int16:
+        return audio
+    audio = np.clip(audio.astype(np.float32), -1.0, 1.0)
+    return (audio * 32767.0).astype(np.int16)
+
+
+def encode_wav(audio, sample_rate: int) -> bytes:
+    """PCM 16-bit WAV в байтах."""
+    pcm = to_int16(audio)
+    if pcm.ndim > 1 and pcm.shape[0] < pcm.shape[-1]:
+        pcm = pcm.T  # (channels, N) -> (N, channels)
+    channels = 1 if pcm.ndim == 1 else pcm.shape[1]
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(np.ascontiguousarray(pcm).tobytes())
+    return buffer.getvalue()
+
+
+class AudioFormat:
+    def __init__(self, name, mime, ext, ffmpeg_args):
+        self.name = name
+        self.mime = mime
+        self.ext = ext
+        self.ffmpeg_args = ffmpeg_args
+
+
+# Форматы ответа. Речь моно, поэтому низкого битрейта хватает:
+# Opus 24 кбит/с примерно в 10 раз меньше 16-bit WAV
+AUDIO_FORMATS = {
+    'opus': AudioFormat('opus', 'audio/ogg; codecs=opus', 'ogg', ['-c:a', 'libopus', '-b:a', '24k', '-f', 'ogg']),
+    'mp3': AudioFormat('mp3', 'audio/mpeg', 'mp3', ['-c:a', 'libmp3lame', '-b:a', '48k', '-f', 'mp3']),
+    'wav': AudioFormat('wav', 'audio/wav', 'wav', ['-c:a', 'pcm_s16le', '-f', 'wav']),
+}
+# Расширение файла движка -> формат
+EXT_FORMATS = {'mp3': 'mp3', 'wav': 'wav', 'ogg': 'opus'}
+
+_FORMAT_ALIASES = {
+    'opus': 'opus', 'ogg': 'opus', 'audio/ogg': 'opus', 'audio/opus': 'opus',
+    'mp3': 'mp3', 'mpeg': 'mp3', 'audio/mpeg': 'mp3', 'audio/mp3': 'mp3',
+    'wav': 'wav', 'audio/wav': 'wav', 'audio/x-wav': 'wav', 'audio/wave': 'wav',
+}
+
+
+def normalize_format(value):
+    """'ogg', 'audio/mpeg', 'WAV', ... -> 'opus' / 'mp3' / 'wav'; None, если формат неизвестен."""
+    if not value:
+        return None
+    return _FORMAT_ALIASES.get(value.split(';')[0].strip().lower())
+
+
+def format_from_accept(accept: str):
+    """Самый предпочтительный поддерживаемый аудиоформат из заголовка Accept (с учётом q)."""
+    best, best_q = None, 0.0
+    for item in (accept or "").split(','):
+        media, *params = [part.strip() for part in item.split(';')]
+        q = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        name = normalize_format(media)
+        # при равном q побеждает первый в списке
+        if name and q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def transcode(data: bytes, target: str):
+    """
+    Перекодирует аудио в формат `target` через ffmpeg (stdin -> stdout, без файлов).
+    None, если ffmpeg недоступен или завершился с ошибкой.
+    """
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        return None
+    try:
+        result = subprocess.run(
+            [ffmpeg, '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+             '-ac', '1', *AUDIO_FORMATS[target].ffmpeg_args, 'pipe:1'],
+            input=data, capture_output=True, timeout=20,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if result.returncode != 0 or not result.stdout:
+        return None
+    return result.stdout
@@ -0,0 +1,243 @@
+"""
+Кэш синтезированной речи с адресацией по содержимому.
+
+Ключ — хэш (текст, голос, скорость, настроение, движок), поэтому одинаковая
+фраза с теми же параметрами синтезируется один раз. Два уровня:
+
+- горячий — последние фразы в памяти (LRU, ограничен по байтам);
+- дисковый — файлы <ключ>.<ext> в TTSConfig.CACHE_DIR (LRU, ограничен по байтам,
+  порядок переживает перезапуск через mtime).
+
+gc() удаляет осиротевшие файлы: недописанные .tmp, файлы без записи в индексе
+и старые tts_<uuid>.* от прежней схемы без кэша.
+
+Из корутин — lookup_async() / store_async(): горячий уровень отвечает сразу,
+чтение и запись файлов идут в пуле 'tts', не блокируя event loop.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .config import TTSConfig
+
+logger = logging.getLogger(__name__)
+
+
+class TTSCache:
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, directory: str, hot_bytes: int = 16 * 2**20, disk_bytes: int = 256 * 2**20,
+                 orphan_dirs=(), orphan_age: float = 3600.0):
+        self.directory = directory
+        self.hot_bytes = hot_bytes
+        self.disk_bytes = disk_bytes
+        self.orphan_dirs = tuple(orphan_dirs)
+        self.orphan_age = orphan_age
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._hot = OrderedDict()    # key -> bytes
+        self._hot_size = 0
+        self._disk = OrderedDict()   # key -> (filename, size)
+        self._disk_size = 0
+        self._stats = {"hot_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0,
+                       "hot_evictions": 0, "disk_evictions": 0, "orphans_removed": 0}
+        self._load_index()
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls(
+                        TTSConfig.CACHE_DIR,
+                        hot_bytes=TTSConfig.CACHE_HOT_BYTES,
+                        disk_bytes=TTSConfig.CACHE_DISK_BYTES,
+                        orphan_dirs=[TTSConfig.OUTPUT_PATH],
+                    )
+                    # Обход каталогов — в фоне: первый get() часто вызывается из корутины
+                    threading.Thread(target=cls._instance.gc, name='tts-cache-gc', daemon=True).start()
+        return cls._instance
+
+    @staticmethod
+    def key(text: str, voice: str, rate: str, mood: str, engine: str) -> str:
+        payload = json.dumps([text.strip(), voice, rate, mood, engine], ensure_ascii=False)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+    def lookup(self, key: str):
+        """Аудио из кэша (горячий уровень, затем диск) или None."""
+        data, entry = self._lookup_memory(key)
+        if data is not None or entry is None:
+            return data
+        return self._read_disk(key, entry)
+
+    async def lookup_async(self, key: str):
+        """Как lookup(), но файл читается в пуле 'tts'."""
+        data, entry = self._lookup_memory(key)
+        if data is not None or entry is None:
+            return data
+        from vision.executors import run_in
+        return await run_in('tts', self._read_disk, key, entry)
+
+    def _lookup_memory(self, key):
+        """(байты из горячего уровня, None) или (None, запись дискового индекса либо None при промахе)."""
+        with self._lock:
+            data = self._hot.get(key)
+            if data is not None:
+                self._hot.move_to_end(key)
+                self._stats["hot_hits"] += 1
+                return data, None
+            entry = self._disk.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None, None
+            self._disk.move_to_end(key)
+            return None, entry
+
+    def _read_disk(self, key, entry):
+        path = os.path.join(self.directory, entry[0])
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # LRU-порядок после перезапуска
+        except OSError:
+            with self._lock:
+                self._drop_disk(key)
+                self._stats["misses"] += 1
+            return None
+
+        with self._lock:
+            self._stats["disk_hits"] += 1
+            self._put_hot(key, data)
+        return data
+
+    def path(self, key: str):
+        """Путь к файлу в дисковом кэше или None."""
+        with self._lock:
+            entry = self._disk.get(key)
+        return os.path.join(self.directory, entry[0]) if entry else None
+
+    def store(self, key: str, data: bytes, ext: str) -> str:
+        """Кладёт аудио в оба уровня. Возвращает имя файла в дисковом кэше."""
+        self._store_memory(key, data)
+        return self._write_disk(key, data, ext)
+
+    async def store_async(self, key: str, data: bytes, ext: str) -> str:
+        """Как store(): в горячий уровень сразу, файл пишется в пуле 'tts'."""
+        self._store_memory(key, data)
+        from vision.executors import run_in
+        return await run_in('tts', self._write_disk, key, data, ext)
+
+    def _store_memory(self, key, data):
+        with self._lock:
+            self._stats["stores"] += 1
+            self._put_hot(key, data)
+
+    def _write_disk(self, key, data, ext):
+        filename = f"{key}.{ext}"
+        path = os.path.join(self.directory, filename)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)  # атомарно: читатели не увидят недописанный файл
+        except OSError as e:
+            logger.error(f"TTS cache write failed: {e}")
+            return None
+
+        with self._lock:
+            self._drop_disk(key)
+            self._disk[key] = (filename, len(data))
+            self._disk_size += len(data)
+            self._evict_disk()
+        return filename
+
+    def gc(self) -> int:
+        """Удаляет осиротевшие файлы. Возвращает число удалённых."""
+        now = time.time()
+        with self._lock:
+            known = {filename for filename, _ in self._disk.values()}
+        removed = 0
+        candidates = [(self.directory, name) for name in _listdir(self.directory) if name not in known]
+        for directory in self.orphan_dirs:
+            candidates += [(directory, name) for name in _listdir(directory) if name.startswith('tts_')]
+        for directory, name in candidates:
+            path = os.path.join(directory, name)
+            try:
+                if not os.path.isfile(path) or now - os.path.getmtime(path) < self.orphan_age:
+                    continue
+                os.remove(path)
+                removed += 1
+            except OSError:
+                continue
+        with self._lock:
+            self._stats["orphans_removed"] += removed
+        if removed:
+            logger.info(f"TTS cache GC: removed {removed} orphaned files")
+        return removed
+
+    @property
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(hot_entries=len(self._hot), hot_mb=round(self._hot_size / 2**20, 2),
+                         disk_entries=len(self._disk), disk_mb=round(self._disk_size / 2**20, 2))
+        lookups = stats["hot_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hot_hits"] + stats["disk_hits"]) / lookups, 3) if lookups else 0.0
+        return stats
+
+    def _load_index(self):
+        entries = []
+        for name in _listdir(self.directory):
+            key, _, ext = name.partition('.')
+            if not ext or '.' in ext:  # *.tmp и чужие файлы — кандидаты для gc()
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, key, name, stat.st_size))
+        for _, key, name, size in sorted(entries):
+            self._disk[key] = (name, size)
+            self._disk_size += size
+        self._evict_disk()
+
+    def _put_hot(self, key, data):
+        if len(data) > self.hot_bytes:
+            return
+        if key in self._hot:
+            self._hot_size -= len(self._hot.pop(key))
+        self._hot[key] = data
+        self._hot_size += len(data)
+        while self._hot_size > self.hot_bytes:
+            _, evicted = self._hot.popitem(last=False)
+            self._hot_size -= len(evicted)
+            self._stats["hot_evictions"] += 1
+
+    def _drop_disk(self, key):
+        entry = self._disk.pop(key, None)
+        if entry is not None:
+            self._disk_size -= entry[1]
+
+    def _evict_disk(self):
+        while self._disk_size > self.disk_bytes and self._disk:
+            key, (filename, size) = self._disk.popitem(last=False)
+            self._disk_size -= size
+            self._stats["disk_evictions"] += 1
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except OSError:
+                pass
+
+
+def _listdir(directory):
+    try:
+        return os.listdir(directory)
+    except OSError:
+        return []
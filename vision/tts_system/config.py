@@ -10,6 +10,9 @@ OUTPUT_DIR = os.path.join(settings.MEDIA_ROOT, 'tts')
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 class TTSConfig:
+    # KaniTTS временно отключён, используется EdgeTTS
+    KANI_ENABLED = os.getenv('KANI_TTS_ENABLED', 'False') == 'True'
+
     # Имя модели
     MODEL_NAME = "nineninesix/kani-tts-450m-0.1-pt"
     
@@ -22,3 +25,9 @@ class TTSConfig:
     
     # URL префикс (для формирования ссылки)
     MEDIA_URL = settings.MEDIA_URL + 'tts/'
+
+    # Кэш синтезированных фраз (см. cache.py): горячий уровень в памяти + файлы на диске
+    CACHE_DIR = os.path.join(OUTPUT_DIR, 'cache')
+    CACHE_URL = MEDIA_URL + 'cache/'
+    CACHE_HOT_BYTES = int(os.getenv('TTS_CACHE_HOT_MB', '16')) * 2**20
+    CACHE_DISK_BYTES = int(os.getenv('TTS_CACHE_DISK_MB', '256')) * 2**20
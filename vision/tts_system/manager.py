@@ -1,11 +1,26 @@
 import os
-import uuid
 import logging
 from django.conf import settings
 from .config import TTSConfig
+from .cache import TTSCache
+from .audio import encode_wav, transcode, AUDIO_FORMATS, EXT_FORMATS, KANI_SAMPLE_RATE
+from vision.registry import ModelRegistry
 
 logger = logging.getLogger(__name__)
 
+def _load_kani():
+    if not TTSConfig.KANI_ENABLED:
+        # Temporarily disabled KaniTTS as per request
+        logger.info(f"Skipping KaniTTS loader. Using EdgeTTS fallback.")
+        return None
+    logger.info(f"⏳ Loading KaniTTS model: {TTSConfig.MODEL_NAME}...")
+    from kani_tts import KaniTTS
+    model = KaniTTS.from_pretrained(TTSConfig.MODEL_NAME, device=TTSConfig.DEVICE)
+    logger.info("✅ KaniTTS model loaded successfully.")
+    return model
+
+ModelRegistry.register('kani', _load_kani)
+
 class TTSManager:
     _instance = None
     _model = None
@@ -17,64 +32,150 @@ class TTSManager:
         return cls._instance
 
     def _load_model(self):
-        """Ленивая загрузка модели (Singleton)"""
+        """Ленивая загрузка модели через общий ModelRegistry (один экземпляр на процесс)"""
         if self._model:
             return
-
-        # Temporarily disabled KaniTTS as per request
-        logger.info(f"Skipping KaniTTS loader. Using EdgeTTS fallback.")
-        self._model = None
-        # try:
-        #     logger.info(f"⏳ Loading KaniTTS model: {TTSConfig.MODEL_NAME}...")
-        #     from kani_tts import KaniTTS
-        #     self._model = KaniTTS.from_pretrained(TTSConfig.MODEL_NAME, device=TTSConfig.DEVICE)
-        #     logger.info("✅ KaniTTS model loaded successfully.")
-        # except ImportError:
-        #     logger.warning("⚠️ kani-tts library not found. Using EdgeTTS fallback.")
-        #     self._model = None
-        # except Exception as e:
-        #     logger.error(f"❌ Failed to load KaniTTS: {e}")
-        #     self._model = None
+        self._model = ModelRegistry.get('kani')
 
     async def generate_speech(self, text: str, mood: str = "neutral") -> str:
         """
-        Генерирует речь и возвращает RELATIVE URL к файлу.
+        Генерирует речь и возвращает RELATIVE URL к файлу (в дисковом кэше TTS).
         mood: 'happy', 'tired', 'neutral'
         """
-        filename = f"tts_{uuid.uuid4().hex[:8]}.wav"
-        full_path = os.path.join(TTSConfig.OUTPUT_PATH, filename)
-        
+        result = await self._synthesize(text, mood)
+        path = TTSCache.get().path(result[0]) if result else None
+        return f"{TTSConfig.CACHE_URL}{os.path.basename(path)}" if path else None
+
+    async def synthesize(self, text: str, mood: str = "neutral") -> bytes:
+        """Аудио фразы в байтах. Повторная фраза с теми же параметрами берётся из кэша."""
+        result = await self._synthesize(text, mood)
+        return result[1] if result else None
+
+    async def synthesize_as(self, text: str, mood: str = "neutral", audio_format: str = None):
+        """
+        (байты, формат) в запрошенном формате ('opus' / 'mp3' / 'wav'; None — родной формат движка).
+        Перекодированный вариант кэшируется рядом с исходным, так что кодирование
+        выполняется один раз на фразу. Без ffmpeg отдаётся родной формат.
+        """
+        result = await self._synthesize(text, mood)
+        if result is None:
+            return None, None
+        key, data, ext = result
+        native = EXT_FORMATS[ext]
+        if audio_format is None or audio_format == native:
+            return data, native
+
+        cache = TTSCache.get()
+        variant_key = f"{key}_{audio_format}"
+        encoded = await cache.lookup_async(variant_key)
+        if encoded is None:
+            from vision.executors import run_in
+            encoded = await run_in('tts', transcode, data, audio_format)
+            if encoded is None:
+                logger.warning(f"Cannot encode TTS audio to {audio_format} (ffmpeg missing?), sending {native}")
+                return data, native
+            await cache.store_async(variant_key, encoded, AUDIO_FORMATS[audio_format].ext)
+        return encoded, audio_format
+
+    async def stream(self, text: str, mood: str = "neutral"):
+        """
+        Async-итератор кусков аудио по мере синтеза (EdgeTTS отдаёт MP3 по частям).
+        Фраза из кэша отдаётся одним куском; новая — попадает в кэш после последнего куска.
+        """
+        cache = TTSCache.get()
+
+        if self._model:
+            # KaniTTS синтезирует фразу целиком (или уходит в fallback на EdgeTTS внутри)
+            result = await self._synthesize(text, mood)
+            if result is not None:
+                yield result[1]
+            return
+
+        voice, rate = edge_voice(mood)
+        key = cache.key(text, voice, rate, mood, "edge")
+        data = await cache.lookup_async(key)
+        if data is not None:
+            yield data
+            return
+
+        chunks = []
+        try:
+            async for chunk in self._edge_chunks(text, voice, rate):
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            logger.error(f"EdgeTTS failed: {e}")
+            return
+        if chunks:
+            await cache.store_async(key, b"".join(chunks), "mp3")
+
+    async def _synthesize(self, text: str, mood: str):
+        """(ключ кэша, байты, расширение) или None."""
+        cache = TTSCache.get()
+
         # 1. Попытка использовать KaniTTS (высокое качество)
         if self._model:
+            key = cache.key(text, "kani", "+0%", mood, "kani")
+            data = await cache.lookup_async(key)
+            if data is not None:
+                return key, data, "wav"
             try:
-                # KaniTTS поддерживет тонкую настройку через Speaker ID или промпты
-                audio = self._model.generate(text)
-                self._model.save_audio(audio, full_path)
-                return f"{TTSConfig.MEDIA_URL}{filename}"
+                data = await self._kani_bytes(text)
+                await cache.store_async(key, data, "wav")
+                return key, data, "wav"
             except Exception as e:
                 logger.error(f"KaniTTS generation failed: {e}. Falling back to EdgeTTS.")
 
         # 2. Fallback на EdgeTTS с выбором голоса по настроению
-        # Voices: DmitryNeural (Neutral), SvetlanaNeural (Happy/Soft), EliasNeural (Calm)
-        voice_map = {
-            "happy": "ru-RU-SvetlanaNeural",
-            "tired": "ru-RU-DmitryNeural", # Can add pitch/rate adjustments
-            "neutral": "ru-RU-DmitryNeural"
-        }
-        voice = voice_map.get(mood, "ru-RU-DmitryNeural")
-        
-        # Настройка скорости в зависимости от настроения
-        rate = "+0%"
-        if mood == "tired":
-            rate = "-10%" # Медленнее, если пользователь устал
-        elif mood == "happy":
-            rate = "+5%"  # Чуть бодрее
-            
+        voice, rate = edge_voice(mood)
+        key = cache.key(text, voice, rate, mood, "edge")
+        data = await cache.lookup_async(key)
+        if data is not None:
+            return key, data, "mp3"
         try:
-            import edge_tts
-            communicate = edge_tts.Communicate(text, voice, rate=rate)
-            await communicate.save(full_path)
-            return f"{TTSConfig.MEDIA_URL}{filename}"
+            data = b"".join([chunk async for chunk in self._edge_chunks(text, voice, rate)])
         except Exception as e:
             logger.error(f"EdgeTTS failed: {e}")
             return None
+        if not data:
+            return None
+        await cache.store_async(key, data, "mp3")
+        return key, data, "mp3"
+
+    async def _kani_bytes(self, text: str) -> bytes:
+        # Генерация на CPU/GPU — в отдельном пуле, WAV собирается в памяти
+        from vision.executors import run_in
+
+        def generate():
+            # KaniTTS поддерживет тонкую настройку через Speaker ID или промпты
+            audio = self._model.generate(text)
+            sample_rate = getattr(self._model, "sample_rate", KANI_SAMPLE_RATE)
+            return encode_wav(audio, sample_rate)
+
+        return await run_in('tts', generate)
+
+    async def _edge_chunks(self, text: str, voice: str, rate: str):
+        import edge_tts
+        communicate = edge_tts.Communicate(text, voice, rate=rate)
+        async for message in communicate.stream():
+            if message["type"] == "audio":
+                yield message["data"]
+
+
+def edge_voice(mood: str):
+    """(голос, скорость) EdgeTTS для настроения."""
+    # Voices: DmitryNeural (Neutral), SvetlanaNeural (Happy/Soft), EliasNeural (Calm)
+    voice_map = {
+        "happy": "ru-RU-SvetlanaNeural",
+        "tired": "ru-RU-DmitryNeural", # Can add pitch/rate adjustments
+        "neutral": "ru-RU-DmitryNeural"
+    }
+    voice = voice_map.get(mood, "ru-RU-DmitryNeural")
+
+    # Настройка скорости в зависимости от настроения
+    rate = "+0%"
+    if mood == "tired":
+        rate = "-10%" # Медленнее, если пользователь устал
+    elif mood == "happy":
+        rate = "+5%"  # Чуть бодрее
+    return voice, rate
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import DetectAPIView, SmartAnalyzeView, NavigationView, index
+from .views import DetectAPIView, SmartAnalyzeView, NavigationView, index, metrics
 from . import auth_views
 
 urlpatterns = [
@@ -17,4 +17,5 @@ urlpatterns = [
     path('api/detect/', DetectAPIView.as_view(), name='detect_api'),
     path('api/smart-analyze/', SmartAnalyzeView.as_view(), name='smart_analyze_api'),
     path('api/navigate/', NavigationView.as_view(), name='navigate_api'),
+    path('api/metrics/', metrics, name='metrics'),
 ]
@@ -1,32 +1,370 @@
 import os
 import json
 import logging
+import threading
+import time
 import numpy as np
+from collections import OrderedDict
+from contextlib import contextmanager
 from typing import List, Dict, Any
 from datetime import datetime
 
+from .embeddings import get_embedder
+from .text_index import BM25Index, reciprocal_rank_fusion
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
 logger = logging.getLogger(__name__)
 
+
+class EmbeddingIndex:
+    """
+    Матрица эмбеддингов фактов (float32, строки нормированы) в embeddings.npy.
+
+    Файл открывается через np.load(mmap_mode='r+') и создаётся с запасом строк:
+    новый факт — запись одной строки в mmap и счётчика в embeddings.meta.json,
+    при заполнении файл пересоздаётся вдвое большим. Поиск — скалярное
+    произведение со всей матрицей и argpartition для top-k.
+    """
+    MIN_CAPACITY = 64
+
+    def __init__(self, directory: str, embedder):
+        self.embedder = embedder
+        self.path = os.path.join(directory, "embeddings.npy")
+        self.meta_path = os.path.join(directory, "embeddings.meta.json")
+        self.count = 0
+        self._matrix = None
+
+    def __len__(self):
+        return self.count
+
+    def load(self, texts: List[str]):
+        """Открывает сохранённую матрицу и досчитывает недостающие строки (или строит заново)."""
+        meta = _read_json(self.meta_path) or {}
+        usable = (
+            meta.get("embedder") == self.embedder.name
+            and meta.get("dim") == self.embedder.dim
+            and 0 <= meta.get("count", -1) <= len(texts)
+            and os.path.exists(self.path)
+        )
+        if usable:
+            try:
+                matrix = np.load(self.path, mmap_mode='r+')
+                usable = matrix.ndim == 2 and matrix.shape[1] == self.embedder.dim and meta["count"] <= len(matrix)
+            except (OSError, ValueError):
+                usable = False
+        if usable:
+            self._matrix = matrix
+            self.count = meta["count"]
+        else:
+            self._matrix = None
+            self.count = 0
+        # Хвост фактов без векторов (сбой между записью факта и вектора или смена эмбеддера)
+        missing = texts[self.count:]
+        if missing:
+            self.extend(self.embedder.embed_batch(missing))
+
+    def extend(self, vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.embedder.dim)
+        needed = self.count + len(vectors)
+        if self._matrix is None or needed > len(self._matrix):
+            self._grow(needed)
+        self._matrix[self.count:needed] = vectors
+        self._matrix.flush()
+        self.count = needed
+        # Счётчик пишется после строк: при сбое лишние строки просто не видны
+        _write_json(self.meta_path, {"embedder": self.embedder.name, "dim": self.embedder.dim, "count": self.count})
+
+    def search(self, query: str, top_k: int = 3, min_score: float = 0.0):
+        """[(номер факта, сходство)] по убыванию сходства."""
+        if not self.count or top_k <= 0:
+            return []
+        scores = self._matrix[:self.count] @ self.embedder.embed(query)
+        if top_k < len(scores):
+            top = np.argpartition(scores, -top_k)[-top_k:]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(int(i), float(scores[i])) for i in top if scores[i] > min_score]
+
+    def _grow(self, needed):
+        capacity = max(self.MIN_CAPACITY, needed, 2 * (len(self._matrix) if self._matrix is not None else 0))
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp.npy"
+        matrix = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                           shape=(capacity, self.embedder.dim))
+        if self.count:
+            matrix[:self.count] = self._matrix[:self.count]
+        matrix.flush()
+        del matrix
+        self._matrix = None
+        os.replace(tmp_path, self.path)
+        self._matrix = np.load(self.path, mmap_mode='r+')
+
+
+class FactLog:
+    """
+    Хранилище фактов: снапшот + журнал добавлений.
+
+    facts.snapshot.json — {"count": n, "facts": [...]}, пишется атомарно (tmp + os.replace).
+    facts.log.jsonl     — по строке на факт {"seq": номер, ...}, дописывается одним write
+                          с O_APPEND, поэтому добавление факта стоит O(1).
+
+    Загрузка — снапшот плюс воспроизведение журнала (записи с seq < count уже в снапшоте,
+    оборванная последняя строка после сбоя пропускается). Когда в журнале набирается
+    compact_every записей, он переименовывается в facts.log.jsonl.compacting, новые
+    записи идут в свежий журнал, а фоновый поток пишет новый снапшот и удаляет старый журнал.
+    Старый knowledge_base.json читается как снапшот и исчезает после первой компакции.
+
+    signature — (размер, mtime) файлов после последней собственной записи или загрузки;
+    если на диске другая, файлы менял кто-то ещё (другой процесс) и память устарела.
+    Память одного пользователя пишут и Django, и WS-сервер, поэтому записи идут под
+    файловой блокировкой каталога (locked()), а перед записью устаревшая память
+    перечитывается — иначе seq и строка эмбеддинга были бы взяты из старой длины.
+    """
+
+    def __init__(self, directory: str, compact_every: int = 500):
+        self.directory = directory
+        self.compact_every = compact_every
+        self.snapshot_path = os.path.join(directory, "facts.snapshot.json")
+        self.log_path = os.path.join(directory, "facts.log.jsonl")
+        self.compacting_path = f"{self.log_path}.compacting"
+        self.legacy_path = os.path.join(directory, "knowledge_base.json")
+        self.lock_path = os.path.join(directory, "memory.lock")
+        self.log_records = 0
+        self.signature = None
+        self._compaction = None
+        self._io_lock = threading.Lock()
+
+    def disk_signature(self):
+        signature = []
+        for path in (self.snapshot_path, self.log_path, self.compacting_path, self.legacy_path):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def is_stale(self) -> bool:
+        return self.signature is None or self.disk_signature() != self.signature
+
+    @contextmanager
+    def locked(self):
+        """Межпроцессная блокировка каталога памяти (flock / msvcrt.locking)."""
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            os.close(fd)
+
+    def load(self) -> List[Dict[str, Any]]:
+        with self._io_lock:
+            self.signature = self.disk_signature()
+            self.log_records = 0
+            return self._load()
+
+    def _load(self) -> List[Dict[str, Any]]:
+        snapshot = _read_json(self.snapshot_path)
+        if isinstance(snapshot, dict):
+            facts = snapshot.get("facts", [])
+        else:
+            facts = _read_json(self.legacy_path) or []
+            if facts:
+                self.log_records = self.compact_every  # перенести в снапшот при первой записи
+
+        for path in (self.compacting_path, self.log_path):
+            for record in _read_jsonl(path):
+                seq = record.pop("seq", len(facts))
+                if seq < len(facts):
+                    continue
+                facts.append(record)
+                if path == self.log_path:
+                    self.log_records += 1
+        return facts
+
+    def append(self, entry: Dict[str, Any], seq: int):
+        os.makedirs(self.directory, exist_ok=True)
+        line = (json.dumps(dict(entry, seq=seq), ensure_ascii=False) + "\n").encode('utf-8')
+        with self._io_lock:
+            stale = self.is_stale()
+            fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._update_signature(stale)
+        self.log_records += 1
+
+    def needs_compaction(self) -> bool:
+        busy = self._compaction is not None and self._compaction.is_alive()
+        return not busy and self.log_records >= self.compact_every
+
+    def compact(self, facts: List[Dict[str, Any]], background: bool = True):
+        """
+        facts — копия всех фактов на момент вызова (вызывать под блокировкой владельца
+        и locked(), с актуальной памятью — чтобы между копией и ротацией журнала не было записей).
+        """
+        if self.is_stale():
+            # Снапшот из устаревшей памяти затёр бы факты другого процесса
+            logger.warning("Fact log compaction refused: memory is stale")
+            return
+        # Если журнал прошлой (упавшей) компакции ещё лежит, текущий не трогаем: снапшот
+        # всё равно содержит все факты, а записи с seq < count при загрузке пропускаются
+        if not os.path.exists(self.compacting_path):
+            with self._io_lock:
+                stale = self.is_stale()
+                if os.path.exists(self.log_path):
+                    os.replace(self.log_path, self.compacting_path)
+                self._update_signature(stale)
+            self.log_records = 0
+        if background:
+            self._compaction = threading.Thread(target=self._write_snapshot, args=(facts,),
+                                                name="fact-log-compaction", daemon=True)
+            self._compaction.start()
+        else:
+            self._write_snapshot(facts)
+
+    def _write_snapshot(self, facts):
+        try:
+            # Долгая запись во временный файл — без блокировки, добавления не ждут
+            tmp_path = _write_json_tmp(self.snapshot_path, {"count": len(facts), "facts": facts})
+            with self.locked(), self._io_lock:
+                if self.is_stale():
+                    # После ротации файлы менял другой процесс (мог и сам сделать снапшот):
+                    # наш снапшот не заменяет чужой, .compacting останется до следующей компакции
+                    os.remove(tmp_path)
+                    logger.info("Fact log compaction skipped: files changed by another process")
+                    return
+                os.replace(tmp_path, self.snapshot_path)
+                for path in (self.compacting_path, self.legacy_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self._update_signature(False)
+        except OSError as e:
+            logger.error(f"Fact log compaction failed: {e}")
+
+    def _update_signature(self, stale):
+        # Если до нашей записи файлы уже менял кто-то другой — чужие изменения не
+        # «присваиваем», память остаётся устаревшей до перезагрузки
+        self.signature = None if stale else self.disk_signature()
+
+
 class VectorMemory:
     """
-    Упрощенная векторная память на основе косинусного сходства.
-    В будущем может быть заменена на ChromaDB или FAISS.
+    Векторная память фактов пользователя.
+    Тексты — в FactLog (снапшот + журнал), эмбеддинги — в EmbeddingIndex (embeddings.npy, mmap).
+    Эмбеддер — settings.VECTOR_MEMORY['embedder']: 'hashing' или модель sentence-transformers.
+    Ключевые слова — BM25Index (vision/text_index.py); VECTOR_MEMORY['retrieval'] выбирает
+    'hybrid' (слияние BM25 и эмбеддингов по местам), 'bm25' или 'embedding'.
+
+    for_user() отдаёт загруженную память из общего LRU процесса: горячие пользователи
+    не читают и не разбирают файлы на каждом запросе.
     """
-    def __init__(self, persistence_path: str):
+    _user_memories = OrderedDict()  # user_id -> [VectorMemory, last_used]
+    _user_locks = {}
+    _registry_lock = threading.Lock()
+    _cache_stats = {"hits": 0, "misses": 0, "reloads": 0, "evictions": 0, "load_seconds": 0.0}
+
+    @classmethod
+    def for_user(cls, user_id, base_path: str = None):
+        """
+        Память пользователя VisionUser.id. Число загруженных памятей ограничено
+        VECTOR_MEMORY['cache_users'] (LRU), простаивающие дольше cache_idle_seconds
+        выгружаются. Если файлы изменил другой процесс, память перечитывается.
+        """
+        from django.conf import settings
+        config = getattr(settings, 'VECTOR_MEMORY', {})
+        key = str(user_id)
+
+        with cls._registry_lock:
+            cls._evict(config, time.monotonic())
+            entry = cls._user_memories.get(key)
+            if entry is not None and not entry[0].log.is_stale():
+                cls._user_memories.move_to_end(key)
+                entry[1] = time.monotonic()
+                cls._cache_stats["hits"] += 1
+                return entry[0]
+            user_lock = cls._user_locks.setdefault(key, threading.Lock())
+
+        # Загрузка — вне общей блокировки: другие пользователи её не ждут
+        with user_lock:
+            with cls._registry_lock:
+                entry = cls._user_memories.get(key)
+                if entry is not None and not entry[0].log.is_stale():
+                    entry[1] = time.monotonic()
+                    cls._cache_stats["hits"] += 1
+                    return entry[0]
+            started = time.perf_counter()
+            memory = cls(os.path.join(base_path or memory_root(), key))
+            elapsed = time.perf_counter() - started
+
+        with cls._registry_lock:
+            cls._cache_stats["reloads" if entry is not None else "misses"] += 1
+            cls._cache_stats["load_seconds"] += elapsed
+            cls._user_memories[key] = [memory, time.monotonic()]
+            cls._user_memories.move_to_end(key)
+            cls._evict(config, time.monotonic())
+        return memory
+
+    @classmethod
+    def cache_stats(cls):
+        with cls._registry_lock:
+            stats = dict(cls._cache_stats, users=len(cls._user_memories))
+        loads = stats["misses"] + stats["reloads"]
+        lookups = stats["hits"] + loads
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        stats["avg_load_ms"] = round(stats["load_seconds"] / loads * 1000, 2) if loads else 0.0
+        stats["load_seconds"] = round(stats["load_seconds"], 3)
+        return stats
+
+    @classmethod
+    def _evict(cls, config, now):
+        max_users = config.get('cache_users', 256)
+        idle = config.get('cache_idle_seconds', 1800)
+        while cls._user_memories:
+            key, (_, last_used) = next(iter(cls._user_memories.items()))
+            if len(cls._user_memories) <= max_users and now - last_used < idle:
+                break
+            cls._user_memories.popitem(last=False)
+            cls._user_locks.pop(key, None)
+            cls._cache_stats["evictions"] += 1
+
+    def __init__(self, persistence_path: str, embedder=None):
+        from django.conf import settings
+        config = getattr(settings, 'VECTOR_MEMORY', {})
+
         self.persistence_path = persistence_path
-        self.kb_path = os.path.join(persistence_path, "knowledge_base.json")
-        self.data = self._load()
-        
-    def _load(self):
-        if os.path.exists(self.kb_path):
-            with open(self.kb_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return []
-
-    def _save(self):
-        os.makedirs(self.persistence_path, exist_ok=True)
-        with open(self.kb_path, 'w', encoding='utf-8') as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        self.min_similarity = config.get('min_similarity', 0.2)
+        self.retrieval = config.get('retrieval', 'hybrid')
+        self._lock = threading.Lock()
+        self.log = FactLog(persistence_path, compact_every=config.get('compact_every', 500))
+        self.index = EmbeddingIndex(persistence_path, embedder or get_embedder(config.get('embedder', 'hashing')))
+        with self.log.locked():
+            self._reload()
+
+    def _reload(self):
+        """Перечитывает факты, индекс и BM25 с диска. Вызывать под log.locked()."""
+        self.data = self.log.load()
+        self.index.load([entry["text"] for entry in self.data])
+        self.keywords = BM25Index()
+        for i, entry in enumerate(self.data):
+            self.keywords.add(i, entry["text"])
 
     def add_fact(self, text: str, metadata: Dict[str, Any] = None):
         """Добавляет факт в базу знаний."""
@@ -34,36 +372,85 @@ class VectorMemory:
             "text": text,
             "metadata": metadata or {},
             "timestamp": datetime.now().isoformat(),
-            # В реальном приложении здесь был бы эмбеддинг
         }
-        self.data.append(entry)
-        self._save()
+        vector = self.index.embedder.embed(text)
+        with self._lock, self.log.locked():
+            # Другой процесс мог дописать факты (в том числе после выдачи экземпляра из
+            # for_user): seq и строка индекса — по актуальной длине
+            if self.log.is_stale():
+                self._reload()
+            self.log.append(entry, seq=len(self.data))
+            self.keywords.add(len(self.data), text)
+            self.data.append(entry)
+            self.index.extend(vector)
+            if self.log.needs_compaction():
+                self.log.compact(list(self.data))
         logger.info(f"Добавлен новый факт в память: {text[:50]}...")
 
     def search(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
-        """
-        Поиск релевантных фактов. 
-        Пока реализован простой текстовый поиск (в будущем - векторный).
-        """
-        query_words = set(query.lower().split())
-        scored_results = []
-        
-        for entry in self.data:
-            text = entry["text"].lower()
-            score = sum(1 for word in query_words if word in text)
-            if score > 0:
-                scored_results.append((score, entry))
-        
-        # Сортировка по весу
-        scored_results.sort(key=lambda x: x[0], reverse=True)
-        return [res[1] for res in scored_results[:top_k]]
+        """Поиск релевантных фактов: BM25 по основам слов и/или косинус эмбеддингов."""
+        # Кандидатов берём с запасом, чтобы слияние было из чего выбирать
+        candidates = top_k * 4
+        with self._lock:
+            # Закэшированный в for_user экземпляр мог устареть после выдачи
+            if self.log.is_stale():
+                with self.log.locked():
+                    self._reload()
+            rankings = []
+            if self.retrieval in ('hybrid', 'bm25'):
+                rankings.append(self.keywords.search(query, top_k=candidates))
+            if self.retrieval in ('hybrid', 'embedding'):
+                rankings.append(self.index.search(query, top_k=candidates, min_score=self.min_similarity))
+            hits = reciprocal_rank_fusion(*rankings, top_k=top_k)
+            return [self.data[i] for i, _ in hits]
 
     def get_context_string(self, query: str) -> str:
         results = self.search(query)
         if not results:
             return ""
-        
+
         context = "Известные факты из прошлого:\n"
         for i, res in enumerate(results):
             context += f"{i+1}. {res['text']}\n"
         return context
+
+
+def memory_root():
+    """Каталог памятей пользователей: data/memory/<VisionUser.id>."""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "memory")
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _read_jsonl(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+    except OSError:
+        return
+    for line in lines:
+        if not line.endswith("\n"):
+            break  # недописанная строка — запись оборвалась при сбое
+        try:
+            yield json.loads(line)
+        except ValueError:
+            logger.warning(f"Skipping corrupt record in {path}")
+
+
+def _write_json_tmp(path, payload):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp_path
+
+
+def _write_json(path, payload):
+    os.replace(_write_json_tmp(path, payload), path)
@@ -1,12 +1,8 @@
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.views import View
-from .yolo import model
-import cv2
-import numpy as np
-from PIL import Image
-import io
 
 # Маппинг классов на русский
 CLASS_NAMES_RU = {
@@ -94,7 +90,7 @@ CLASS_NAMES_RU = {
 
 @method_decorator(csrf_exempt, name='dispatch')
 class DetectAPIView(View):
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         if 'image' not in request.FILES:
             return JsonResponse({'message': 'Нет изображения'}, status=400)
 
@@ -102,65 +98,224 @@ class DetectAPIView(View):
         image_file = request.FILES['image']
         image_bytes = image_file.read()
         
-        # Конвертируем в OpenCV формат
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        # Декодирование (CPU, вне event loop); resize + CLAHE — внутри detect_async
+        frame = await run_in('decode', Frame.from_bytes, image_bytes, max_dim=1280)
 
-        if img is None:
+        if frame is None:
             return JsonResponse({'message': 'Ошибка обработки изображения'}, status=400)
 
-        # Preprocessing для улучшения распознавания
-        # 1. Resize если изображение слишком большое (оптимизация)
-        max_dimension = 1280
-        h, w = img.shape[:2]
-        if max(h, w) > max_dimension:
-            scale = max_dimension / max(h, w)
-            img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
-        
-        # 2. Улучшение контраста (CLAHE)
-        lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-        l, a, b = cv2.split(lab)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-        l = clahe.apply(l)
-        img = cv2.cvtColor(cv2.merge([l, a, b]), cv2.COLOR_LAB2BGR)
-
-        # Детекция (понижаем confidence для лучшего обнаружения)
-        results = model.predict(img, conf=0.3, iou=0.45)
+        # Детекция: пул процессов (INFERENCE_WORKERS['detect']) или общая батчевая очередь.
+        # Сбой детектора — ошибка, а не «Путь свободен»
+        # Уровень модели (vision/tiering.py): detect_async учитывает нагрузку через serve('detect')
+        tiers = track_tiers()
+        try:
+            detections = await detect_async(frame, raise_errors=True)
+        except Exception:
+            return JsonResponse({'message': 'Ошибка детекции'}, status=503)
         
-        detected_objects = []
-        for result in results:
-            for box in result.boxes:
-                class_id = int(box.cls[0])
-                class_name = model.names[class_id]
-                ru_name = CLASS_NAMES_RU.get(class_name, class_name)
-                if ru_name not in detected_objects:
-                    detected_objects.append(ru_name)
+        detected_objects = list(dict.fromkeys(
+            CLASS_NAMES_RU.get(name, name) for name in detections.unique_labels()
+        ))
 
         if not detected_objects:
             message = "Путь свободен"
         else:
             message = "Впереди: " + ", ".join(detected_objects)
 
-        return JsonResponse({'message': message})
+        # objects: боксы, угол (bearing) и расстояние для пространственного звука на клиенте
+        return JsonResponse({'message': message, 'objects': detections.to_json(), 'tiers': tiers})
 
 
-from .services import speech_to_text, analyze_image_local, generate_ai_response_async, text_to_speech_async, read_text_local, detect_objects_local
+from .services import speech_to_text_async, analyze_image_async, generate_ai_response_async, text_to_speech_as_async, speak_response_stream, read_text_async, detect_async, detections_from_result, CAPTION_FAILED
+from .batching import DetectionBatcher
+from .stt_batching import WhisperBatcher
+from .tiering import ModelTiering, track_tiers
+from .vector_memory import VectorMemory
+from .frame import Frame
+from .frame_cache import FrameResultCache
+from .registry import ModelRegistry
+from .workers import InferencePool
 from .models import VisionUser
 import base64
 import json
-from asgiref.sync import sync_to_async
+import logging
+import time
+from .executors import run_in, ModelExecutors
+from .pipeline import Pipeline, Stage
+from .llm_gateway import LLMGateway
+from .response_cache import ResponseCache
+from .tts_system.cache import TTSCache
+from .audio_response import negotiate_audio_format, speech_response
+from .speech_stream import iterate_in_thread
+
+logger = logging.getLogger(__name__)
+
+# Ключевые слова, по которым запрос требует OCR
+OCR_KEYWORDS = ['читай', 'прочти', 'текст', 'написано', 'цифры']
+
+
+async def _stage_decode(ctx):
+    # Декодируем ОДИН раз (max 640 для скорости), дальше YOLO, BLIP и OCR берут нужное представление из Frame
+    return await run_in('decode', Frame.from_bytes, ctx.inputs['image_bytes'], max_dim=640)
+
+
+async def _stage_stt(ctx):
+    return await speech_to_text_async(ctx.inputs['audio_file'])
+
+
+async def _stage_text(ctx):
+    text_input = ctx.inputs['text']
+    if ctx['stt']:
+        text_input = f"{text_input} {ctx['stt']}".strip()
+    return text_input
+
+
+async def _stage_intent(ctx):
+    text = ctx['text'].lower()
+    return {'ocr': any(w in text for w in OCR_KEYWORDS)}
+
+
+async def _stage_detect(ctx):
+    frame = ctx['decode']
+    return await ctx.inputs['frame_cache'].get_or_compute(
+        frame, 'detect', lambda: detect_async(frame, raise_errors=True), fallback=detections_from_result(None)
+    )
+
+
+async def _stage_caption(ctx):
+    frame = ctx['decode']
+    return await ctx.inputs['frame_cache'].get_or_compute(
+        frame, 'caption', lambda: analyze_image_async(frame, raise_errors=True), fallback=CAPTION_FAILED
+    )
+
+
+async def _stage_ocr(ctx):
+    frame = ctx['decode']
+    return await ctx.inputs['frame_cache'].get_or_compute(frame, 'ocr', lambda: read_text_async(frame, raise_errors=True))
+
+
+def _labels(detections):
+    return detections.unique_labels() if detections is not None else []
+
+
+async def _stage_llm(ctx):
+    # Если текста нет, но есть описание картинки -> "Что изображено?"
+    text_input = ctx['text'] or "Что изображено?"
+    vision_user = ctx.inputs['vision_user']
+    user = ctx.inputs['user']
+
+    await run_in('db', vision_user.add_message, "user", text_input)
+    response_text = await generate_ai_response_async(
+        text_input,
+        visual_context=ctx['caption'],
+        user_obj=vision_user,
+        ocr_context=ctx['ocr'],
+        detected_objects=_labels(ctx['detect'])
+    )
+    await run_in('db', vision_user.add_message, "assistant", response_text)
+
+    # Увеличиваем счетчик для аутентифицированных пользователей
+    if user:
+        await run_in('db', user.increment_request_count)
+    return response_text
+
+
+def _user_mood(vision_user):
+    return (vision_user.facts or {}).get('mood', 'neutral') if vision_user else 'neutral'
+
+
+async def _stage_tts(ctx):
+    # (байты, формат): формат согласован с клиентом, None — родной формат движка
+    return await text_to_speech_as_async(
+        ctx['llm'], mood=_user_mood(ctx.inputs['vision_user']), audio_format=ctx.inputs['audio_format']
+    )
+
+
+SMART_ANALYZE_PIPELINE = Pipeline([
+    Stage('decode', _stage_decode, when=lambda ctx: ctx.inputs['image_bytes']),
+    Stage('stt', _stage_stt, when=lambda ctx: ctx.inputs['audio_file']),
+    Stage('text', _stage_text, deps=['stt']),
+    Stage('intent', _stage_intent, deps=['text']),
+    Stage('detect', _stage_detect, deps=['decode'], when=lambda ctx: ctx['decode'] is not None),
+    Stage('caption', _stage_caption, deps=['decode'], when=lambda ctx: ctx['decode'] is not None),
+    Stage('ocr', _stage_ocr, deps=['decode', 'intent'],
+          when=lambda ctx: ctx['decode'] is not None and ctx['intent']['ocr']),
+    Stage('llm', _stage_llm, deps=['text', 'detect', 'caption', 'ocr'], when=lambda ctx: ctx['text'] or ctx['caption']),
+    Stage('tts', _stage_tts, deps=['llm'], when=lambda ctx: ctx['llm']),
+])
+
+# Какие стадии нужны режиму (зависимости подтягиваются сами)
+MODE_TARGETS = {
+    'navigator': ['detect'],  # Fast YOLO only
+    'chat': ['detect', 'tts'],
+}
+# Потоковый чат: LLM и TTS идут вне DAG, по предложениям (см. _stream_chat)
+STREAM_TARGETS = ['detect', 'caption', 'ocr']
+
+
+def _ndjson(payload):
+    return json.dumps(payload, ensure_ascii=False) + "\n"
+
+
+async def _stream_chat(ctx, detected_objects, objects_json, tiers):
+    """
+    NDJSON-поток ответа: сначала результаты зрения, затем по строке на каждое
+    озвученное предложение (аудио в base64 в согласованном формате), в конце
+    полный текст и тайминги.
+    """
+    started = time.perf_counter()
+    yield _ndjson({
+        'type': 'vision',
+        'debug_vision': ctx['caption'],
+        'detected_objects': detected_objects,
+        'objects': objects_json,
+        'tiers': tiers,
+    })
+
+    text_input = ctx['text'] or "Что изображено?"
+    vision_user = ctx.inputs['vision_user']
+    user = ctx.inputs['user']
+    await run_in('db', vision_user.add_message, "user", text_input)
+
+    sentences = []
+    async for index, sentence, audio, audio_format in speak_response_stream(
+        text_input,
+        visual_context=ctx['caption'],
+        user_obj=vision_user,
+        ocr_context=ctx['ocr'],
+        mood=_user_mood(vision_user),
+        detected_objects=detected_objects,
+        audio_format=ctx.inputs['audio_format']
+    ):
+        if index == 0:
+            ctx.timings['first_audio'] = round((time.perf_counter() - started) * 1000, 1)
+        sentences.append(sentence)
+        yield _ndjson({
+            'type': 'audio',
+            'index': index,
+            'text': sentence,
+            'audio': base64.b64encode(audio).decode('utf-8') if audio else None,
+            'audio_format': audio_format,
+        })
+    ctx.timings['llm_tts'] = round((time.perf_counter() - started) * 1000, 1)
+
+    response_text = " ".join(sentences)
+    await run_in('db', vision_user.add_message, "assistant", response_text)
+    if user:
+        await run_in('db', user.increment_request_count)
+
+    yield _ndjson({'type': 'done', 'message': response_text, 'timings': ctx.timings})
+
 
 @method_decorator(csrf_exempt, name='dispatch')
 class SmartAnalyzeView(View):
     async def post(self, request, *args, **kwargs):
-        import asyncio
-        
         # 1. Проверка аутентификации (опционально для совместимости)
         user = None
         if request.user.is_authenticated:
             user = request.user
             # Проверка лимитов
-            if not await sync_to_async(user.can_make_request)():
+            if not await run_in('db', user.can_make_request):
                 return JsonResponse({
                     'error': 'Daily limit reached',
                     'subscription_type': user.subscription_type,
@@ -170,94 +325,38 @@ class SmartAnalyzeView(View):
         # 2. Получаем данные
         image_file = request.FILES.get('image')
         audio_file = request.FILES.get('audio')
-        text_input = request.POST.get('text', '')
         user_id = request.POST.get('user_id', 'anonymous')
         mode = request.POST.get('mode', 'chat') # 'chat' or 'navigator'
+        if mode not in MODE_TARGETS:
+            mode = 'chat'
+        # stream=1: ответ отдаётся NDJSON-потоком, аудио — по мере готовности предложений
+        stream = mode == 'chat' and request.POST.get('stream', '').lower() in ('1', 'true')
+        # audio_format / Accept: бинарный multipart-ответ вместо base64 в JSON
+        audio_format = negotiate_audio_format(request)
 
         # 3. Получаем пользователя (для обратной совместимости с Telegram)
-        user_tuple = await sync_to_async(VisionUser.objects.get_or_create)(telegram_id=user_id)
+        user_tuple = await run_in('db', VisionUser.objects.get_or_create, telegram_id=user_id)
         vision_user = user_tuple[0]
 
-        # Подготовка тасков
-        stt_task = None
-        vision_task = None
-        image_bytes = None
-
-        # Запускаем STT
-        if audio_file:
-            # Важно: если audio_file это InMemoryUploadedFile, передача его в другой поток может быть tricky,
-            # но faster_whisper обычно принимает путь или file-like.
-            # Для надежности читаем в BytesIO если это не путь
-            stt_task = sync_to_async(speech_to_text)(audio_file)
-
-        # Подготовка изображения (Resize)
-        if image_file:
-            image_bytes = image_file.read()
-            # Оптимизация размера ПЕРЕД отправкой в модели (снижаем нагрузку на BLIP/OCR)
-            # Сделаем resize тут, в памяти
-            def optimize_image(img_data):
-                nparr = np.frombuffer(img_data, np.uint8)
-                img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                if img is None: return img_data
-                
-                # Max dimension 640 for speed
-                max_dim = 640
-                h, w = img.shape[:2]
-                if max(h, w) > max_dim:
-                    scale = max_dim / max(h, w)
-                    img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
-                    # Encode back to bytes
-                    _, encoded_img = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), 85])
-                    return encoded_img.tobytes()
-                return img_data
-
-            # Запускаем оптимизацию и Vision параллельно
-            # Но Vision требует байты. Лучше сначала оптимизировать (быстро), потом Vision.
-            # optimize_image - CPU bound, sync.
-            image_bytes = await sync_to_async(optimize_image)(image_bytes)
-
-            if mode == 'navigator':
-                 # Fast YOLO only
-                 # Мы можем запустить это сразу
-                 vision_task = sync_to_async(detect_objects_local)(image_bytes)
-            else:
-                 # BLIP
-                 vision_task = sync_to_async(analyze_image_local)(image_bytes)
-
-        # Запускаем задачи параллельно
-        # Структура tasks: [stt_task (optional), yolo_task (optional), blip_task (optional)]
-        tasks = []
-        task_map = {} # map task name to index
-
-        if stt_task:
-            task_map['stt'] = len(tasks)
-            tasks.append(stt_task)
-            
-        if image_bytes:
-            # Always run YOLO for HUD info
-            yolo_task = sync_to_async(detect_objects_local)(image_bytes)
-            task_map['yolo'] = len(tasks)
-            tasks.append(yolo_task)
-            
-            if mode != 'navigator':
-                blip_task = sync_to_async(analyze_image_local)(image_bytes)
-                task_map['blip'] = len(tasks)
-                tasks.append(blip_task)
+        # 4. Стадии запускаются параллельно, каждая не более одного раза.
+        # tiers — какими уровнями моделей (vision/tiering.py) обслужены стадии
+        tiers = track_tiers()
+        ctx = await SMART_ANALYZE_PIPELINE.run(
+            STREAM_TARGETS if stream else MODE_TARGETS[mode],
+            image_bytes=image_file.read() if image_file else None,
+            audio_file=audio_file,
+            text=request.POST.get('text', ''),
+            # Кэш результатов для почти одинаковых кадров этого пользователя
+            frame_cache=FrameResultCache.for_user(user_id),
+            vision_user=vision_user,
+            user=user,
+            audio_format=audio_format,
+        )
 
-        results = await asyncio.gather(*tasks)
-
-        # Разбираем результаты
-        transcript = results[task_map['stt']] if 'stt' in task_map else None
-        
-        # YOLO result: list of strings
-        detected_objects = results[task_map['yolo']] if 'yolo' in task_map else []
-        
-        # BLIP result: string description
-        visual_description = results[task_map['blip']] if 'blip' in task_map else None
-        
-        # Обновляем текст
-        if transcript:
-            text_input = f"{text_input} {transcript}".strip()
+        # YOLO result: Detections (боксы, угол, расстояние) + список имён для HUD
+        detections = ctx['detect']
+        detected_objects = _labels(detections)
+        objects_json = detections.to_json() if detections is not None else []
 
         # Если режим навигатора - возвращаем быстрый ответ
         if mode == 'navigator':
@@ -269,64 +368,59 @@ class SmartAnalyzeView(View):
             return JsonResponse({
                 'message': response_text, 
                 'audio': None,
-                'detected_objects': detected_objects
+                'detected_objects': detected_objects,
+                'objects': objects_json,
+                'timings': ctx.timings,
+                'tiers': tiers
             })
 
+        if stream:
+            if not (ctx['text'] or ctx['caption']):
+                return JsonResponse({'message': 'Не удалось распознать запрос.', 'audio': None})
+            body = _stream_chat(ctx, detected_objects, objects_json, tiers)
+            if not isinstance(request, ASGIRequest):
+                # WSGI: async-итератор Django собрал бы целиком — отдаём построчно из потока
+                body = iterate_in_thread(body)
+            return StreamingHttpResponse(body, content_type='application/x-ndjson')
+
         # Режим чата
-        visual_description = visual_result
-        ocr_text = None
+        response_text = ctx['llm']
+        if response_text is None:
+            return JsonResponse({'message': 'Не удалось распознать запрос.', 'audio': None})
 
-        # Теперь, имея полный текст, решаем про OCR
-        # OCR все еще может быть долгой, но она нужна только по запросу
-        if image_bytes and any(w in text_input.lower() for w in ['читай', 'прочти', 'текст', 'написано', 'цифры']):
-             ocr_text = await sync_to_async(read_text_local)(image_bytes)
+        audio_content, audio_content_format = ctx['tts'] or (None, None)
 
-        if not text_input:
-             # Если текста нет, но есть картинка -> "Что изображено?"
-             if visual_description:
-                 text_input = "Что изображено?"
-             else:
-                 return JsonResponse({'message': 'Не удалось распознать запрос.', 'audio': None})
-
-        # Сохраняем запрос
-        if vision_user:
-            await sync_to_async(vision_user.add_message)("user", text_input)
-
-        # 5. LLM - передаем vision_user только если он существует
-        response_text = await generate_ai_response_async(
-            text_input, 
-            visual_context=visual_description, 
-            user_obj=vision_user if vision_user else None,
-            ocr_context=ocr_text
-        )
-
-        # Сохраняем ответ
-        if vision_user:
-            await sync_to_async(vision_user.add_message)("assistant", response_text)
-        
-        # Увеличиваем счетчик для аутентифицированных пользователей
-        if user:
-            await sync_to_async(user.increment_request_count)()
-
-        # 6. TTS with Mood
-        mood = vision_user.facts.get('mood', 'neutral') if vision_user else 'neutral'
-        audio_content = await text_to_speech_async(response_text, mood=mood)
-        audio_b64 = None
-        if audio_content:
-            audio_b64 = base64.b64encode(audio_content).decode('utf-8')
-
-        return JsonResponse({
+        return speech_response({
             'message': response_text,
-            'audio': audio_b64,
-            'debug_vision': visual_description,
-            'detected_objects': detected_objects
-        })
+            'debug_vision': ctx['caption'],
+            'detected_objects': detected_objects,
+            'objects': objects_json,
+            'timings': ctx.timings,
+            'tiers': tiers
+        }, audio_content, audio_content_format, binary=audio_format is not None)
 
 def index(request):
     from django.shortcuts import render
     return render(request, 'index.html')
 
 
+def metrics(request):
+    """Счётчики производительности инференса (кэш кадров, батчинг YOLO, память моделей)."""
+    return JsonResponse({
+        'frame_cache': FrameResultCache.global_stats(),
+        'yolo_batcher': DetectionBatcher.get().stats,
+        'whisper_batcher': WhisperBatcher.get().stats,
+        'model_tiers': ModelTiering.get().stats,
+        'vector_memory': VectorMemory.cache_stats(),
+        'models': ModelRegistry.memory_report(),
+        'inference_workers': InferencePool.all_stats(),
+        'executors': ModelExecutors.stats(),
+        'llm': LLMGateway.get().stats,
+        'llm_response_cache': ResponseCache.get().stats,
+        'tts_cache': TTSCache.get().stats,
+    })
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class NavigationView(View):
     """
@@ -342,12 +436,13 @@ class NavigationView(View):
         current_lon = request.POST.get('current_lon')
         
         # Получаем пользователя
-        user_tuple = await sync_to_async(VisionUser.objects.get_or_create)(telegram_id=user_id)
+        user_tuple = await run_in('db', VisionUser.objects.get_or_create, telegram_id=user_id)
         user = user_tuple[0]
         
         # Обработка аудио
+        tiers = track_tiers()
         if audio_file:
-            transcript = await sync_to_async(speech_to_text)(audio_file)
+            transcript = await speech_to_text_async(audio_file)
             if transcript:
                 text_input = f"{text_input} {transcript}".strip()
         
@@ -357,51 +452,40 @@ class NavigationView(View):
         # Используем AI для извлечения адреса из запроса
         destination = await self._extract_destination(text_input)
         
+        audio_format = negotiate_audio_format(request)
+
         if not destination:
             response_text = "Извините, я не смог определить адрес назначения. Попробуйте сказать, например: 'Как дойти до улицы Турусбекова, дом 109'"
-            audio_content = await text_to_speech_async(response_text)
-            audio_b64 = base64.b64encode(audio_content).decode('utf-8') if audio_content else None
-            return JsonResponse({
+            audio_content, audio_content_format = await text_to_speech_as_async(response_text, audio_format=audio_format)
+            return speech_response({
                 'message': response_text,
-                'audio': audio_b64,
                 'destination': None
-            })
+            }, audio_content, audio_content_format, binary=audio_format is not None)
         
         # Возвращаем адрес для построения маршрута на клиенте
         # Клиент использует NavigationService для построения маршрута
         response_text = f"Строю маршрут до {destination}. Подождите..."
-        audio_content = await text_to_speech_async(response_text)
-        audio_b64 = base64.b64encode(audio_content).decode('utf-8') if audio_content else None
+        audio_content, audio_content_format = await text_to_speech_as_async(response_text, audio_format=audio_format)
         
-        return JsonResponse({
+        return speech_response({
             'message': response_text,
-            'audio': audio_b64,
             'destination': destination,
-            'action': 'build_route'
-        })
+            'action': 'build_route',
+            'tiers': tiers
+        }, audio_content, audio_content_format, binary=audio_format is not None)
     
     async def _extract_destination(self, text):
         """
         Использует AI для извлечения адреса из естественного языка.
         """
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
+        gateway = LLMGateway.get()
+        if not gateway.available:
             # Fallback: простой парсинг
             return self._simple_address_extraction(text)
         
-        base_url = "https://api.deepseek.com"
-        model_name = "deepseek-chat"
-        if api_key.startswith("sk-or-v1"):
-            base_url = "https://openrouter.ai/api/v1"
-            model_name = "deepseek/deepseek-chat"
-        
-        from openai import AsyncOpenAI
-        client = AsyncOpenAI(api_key=api_key, base_url=base_url)
-        
         try:
-            response = await client.chat.completions.create(
-                model=model_name,
-                messages=[
+            result = await gateway.chat(
+                [
                     {
                         "role": "system",
                         "content": "Ты помощник для извлечения адресов. Извлеки адрес назначения из запроса пользователя. Верни ТОЛЬКО адрес, без дополнительного текста. Если адрес не найден, верни 'NOT_FOUND'."
@@ -414,7 +498,7 @@ class NavigationView(View):
                 max_tokens=100
             )
             
-            result = response.choices[0].message.content.strip()
+            result = (result or "").strip()
             if result == 'NOT_FOUND' or not result:
                 return None
             return result
@@ -0,0 +1,367 @@
+"""
+Пул процессов для инференса.
+
+Пред- и постобработка YOLO / BLIP / OCR (CLAHE, resize, NMS, токенизация)
+держит GIL, поэтому в одном процессе параллельные запросы мешают друг другу.
+Здесь на каждый тип модели можно поднять отдельные процессы с фиксированным
+числом потоков. Кадры передаются через слоты кольца в
+multiprocessing.shared_memory, а не пиклингом байт; назад приходит только
+компактный результат (Detections, строка).
+
+Включается через settings.INFERENCE_WORKERS, например:
+    {'detect': {'processes': 2, 'threads': 2}, 'caption': {'processes': 1, 'threads': 4}}
+"""
+import asyncio
+import atexit
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Максимальный кадр в слоте: 1280x1280 BGR (больше кадры уже уменьшены Frame)
+DEFAULT_SLOT_BYTES = 1280 * 1280 * 3
+
+
+class SharedFrameRing:
+    """Кольцо из `slots` слотов по `slot_bytes` байт в одном блоке shared memory."""
+
+    def __init__(self, slots: int, slot_bytes: int, name: str = None):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def fits(self, array: np.ndarray) -> bool:
+        return array.nbytes <= self.slot_bytes
+
+    def write(self, slot: int, array: np.ndarray):
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+        view[...] = array
+
+    def read(self, slot: int, shape, dtype) -> np.ndarray:
+        view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=self.shm.buf, offset=slot * self.slot_bytes)
+        return view.copy()
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class InferencePool:
+    """
+    Процессы-воркеры одного типа модели + клиент на futures.
+
+    Клиент берёт свободный слот, пишет в него кадр и ставит задачу в очередь
+    наименее загруженного воркера; поток-слушатель разбирает очередь
+    результатов и завершает futures. Поток-надзиратель следит за процессами:
+    если воркер упал, его задачи завершаются ошибкой, слоты освобождаются,
+    а процесс перезапускается. Кольцо shared memory закрывается в shutdown,
+    который регистрируется в atexit.
+    """
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, kind: str, processes: int = 1, threads: int = 1, slots: int = None,
+                 slot_bytes: int = DEFAULT_SLOT_BYTES, batch: int = 8, timeout: float = 30.0,
+                 monitor_interval: float = 1.0):
+        if kind not in WORKER_TASKS:
+            raise ValueError(f"Unknown inference worker type '{kind}'")
+
+        self.kind = kind
+        self.timeout = timeout
+        self.monitor_interval = monitor_interval
+        self.threads = threads
+        self.batch = batch
+        slots = slots or processes * 4
+        self.ring = SharedFrameRing(slots, slot_bytes)
+        self._free_slots = queue.Queue()
+        for slot in range(slots):
+            self._free_slots.put(slot)
+
+        self._ctx = mp.get_context("spawn")
+        self._results = self._ctx.Queue()
+        # request_id -> (future, slot, номер воркера)
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count()
+        self._closed = False
+        self._restarts = 0
+
+        # Своя очередь задач у каждого воркера: при падении процесса точно известно, какие задачи пропали
+        self._workers = [self._start_worker(i) for i in range(processes)]
+        self._load = [0] * processes
+
+        self._listener = threading.Thread(target=self._listen, name=f"inference-{kind}-results", daemon=True)
+        self._listener.start()
+        self._monitor = threading.Thread(target=self._watch, name=f"inference-{kind}-monitor", daemon=True)
+        self._monitor.start()
+        atexit.register(self.shutdown)
+        logger.info(f"Inference pool '{kind}': {processes} processes x {threads} threads, {slots} slots")
+
+    @classmethod
+    def get(cls, kind: str):
+        """Пул для типа модели или None, если он не включён в settings.INFERENCE_WORKERS."""
+        if kind in cls._pools:
+            return cls._pools[kind]
+        from django.conf import settings
+        config = getattr(settings, 'INFERENCE_WORKERS', {}).get(kind)
+        with cls._pools_lock:
+            if kind not in cls._pools:
+                cls._pools[kind] = cls(kind, **config) if config else None
+        return cls._pools[kind]
+
+    @classmethod
+    def all_stats(cls):
+        return {kind: pool.stats for kind, pool in cls._pools.items() if pool is not None}
+
+    def submit(self, array: np.ndarray, options: dict = None, block: bool = True) -> Future:
+        """
+        Отправляет кадр воркерам. Если все слоты заняты, ждёт освобождения не дольше
+        timeout (TimeoutError), а с block=False сразу бросает queue.Empty.
+        options — параметры обработчика (уровень модели, см. vision/tiering.py).
+        """
+        if self._closed:
+            raise RuntimeError(f"Inference pool '{self.kind}' is shut down")
+        future = Future()
+        array = np.ascontiguousarray(array)
+
+        if self.ring.fits(array):
+            try:
+                slot = self._free_slots.get(block=block, timeout=self.timeout if block else None)
+            except queue.Empty:
+                if not block:
+                    raise
+                raise TimeoutError(f"No free frame slots in inference pool '{self.kind}'") from None
+            self.ring.write(slot, array)
+            payload = (slot, array.shape, array.dtype.str)
+        else:
+            # Редкий случай: кадр больше слота — передаём обычным пиклингом
+            slot = None
+            payload = (None, None, array)
+
+        with self._pending_lock:
+            if self._closed:
+                if slot is not None:
+                    self._free_slots.put(slot)
+                raise RuntimeError(f"Inference pool '{self.kind}' is shut down")
+            request_id = next(self._ids)
+            worker = min(range(len(self._workers)), key=self._load.__getitem__)
+            self._load[worker] += 1
+            self._pending[request_id] = (future, slot, worker)
+            # Под блокировкой: надзиратель не заменит очередь воркера между выбором и отправкой
+            self._workers[worker][1].put((request_id,) + payload + (options or {},))
+        return future
+
+    async def run(self, array: np.ndarray, options: dict = None):
+        """Async-клиент: ждёт результат воркера, не блокируя event loop."""
+        try:
+            future = self.submit(array, options, block=False)
+        except queue.Empty:
+            # Все слоты заняты — ждём слот в потоке, а не в event loop
+            future = await asyncio.to_thread(self.submit, array, options)
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+
+    @property
+    def pending(self) -> int:
+        with self._pending_lock:
+            return len(self._pending)
+
+    @property
+    def stats(self):
+        with self._pending_lock:
+            pending = len(self._pending)
+            processes = sum(process.is_alive() for process, _ in self._workers)
+        return {
+            "processes": processes,
+            "pending": pending,
+            "free_slots": self._free_slots.qsize(),
+            "restarts": self._restarts,
+        }
+
+    def shutdown(self):
+        with self._pending_lock:
+            if self._closed:
+                return
+            self._closed = True
+            workers = list(self._workers)
+            pending = list(self._pending.values())
+            self._pending.clear()
+
+        for _, tasks in workers:
+            tasks.put(None)
+        for process, _ in workers:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+                process.join(timeout=1)
+        for future, _, _ in pending:
+            if not future.done():
+                future.set_exception(RuntimeError(f"Inference pool '{self.kind}' is shut down"))
+        self._results.put(None)
+        self.ring.close()
+        atexit.unregister(self.shutdown)
+
+    def _start_worker(self, index):
+        tasks = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(self.kind, self.ring.name, self.ring.slots, self.ring.slot_bytes, tasks, self._results,
+                  self.threads, self.batch),
+            name=f"inference-{self.kind}-{index}",
+            daemon=True,
+        )
+        process.start()
+        return process, tasks
+
+    def _watch(self):
+        while not self._closed:
+            time.sleep(self.monitor_interval)
+            for index in range(len(self._workers)):
+                process, _ = self._workers[index]
+                if process.is_alive() or self._closed:
+                    continue
+                self._restart(index, process.exitcode)
+
+    def _restart(self, index, exitcode):
+        with self._pending_lock:
+            if self._closed:
+                return
+            lost = [(request_id, entry) for request_id, entry in self._pending.items() if entry[2] == index]
+            for request_id, _ in lost:
+                del self._pending[request_id]
+            self._load[index] = 0
+            # Задачи, оставшиеся в очереди мёртвого воркера, уже завершены ошибкой — очередь новая
+            self._workers[index] = self._start_worker(index)
+            self._restarts += 1
+
+        logger.error(f"Inference worker '{self.kind}-{index}' died (exit code {exitcode}), "
+                     f"failed {len(lost)} requests, restarted")
+        error = RuntimeError(f"Inference worker '{self.kind}-{index}' died (exit code {exitcode})")
+        for _, (future, slot, _) in lost:
+            # Мёртвый процесс больше не прочитает слот — его можно отдавать снова
+            if slot is not None:
+                self._free_slots.put(slot)
+            if not future.done():
+                future.set_exception(error)
+
+    def _listen(self):
+        while True:
+            message = self._results.get()
+            if message is None:
+                break
+            request_id, ok, value = message
+            with self._pending_lock:
+                future, slot, worker = self._pending.pop(request_id, (None, None, None))
+                if worker is not None:
+                    self._load[worker] -= 1
+            if slot is not None:
+                self._free_slots.put(slot)
+            if future is None or future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(RuntimeError(value))
+
+
+def _worker_main(kind, shm_name, slots, slot_bytes, tasks, results, threads, batch):
+    # Число потоков фиксируем ДО импорта torch / onnxruntime / cv2
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+
+    import django
+    django.setup()
+    import torch
+    torch.set_num_threads(threads)
+    import cv2
+    cv2.setNumThreads(threads)
+
+    handler = WORKER_TASKS[kind]
+    ring = SharedFrameRing(slots, slot_bytes, name=shm_name)
+
+    while True:
+        items = [tasks.get()]
+        # Забираем всё, что уже накопилось в очереди, — воркер обрабатывает это одним батчем
+        while len(items) < batch and items[-1] is not None:
+            try:
+                items.append(tasks.get_nowait())
+            except queue.Empty:
+                break
+
+        stop = items[-1] is None
+        items = [item for item in items if item is not None]
+
+        # Кадры с разными параметрами (уровнями моделей) — отдельными вызовами обработчика
+        groups = {}
+        for request_id, slot, shape, data, options in items:
+            image = ring.read(slot, shape, data) if slot is not None else data
+            ids, images = groups.setdefault(tuple(sorted(options.items())), ([], []))
+            ids.append(request_id)
+            images.append(image)
+
+        for options, (ids, images) in groups.items():
+            try:
+                outputs = handler(images, **dict(options))
+                for request_id, output in zip(ids, outputs):
+                    results.put((request_id, True, output))
+            except Exception as e:
+                for request_id in ids:
+                    results.put((request_id, False, f"{type(e).__name__}: {e}"))
+
+        if stop:
+            break
+
+    ring.close()
+
+
+def _detect_batch(images, model=None, imgsz=None):
+    from .services import LocalBrain, detections_from_result, prepare_detection_image
+    detector = LocalBrain.get_yolo_model(model)
+    prepared = [prepare_detection_image(image) for image in images]
+    options = {'imgsz': imgsz} if imgsz else {}
+    results = detector.predict(prepared, conf=0.3, iou=0.45, verbose=False, **options)
+    return [detections_from_result(result) for result in results]
+
+
+def _caption_batch(images, max_new_tokens=50):
+    from .frame import Frame
+    from .services import LocalBrain
+    import torch
+
+    processor, model = LocalBrain.get_vision_model()
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    inputs = processor(images=[Frame(image).pil for image in images], return_tensors="pt").to(device)
+    out = model.generate(**inputs, max_new_tokens=max_new_tokens)
+    return processor.batch_decode(out, skip_special_tokens=True)
+
+
+def _ocr_batch(images):
+    from .services import read_text_local
+    from .frame import Frame
+    return [read_text_local(Frame(image), raise_errors=True) for image in images]
+
+
+WORKER_TASKS = {
+    "detect": _detect_batch,
+    "caption": _caption_batch,
+    "ocr": _ocr_batch,
+}
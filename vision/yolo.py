@@ -1,15 +1,14 @@
-from ultralytics import YOLO
-import os
-
 class YOLOModel:
-    _instance = None
+    """Совместимость со старым API: модель берётся из общего ModelRegistry."""
 
     @classmethod
     def get_instance(cls):
-        if cls._instance is None:
-            # Загружаем модель один раз
-            cls._instance = YOLO('yolov8n.pt')
-        return cls._instance
+        from .services import LocalBrain
+        return LocalBrain.get_yolo_model()
+
 
-# Загружаем модель заранее
-model = YOLOModel.get_instance()
+def __getattr__(name):
+    # `from vision.yolo import model` больше не грузит отдельную копию YOLO при импорте
+    if name == 'model':
+        return YOLOModel.get_instance()
+    raise AttributeError(name)
@@ -17,9 +17,16 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 import django
 django.setup()
 
-from vision.services import detect_objects_local, analyze_image_local, generate_ai_response_async, text_to_speech_async
+from vision.services import transcribe_pcm_async, detect_async, analyze_image_async, generate_ai_response_async, text_to_speech_as_async, speak_response_stream, detections_from_result, CAPTION_FAILED
 from vision.models import VisionUser
-from asgiref.sync import sync_to_async
+from vision.frame import Frame
+from vision.frame_cache import FrameResultCache
+from vision.tracking import ObjectTracker
+from vision.motion import MotionGate
+from django.conf import settings
+from vision.executors import run_in
+from vision.stt_stream import StreamingTranscriber
+from vision.tts_system.audio import AUDIO_FORMATS, normalize_format
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("WayFinderWS")
@@ -46,71 +53,220 @@ class ConnectionManager:
 
 manager = ConnectionManager()
 
+DANGER_OBJECTS = {'car', 'truck', 'bus', 'motorcycle', 'bicycle', 'person'}
+
+async def send_audio(websocket: WebSocket, payload: dict, audio: bytes, audio_format: str, binary: bool,
+                     lock: asyncio.Lock):
+    """
+    binary=True: JSON-кадр с метаданными (audio: формат, mime, размер), следом бинарный кадр с аудио.
+    Иначе — как раньше, один JSON-кадр с аудио в base64.
+    lock — блокировка отправки соединения: пара метаданные + аудио уходит без вклинивания
+    кадров от параллельных задач (ответы STT и основной цикл пишут в один сокет).
+    """
+    if not binary or not audio:
+        payload["audio"] = base64.b64encode(audio).decode('utf-8') if audio else None
+        async with lock:
+            await websocket.send_text(json.dumps(payload))
+        return
+    payload["audio"] = {
+        "format": audio_format,
+        "mime": AUDIO_FORMATS[audio_format].mime if audio_format in AUDIO_FORMATS else None,
+        "bytes": len(audio),
+    }
+    async with lock:
+        await websocket.send_text(json.dumps(payload))
+        await websocket.send_bytes(audio)
+
 @app.websocket("/ws/vision/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
     await manager.connect(websocket)
     logger.info(f"User {user_id} connected via WebSocket")
     
     # Get or create vision user
-    vision_user_tuple = await sync_to_async(VisionUser.objects.get_or_create)(telegram_id=user_id)
+    vision_user_tuple = await run_in('db', VisionUser.objects.get_or_create, telegram_id=user_id)
     vision_user = vision_user_tuple[0]
+    # Соседние кадры неподвижного пользователя почти одинаковые — отвечаем из кэша
+    frame_cache = FrameResultCache.for_user(user_id)
+    # Трекер соединения: стабильные ID объектов и отправка только изменений
+    tracker = ObjectTracker()
+    detect_every = max(getattr(settings, 'WS_DETECT_EVERY_N', 1), 1)
+    frame_index = 0
+    motion_gates = {}
+
+    # Последняя обработанная сцена — контекст для голосовых вопросов
+    scene = {"frame": None, "detections": None}
+    # Настройки голосового ввода (сообщение {"type": "audio_start", ...})
+    voice = {"audio_format": None, "stream": False}
+    # Все отправки в сокет — под одной блокировкой (см. send_audio)
+    send_lock = asyncio.Lock()
+
+    async def send_json(payload):
+        async with send_lock:
+            await websocket.send_text(json.dumps(payload))
+
+    def add_scene_state(response_data, detections):
+        # Текущее состояние сцены — в каждом ответе, а не только при изменениях:
+        # стоящая рядом машина остаётся опасностью, и клиент восстанавливается после пропущенного кадра.
+        # Последние детекции (порог YOLO) + живые треки: новая опасность сигналится с первого кадра,
+        # не дожидаясь подтверждения трека
+        labels = set(tracker.active_labels())
+        if detections is not None:
+            labels.update(detections.unique_labels())
+        response_data["detected_objects"] = sorted(labels)
+        # Check for danger (simplified: car, truck, bus, motorcycle nearby)
+        response_data["is_danger"] = bool(labels & DANGER_OBJECTS)
+
+    async def answer(text_input, frame, detections, response_data, audio_format, stream):
+        """Описание сцены / ответ LLM + TTS. Возвращает (аудио, формат) для send_audio."""
+        visual_description = None
+        if frame is not None:
+            # Comprehensive analysis
+            visual_description = await frame_cache.get_or_compute(
+                frame, 'caption', lambda: analyze_image_async(frame, raise_errors=True), fallback=CAPTION_FAILED
+            )
+        labels = detections.unique_labels() if detections is not None else None
+
+        if text_input and stream:
+            # Потоковый ответ: каждое предложение озвучивается и уходит клиенту сразу,
+            # пока LLM генерирует следующие
+            sentences = []
+            async for index, sentence, audio, fmt in speak_response_stream(
+                text_input,
+                visual_context=visual_description,
+                user_obj=vision_user,
+                mood=(vision_user.facts or {}).get('mood', 'neutral'),
+                detected_objects=labels,
+                audio_format=audio_format
+            ):
+                sentences.append(sentence)
+                chunk = {"type": "audio_chunk", "index": index, "text": sentence}
+                await send_audio(websocket, chunk, audio, fmt, binary=audio_format is not None, lock=send_lock)
+            response_data["message"] = " ".join(sentences)
+        elif text_input:
+            # LLM Response
+            ai_response = await generate_ai_response_async(
+                text_input, 
+                visual_context=visual_description, 
+                user_obj=vision_user,
+                detected_objects=labels
+            )
+            response_data["message"] = ai_response
+            
+            # TTS
+            mood = (vision_user.facts or {}).get('mood', 'neutral')
+            return await text_to_speech_as_async(ai_response, mood=mood, audio_format=audio_format)
+        else:
+            response_data["message"] = visual_description
+        return None, None
+
+    async def send_reply(response_data, reply_audio, audio_format):
+        if reply_audio[0]:
+            await send_audio(websocket, response_data, *reply_audio, binary=audio_format is not None,
+                             lock=send_lock)
+        else:
+            await send_json(response_data)
+
+    async def on_transcript(event):
+        # partial / final текст сразу клиенту; по концу фразы — ответ по последней сцене
+        await send_json(event)
+        if event["final"] and event["text"]:
+            response_data = {"type": "answer", "transcript": event["text"]}
+            reply_audio = await answer(
+                event["text"], scene["frame"], scene["detections"], response_data,
+                voice["audio_format"], voice["stream"]
+            )
+            await send_reply(response_data, reply_audio, voice["audio_format"])
+
+    stt = StreamingTranscriber(transcribe_pcm_async, on_transcript, **getattr(settings, 'STT_STREAM', {}))
 
     try:
         while True:
             # Receive data from client
-            # Expected format: {"image": "base64...", "text": "...", "mode": "..."}
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            # Expected format: {"image": "base64...", "text": "...", "mode": "...", "stream": false, "audio_format": null}
+            # Бинарные кадры — голос: PCM 16 kHz int16 mono (потоковый STT)
+            packet = await websocket.receive()
+            if packet["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(packet.get("code", 1000))
+            if packet.get("bytes") is not None:
+                await stt.feed(packet["bytes"])
+                continue
+
+            message = json.loads(packet["text"])
+            if message.get("type") == "audio_start":
+                voice["audio_format"] = normalize_format(message.get("audio_format"))
+                voice["stream"] = bool(message.get("stream"))
+                continue
+            if message.get("type") == "audio_end":
+                stt.flush()
+                continue
             
             image_b64 = message.get("image")
             text_input = message.get("text", "")
             mode = message.get("mode", "navigator")
+            # "audio_format": "opus" | "mp3" | "wav" — аудио приходит отдельным бинарным кадром
+            audio_format = normalize_format(message.get("audio_format"))
             
             response_data = {}
+            reply_audio = (None, None)
             
             if image_b64:
-                # Process image
+                needs_analysis = mode == "vision" or bool(text_input)
+                # Полная детекция раз в WS_DETECT_EVERY_N кадров, между ними треки
+                # продвигаются предсказанием без инференса
+                run_detection = needs_analysis or frame_index % detect_every == 0
+                frame_index += 1
+
                 image_bytes = base64.b64decode(image_b64)
+
+                # Motion gate: сцена не изменилась — детектор не запускаем
+                if run_detection and not needs_analysis:
+                    if mode not in motion_gates:
+                        motion_gates[mode] = MotionGate.for_mode(mode, getattr(settings, 'MOTION_GATE', {}))
+                    thumbnail = MotionGate.thumbnail_from_bytes(image_bytes)
+                    run_detection = motion_gates[mode].should_run(thumbnail)
+
+                if not run_detection:
+                    tracker.predict()
+                    # Детектор на этом кадре не запускался — последняя детекция сцены
+                    add_scene_state(response_data, scene["detections"])
+                    await send_json(response_data)
+                    continue
+
+                # Process image: декодируем один раз, кадр общий для YOLO и BLIP
+                frame = await run_in('decode', Frame.from_bytes, image_bytes, max_dim=1280)
                 
-                # 1. Fast YOLO for HUD
-                detected_objects = await sync_to_async(detect_objects_local)(image_bytes)
-                response_data["detected_objects"] = detected_objects
-                
-                # Check for danger (simplified: car, truck, bus, motorcycle nearby)
-                danger_objs = {'car', 'truck', 'bus', 'motorcycle', 'bicycle', 'person'}
-                is_danger = any(obj in danger_objs for obj in detected_objects)
-                response_data["is_danger"] = is_danger
+                # 1. Fast YOLO for HUD (общая батчевая очередь с HTTP API)
+                detections = await frame_cache.get_or_compute(
+                    frame, 'detect', lambda: detect_async(frame, raise_errors=True),
+                    fallback=detections_from_result(None)
+                )
+                delta = tracker.update(detections.xyxy, detections.conf, detections.labels)
+
+                add_scene_state(response_data, detections)
+                # Треки — только изменения сцены: новые / пропавшие / сдвинувшиеся объекты
+                if delta:
+                    response_data["tracks"] = delta.to_dict()
                 
+                scene["frame"], scene["detections"] = frame, detections
+
                 if mode == "vision" or text_input:
-                    # Comprehensive analysis
-                    visual_description = await sync_to_async(analyze_image_local)(image_bytes)
-                    
-                    if text_input:
-                        # LLM Response
-                        ai_response = await generate_ai_response_async(
-                            text_input, 
-                            visual_context=visual_description, 
-                            user_obj=vision_user
-                        )
-                        response_data["message"] = ai_response
-                        
-                        # TTS
-                        mood = vision_user.facts.get('mood', 'neutral')
-                        audio_content = await text_to_speech_async(ai_response, mood=mood)
-                        if audio_content:
-                            response_data["audio"] = base64.b64encode(audio_content).decode('utf-8')
-                    else:
-                        response_data["message"] = visual_description
+                    reply_audio = await answer(
+                        text_input, frame, detections, response_data, audio_format, message.get("stream")
+                    )
             
             # Send result back
-            await websocket.send_text(json.dumps(response_data))
+            await send_reply(response_data, reply_audio, audio_format)
 
     except WebSocketDisconnect:
         manager.disconnect(websocket)
         logger.info(f"User {user_id} disconnected")
+        for mode, gate in motion_gates.items():
+            logger.info(f"Motion gate [{mode}] for {user_id}: {gate.stats} (skip rate {gate.skip_rate:.0%})")
     except Exception as e:
         logger.error(f"Error in websocket loop: {e}")
         manager.disconnect(websocket)
+    finally:
+        await stt.close()
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8001)